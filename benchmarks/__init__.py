@@ -0,0 +1,28 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Performance benchmarks for charms.reactive.
+
+Each module in this package is a standalone benchmark which can be run with,
+for example::
+
+    python -m benchmarks.dispatch --help
+
+They generate synthetic charms on disk and run the framework against them
+with a faked hook environment, so they don't need a Juju controller.
+"""
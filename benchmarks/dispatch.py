@@ -0,0 +1,140 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark :func:`~charms.reactive.bus.discover`,
+:func:`~charms.reactive.bus.dispatch` and :func:`~charms.reactive.main`
+against a synthetic charm.
+
+Run with::
+
+    python -m benchmarks.dispatch --layers 10 --handlers 50 --flags 200
+"""
+
+import argparse
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from charmhelpers.core import hookenv
+
+import charms.reactive
+from charms.reactive import bus
+
+from benchmarks import harness
+from benchmarks import synthetic
+
+
+def run_benchmark(charm_dir, hook_name='update-status', repeat=5, warm=False):
+    """
+    Run the benchmark against the charm in ``charm_dir``.
+
+    Each timed run starts as a fresh hook process would, with the handlers
+    re-discovered and re-imported.  Call counts and peak memory are measured
+    in separate runs, so that the instrumentation doesn't skew the timings.
+
+    :param bool warm: If True, time a hook run after one has already
+        completed against the same unit state, such as ``update-status``
+        on an established unit, rather than the very first hook.
+    :return: A tuple of the summarized timings and other measurements.
+    """
+    timings = OrderedDict((name, []) for name in ('discover', 'dispatch', 'main'))
+    with harness.HookEnvironment(charm_dir, hook_name) as env:
+        def prepare():
+            env.reset(fresh_state=True)
+            if warm:
+                charms.reactive.main()
+                env.reset()
+
+        for i in range(repeat):
+            prepare()
+            timings['discover'].append(harness.timed(bus.discover))
+            hookenv._run_atstart()
+            timings['dispatch'].append(harness.timed(bus.dispatch))
+            prepare()
+            timings['main'].append(harness.timed(charms.reactive.main))
+
+        prepare()
+        with harness.instrument(
+                (bus.FlagWatch, 'iteration', 'iterations'),
+                (bus.Handler, 'test', 'handler tests'),
+                (bus.Handler, 'invoke', 'handler invocations')) as stats:
+            charms.reactive.main()
+        counts = dict(stats.calls)
+        counts['handlers'] = len(bus.Handler.get_handlers())
+
+        prepare()
+        counts['peak memory (KiB)'] = harness.peak_memory(charms.reactive.main) // 1024
+
+    return OrderedDict((name, harness.summarize(samples))
+                       for name, samples in timings.items()), counts
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--layers', type=int, default=5,
+                        help='Number of layers (handler modules)')
+    parser.add_argument('--handlers', type=int, default=20,
+                        help='Number of handlers per layer')
+    parser.add_argument('--flags', type=int, default=50,
+                        help='Number of distinct flags used by the handlers')
+    parser.add_argument('--chains', type=int, default=2,
+                        help='Number of trigger chains')
+    parser.add_argument('--chain-length', type=int, default=5,
+                        help='Number of flags in each trigger chain')
+    parser.add_argument('--hook', default='update-status',
+                        help='Name of the hook to run')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for generating the charm')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed runs')
+    parser.add_argument('--warm', action='store_true',
+                        help='Time a hook on a unit which has already run one')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    opts = parser.parse_args(args)
+
+    params = OrderedDict([
+        ('layers', opts.layers),
+        ('handlers', opts.handlers),
+        ('flags', opts.flags),
+        ('chains', opts.chains),
+        ('chain_length', opts.chain_length),
+        ('hook', opts.hook),
+        ('seed', opts.seed),
+        ('warm', opts.warm),
+    ])
+    charm_dir = tempfile.mkdtemp(prefix='reactive-bench-charm-')
+    try:
+        synthetic.generate_charm(charm_dir,
+                                 layers=opts.layers,
+                                 handlers=opts.handlers,
+                                 flags=opts.flags,
+                                 chains=opts.chains,
+                                 chain_length=opts.chain_length,
+                                 hook_name=opts.hook,
+                                 seed=opts.seed)
+        timings, counts = run_benchmark(charm_dir, opts.hook,
+                                        repeat=opts.repeat, warm=opts.warm)
+    finally:
+        shutil.rmtree(charm_dir)
+    harness.report([harness.result('dispatch', params, timings, counts)],
+                   as_json=opts.json)
+
+
+if __name__ == '__main__':
+    main()
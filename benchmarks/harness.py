@@ -0,0 +1,277 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Helpers shared by the benchmarks: a fake hook environment, timing, call
+counting and reporting.
+"""
+
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+import mock
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+
+import charms.reactive  # noqa (registers the framework's atstart callbacks)
+from charms.reactive import bus
+from charms.reactive.endpoints import Endpoint
+
+
+# the atstart callbacks registered when the framework is imported, which
+# need to be put back before every run, as hookenv drops them once run
+_FRAMEWORK_ATSTART = list(hookenv._atstart)
+
+# packages that discover() imports from the charm
+_CHARM_PACKAGES = ('reactive', 'relations')
+
+
+class HookEnvironment(object):
+    """
+    Fake hook execution environment for a charm on disk.
+
+    This sets up the environment variables that Juju would provide, replaces
+    :func:`hookenv.log` with an in-memory list, and points
+    :func:`unitdata.kv` at a real on-disk database.  :meth:`reset` puts the
+    framework back into the state of a freshly started hook process, so that
+    every run re-discovers and re-imports the charm's handlers.
+
+    :param str charm_dir: Path to the charm.
+    :param str hook_name: Name of the hook to pretend to run.
+    :param dict env: Additional environment variables to set.
+    """
+    def __init__(self, charm_dir, hook_name='update-status', env=None):
+        self.charm_dir = charm_dir
+        self.hook_name = hook_name
+        self.env = env or {}
+        self.log = []
+        self.state_dir = None
+        self._state_count = 0
+        self._patches = []
+
+    def __enter__(self):
+        self.state_dir = tempfile.mkdtemp(prefix='reactive-bench-')
+        self._saved_path = list(sys.path)
+        environ = dict(self.env,
+                       CHARM_DIR=self.charm_dir,
+                       JUJU_CHARM_DIR=self.charm_dir,
+                       JUJU_HOOK_NAME=self.hook_name,
+                       JUJU_UNIT_NAME='synthetic/0')
+        self._patches = [
+            mock.patch.dict(os.environ, environ),
+            mock.patch.object(hookenv, 'log', self._log),
+        ]
+        for patch in self._patches:
+            patch.start()
+        self.reset(fresh_state=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._close_storage()
+        for patch in reversed(self._patches):
+            patch.stop()
+        sys.path[:] = self._saved_path
+        self._purge_modules()
+        bus.Handler.clear()
+        hookenv.cache.clear()
+        shutil.rmtree(self.state_dir)
+
+    def _log(self, message, level=None):
+        self.log.append((level, message))
+
+    def _close_storage(self):
+        if unitdata._KV is not None:
+            unitdata._KV.conn.close()
+        unitdata._KV = None
+
+    def _purge_modules(self):
+        for name in list(sys.modules):
+            if name.split('.')[0] in _CHARM_PACKAGES:
+                del sys.modules[name]
+
+    def reset(self, fresh_state=False):
+        """
+        Reset the framework's in-process state before the next run.
+
+        :param bool fresh_state: If True, also switch to a new, empty unit
+            state database.  Otherwise, the flags and other data written by
+            the previous run are kept, as they would be between hooks.
+        """
+        self._close_storage()
+        if fresh_state:
+            self._state_count += 1
+            os.environ['UNIT_STATE_DB'] = os.path.join(
+                self.state_dir, 'state-{}.db'.format(self._state_count))
+        self._purge_modules()
+        bus.Handler.clear()
+        Endpoint._endpoints = {}
+        hookenv._atstart[:] = [(_rebind(callback), args, kwargs)
+                               for callback, args, kwargs in _FRAMEWORK_ATSTART]
+        del hookenv._atexit[:]
+        hookenv.cache.clear()
+        del self.log[:]
+
+
+def _rebind(callback):
+    # look up class methods again, so that they can be instrumented
+    owner = getattr(callback, '__self__', None)
+    if owner is None:
+        return callback
+    return getattr(owner, callback.__name__)
+
+
+def timed(func, *args, **kwargs):
+    """
+    Call ``func`` and return the elapsed wall-clock time in seconds.
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def peak_memory(func, *args, **kwargs):
+    """
+    Call ``func`` and return the peak memory allocated during the call, in
+    bytes, as seen by :mod:`tracemalloc`.
+    """
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class CallStats(object):
+    """
+    Number of calls made to, and total time spent in, instrumented callables.
+
+    Times are inclusive, so they overlap if one instrumented callable calls
+    another.
+    """
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+
+
+@contextmanager
+def instrument(*targets):
+    """
+    Count and time the calls made to the given attributes while the context
+    is active.
+
+    Each target is an ``(obj, attribute_name, name)`` tuple.  Plain
+    functions, methods, classmethods and properties are supported.  Yields a
+    :class:`CallStats`, keyed by name.
+    """
+    stats = CallStats()
+
+    def instrumented(name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.calls[name] += 1
+                stats.seconds[name] += time.perf_counter() - start
+        return wrapper
+
+    patches = []
+    for obj, attr, name in targets:
+        original = obj.__dict__.get(attr, getattr(obj, attr))
+        if isinstance(original, classmethod):
+            replacement = classmethod(instrumented(name, original.__func__))
+        elif isinstance(original, staticmethod):
+            replacement = staticmethod(instrumented(name, original.__func__))
+        elif isinstance(original, property):
+            replacement = property(instrumented(name, original.fget),
+                                   original.fset, original.fdel,
+                                   original.__doc__)
+        else:
+            replacement = instrumented(name, original)
+        patches.append(mock.patch.object(obj, attr, replacement))
+    for patch in patches:
+        patch.start()
+    try:
+        yield stats
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+
+def summarize(samples):
+    """
+    Summarize a list of timings, in seconds.
+    """
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'max': ordered[-1],
+    }
+
+
+def result(title, params, timings, counts):
+    """
+    Collect the results of a benchmark run.
+
+    :param str title: Name of the benchmark.
+    :param dict params: Parameters the benchmark was run with.
+    :param dict timings: Summarized timings, keyed by what was timed.
+    :param dict counts: Other measurements, such as call counts.
+    """
+    return {
+        'benchmark': title,
+        'params': params,
+        'timings': timings,
+        'counts': counts,
+    }
+
+
+def report(results, as_json=False, out=sys.stdout):
+    """
+    Write a list of benchmark results, either as readable tables or as JSON.
+    """
+    if as_json:
+        json.dump(results, out, indent=2, sort_keys=True)
+        out.write('\n')
+        return
+    for res in results:
+        out.write('{}: {}\n'.format(res['benchmark'], ' '.join(
+            '{}={}'.format(key, value) for key, value in res['params'].items())))
+        for name, stats in res['timings'].items():
+            out.write('  {:<32} min {:>10}  median {:>10}  max {:>10}\n'.format(
+                name, _format_seconds(stats['min']),
+                _format_seconds(stats['median']),
+                _format_seconds(stats['max'])))
+        for name, value in sorted(res['counts'].items()):
+            out.write('  {:<32} {}\n'.format(name, value))
+
+
+def _format_seconds(seconds):
+    return '{:.2f}ms'.format(seconds * 1000)
@@ -0,0 +1,130 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Stand-ins for the Juju relation hook tools, for the benchmarks.
+
+:func:`install` writes ``relation-ids``, ``relation-list``, ``relation-get``
+and ``relation-set`` executables into a directory, to be put on the ``PATH``.
+They answer from a JSON model of the relations, sleep for a configurable
+time on every call to simulate the round trip to the Juju agent, and log
+each call so that the benchmark can count them.
+
+This module is also the implementation of the tools, so it must only import
+what a hook tool needs in order to start quickly.
+"""
+
+import json
+import os
+import sys
+import time
+
+
+TOOLS = ('relation-ids', 'relation-list', 'relation-get', 'relation-set')
+
+_SCRIPT = '''\
+#!{python} -S
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks.hooktools import run
+sys.exit(run({tool!r}, sys.argv[1:]))
+'''
+
+
+def install(bin_dir, model_path, calls_path):
+    """
+    Write the stand-in tools into ``bin_dir``.
+
+    :param str model_path: Path of the JSON model that the tools answer from,
+        as written by :func:`write_model`.
+    :param str calls_path: Path of the file that each call is logged to.
+    :return: The environment variables the tools need.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for tool in TOOLS:
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as fp:
+            fp.write(_SCRIPT.format(python=sys.executable, root=root, tool=tool))
+        os.chmod(path, 0o755)
+    return {
+        'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+        'REACTIVE_BENCH_MODEL': model_path,
+        'REACTIVE_BENCH_CALLS': calls_path,
+    }
+
+
+def write_model(model_path, relations):
+    """
+    Write the relations model.
+
+    :param dict relations: Mapping of relation IDs to mappings of the remote
+        units' names to their relation data.
+    """
+    with open(model_path, 'w') as fp:
+        json.dump(relations, fp)
+
+
+def count_calls(calls_path):
+    """
+    Return a dict of the number of calls made to each tool, and reset the log.
+    """
+    counts = dict.fromkeys(TOOLS, 0)
+    if os.path.exists(calls_path):
+        with open(calls_path) as fp:
+            for line in fp:
+                counts[line.strip()] += 1
+        os.remove(calls_path)
+    return counts
+
+
+def run(tool, args):
+    """
+    Entry point of the stand-in tools.
+    """
+    latency = float(os.environ.get('REACTIVE_BENCH_LATENCY') or 0)
+    if latency:
+        time.sleep(latency)
+    with open(os.environ['REACTIVE_BENCH_CALLS'], 'a') as fp:
+        fp.write(tool + '\n')
+    if args == ['--help']:
+        # relation_set() checks for this, to decide how to pass the data
+        sys.stdout.write('usage: relation-set [options] key=value [key=value ...]\n'
+                         '    --file  (= ) file containing key-value pairs\n')
+        return 0
+    if tool == 'relation-set':
+        return 0
+
+    with open(os.environ['REACTIVE_BENCH_MODEL']) as fp:
+        relations = json.load(fp)
+    args = [arg for arg in args if arg != '--format=json']
+    rid = None
+    if '-r' in args:
+        i = args.index('-r')
+        rid = args[i + 1]
+        del args[i:i + 2]
+
+    if tool == 'relation-ids':
+        name = args[0]
+        result = sorted(r for r in relations if r.split(':')[0] == name)
+    elif tool == 'relation-list':
+        result = sorted(relations.get(rid, {}))
+    else:
+        attribute, unit = (args + ['-', None])[:2]
+        data = relations.get(rid, {}).get(unit, {})
+        result = data if attribute == '-' else data.get(attribute)
+    json.dump(result, sys.stdout)
+    return 0
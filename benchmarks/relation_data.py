@@ -0,0 +1,209 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark the endpoint relation data path: :meth:`Endpoint._startup
+<charms.reactive.endpoints.Endpoint._startup>` and ``_manage_flags``,
+:attr:`~charms.reactive.endpoints.Endpoint.all_units`,
+:attr:`CombinedUnitsView.received
+<charms.reactive.endpoints.CombinedUnitsView.received>` and publishing with
+``Relation._flush_data``.
+
+The relation hook tools are replaced with local stand-ins (see
+:mod:`benchmarks.hooktools`), and the benchmark sweeps over the number of
+relations, units per relation and keys per unit.  Run with::
+
+    python -m benchmarks.relation_data --relations 1,10 --units 1,10 --keys 10
+
+Note that the stand-in tools are Python scripts, so each call costs a
+Python interpreter start-up on top of ``--latency``.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import charms.reactive
+from charms.reactive import endpoints
+
+from benchmarks import harness
+from benchmarks import hooktools
+from benchmarks import synthetic
+
+
+ENDPOINT = 'bench'
+
+_METADATA = '''\
+name: synthetic
+summary: synthetic charm
+description: synthetic charm
+requires:
+  {endpoint}:
+    interface: bench
+'''
+
+_INTERFACE = '''\
+from charms.reactive import Endpoint, when
+
+
+class BenchRequires(Endpoint):
+    @when('endpoint.{endpoint_name}.changed')
+    def handle_changed(self):
+        received = self.all_units.received
+        for relation in self.relations:
+            relation.to_publish['seen'] = len(received)
+            relation.to_publish['units'] = sorted(relation.units.keys())
+'''
+
+
+def generate_charm(charm_dir):
+    """
+    Write a charm with a single endpoint, whose interface layer reads all of
+    the received data and publishes to every relation when it changes.
+    """
+    synthetic.generate_charm(charm_dir, layers=0,
+                             metadata=_METADATA.format(endpoint=ENDPOINT))
+    interface_dir = os.path.join(charm_dir, 'hooks', 'relations', 'bench')
+    os.makedirs(interface_dir)
+    with open(os.path.join(interface_dir, 'requires.py'), 'w') as fp:
+        fp.write(_INTERFACE)
+    return charm_dir
+
+
+def relations_model(relations, units, keys):
+    """
+    Build the relations model for :func:`hooktools.write_model`.
+    """
+    return {
+        '{}:{}'.format(ENDPOINT, rel): {
+            'remote{}/{}'.format(rel, unit): {
+                'key-{}'.format(key): json.dumps('value-{}-{}'.format(unit, key))
+                for key in range(keys)
+            } for unit in range(units)
+        } for rel in range(relations)
+    }
+
+
+def run_benchmark(charm_dir, relations=1, units=1, keys=1, latency=0,
+                  repeat=3, hook_name=None):
+    """
+    Run a hook for the endpoint with the given number of relations, units
+    and keys.
+
+    By default, the hook is ``bench-relation-changed``, for which all of the
+    received data is checked for changes.
+
+    :param float latency: Time in seconds for each hook tool call to take.
+    :return: A tuple of the summarized timings and other measurements.
+    """
+    tools_dir = tempfile.mkdtemp(prefix='reactive-bench-tools-')
+    try:
+        model_path = os.path.join(tools_dir, 'model.json')
+        calls_path = os.path.join(tools_dir, 'calls')
+        hooktools.write_model(model_path,
+                              relations_model(relations, units, keys))
+        env = hooktools.install(tools_dir, model_path, calls_path)
+        env['REACTIVE_BENCH_LATENCY'] = str(latency)
+        if hook_name is None:
+            hook_name = '{}-relation-changed'.format(ENDPOINT)
+            env.update({
+                'JUJU_RELATION': ENDPOINT,
+                'JUJU_RELATION_ID': '{}:0'.format(ENDPOINT),
+                'JUJU_REMOTE_UNIT': 'remote0/0',
+            })
+        with harness.HookEnvironment(charm_dir, hook_name, env) as hook_env:
+            samples = []
+            for i in range(repeat):
+                hook_env.reset(fresh_state=True)
+                samples.append(harness.timed(charms.reactive.main))
+            hooktools.count_calls(calls_path)
+
+            with harness.instrument(
+                    (endpoints.Endpoint, '_startup', 'Endpoint._startup'),
+                    (endpoints.Endpoint, '_manage_flags', 'Endpoint._manage_flags'),
+                    (endpoints.Endpoint, 'all_units', 'Endpoint.all_units'),
+                    (endpoints.CombinedUnitsView, 'received',
+                     'CombinedUnitsView.received'),
+                    (endpoints.Relation, '_flush_data',
+                     'Relation._flush_data')) as stats:
+                hook_env.reset(fresh_state=True)
+                charms.reactive.main()
+            tool_calls = hooktools.count_calls(calls_path)
+    finally:
+        shutil.rmtree(tools_dir)
+
+    timings = OrderedDict([('main', harness.summarize(samples))])
+    for name in sorted(stats.seconds):
+        timings[name] = harness.summarize([stats.seconds[name]])
+    counts = {'{} calls'.format(tool): count
+              for tool, count in tool_calls.items()}
+    counts['hook tool calls'] = sum(tool_calls.values())
+    return timings, counts
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--relations', type=_int_list, default=[1, 5],
+                        help='Comma separated numbers of relations to sweep')
+    parser.add_argument('--units', type=_int_list, default=[1, 5],
+                        help='Comma separated numbers of units per relation to sweep')
+    parser.add_argument('--keys', type=_int_list, default=[5],
+                        help='Comma separated numbers of keys per unit to sweep')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Extra time, in seconds, for each hook tool call')
+    parser.add_argument('--hook', default=None,
+                        help='Name of the hook to run, instead of the '
+                             'relation-changed hook of the endpoint')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    opts = parser.parse_args(args)
+
+    results = []
+    charm_dir = tempfile.mkdtemp(prefix='reactive-bench-charm-')
+    try:
+        generate_charm(charm_dir)
+        for relations, units, keys in itertools.product(
+                opts.relations, opts.units, opts.keys):
+            params = OrderedDict([
+                ('relations', relations),
+                ('units', units),
+                ('keys', keys),
+                ('latency', opts.latency),
+            ])
+            timings, counts = run_benchmark(charm_dir, relations, units, keys,
+                                            latency=opts.latency,
+                                            repeat=opts.repeat,
+                                            hook_name=opts.hook)
+            results.append(harness.result('relation_data', params,
+                                          timings, counts))
+    finally:
+        shutil.rmtree(charm_dir)
+    harness.report(results, as_json=opts.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Generation of synthetic charms for the benchmarks.
+"""
+
+import os
+import random
+
+
+_IMPORTS = '''\
+from charms.reactive import hook, when, when_any, when_not
+from charms.reactive import set_flag, register_trigger
+'''
+
+
+def flag_name(index):
+    return 'synthetic.flag.{}'.format(index)
+
+
+def chain_flag_name(chain, link):
+    return 'synthetic.chain.{}.{}'.format(chain, link)
+
+
+def generate_charm(charm_dir, layers=5, handlers=20, flags=50, chains=0,
+                   chain_length=5, hook_name='update-status', seed=0,
+                   metadata=None):
+    """
+    Write a synthetic reactive charm to ``charm_dir``.
+
+    Each of the ``layers`` layers becomes a module in ``reactive/`` with
+    ``handlers`` handlers over a pool of ``flags`` flags.  The handlers are
+    a mix of:
+
+      * producers, which wait for a flag set by an earlier producer and set
+        a new, higher-numbered one, forming a random tree of flags rooted at
+        the first flag; the charm always settles, after a number of
+        iterations that depends on the depth of the tree,
+      * observers, which are only tested and invoked, using ``@when`` and
+        ``@when_any`` / ``@when_not``,
+      * one ``@hook`` handler per layer for ``hook_name``.
+
+    The first handler bootstraps the first flag.  Additionally, ``chains``
+    trigger chains of ``chain_length`` flags are registered, each started by
+    a handler waiting for the first flag.
+
+    The same ``seed`` always produces the same charm.
+
+    :param str metadata: Contents for ``metadata.yaml``, if not the default.
+    """
+    rng = random.Random(seed)
+    flags = max(flags, 2)
+    reactive_dir = os.path.join(charm_dir, 'reactive')
+    os.makedirs(reactive_dir)
+    with open(os.path.join(charm_dir, 'metadata.yaml'), 'w') as fp:
+        fp.write(metadata or 'name: synthetic\n'
+                             'summary: synthetic charm\n'
+                             'description: synthetic charm\n')
+
+    layer_code = [[_IMPORTS] for _ in range(layers)]
+    for chain in range(chains):
+        code = layer_code[chain % layers]
+        code.append('')
+        for link in range(chain_length - 1):
+            code.append('register_trigger(when={!r}, set_flag={!r})'.format(
+                chain_flag_name(chain, link), chain_flag_name(chain, link + 1)))
+        code.append(_handler(
+            'chain_{}'.format(chain),
+            ['when({!r})'.format(flag_name(0)),
+             'when_not({!r})'.format(chain_flag_name(chain, 0))],
+            'set_flag({!r})'.format(chain_flag_name(chain, 0))))
+
+    if layers:
+        layer_code[0].append(_handler(
+            'bootstrap',
+            ['when_not({!r})'.format(flag_name(0))],
+            'set_flag({!r})'.format(flag_name(0))))
+    produced = [0]
+    for layer in range(layers):
+        code = layer_code[layer]
+        code.append(_handler(
+            'layer_{}_hook'.format(layer),
+            ['hook({!r})'.format(hook_name)],
+            'pass'))
+        for index in range(handlers):
+            name = 'layer_{}_handler_{}'.format(layer, index)
+            kind = index % 3
+            if kind == 0:
+                a = rng.choice(produced)
+                if len(produced) < flags:
+                    b = len(produced)
+                    produced.append(b)
+                else:
+                    b = rng.randrange(flags)
+                code.append(_handler(
+                    name,
+                    ['when({!r})'.format(flag_name(a)),
+                     'when_not({!r})'.format(flag_name(b))],
+                    'set_flag({!r})'.format(flag_name(b))))
+            elif kind == 1:
+                a, b = rng.randrange(flags), rng.randrange(flags)
+                code.append(_handler(
+                    name,
+                    ['when({!r}, {!r})'.format(flag_name(a), flag_name(b))],
+                    'pass'))
+            else:
+                a, b = rng.randrange(flags), rng.randrange(flags)
+                code.append(_handler(
+                    name,
+                    ['when_any({!r}, {!r})'.format(flag_name(a), flag_name(b)),
+                     'when_not({!r})'.format(flag_name(rng.randrange(flags)))],
+                    'pass'))
+
+    for layer, code in enumerate(layer_code):
+        path = os.path.join(reactive_dir, 'layer_{}.py'.format(layer))
+        with open(path, 'w') as fp:
+            fp.write('\n'.join(code))
+    return charm_dir
+
+
+def _handler(name, decorators, body):
+    lines = ['', '']
+    lines.extend('@' + decorator for decorator in decorators)
+    lines.append('def {}():'.format(name))
+    lines.append('    ' + body)
+    return '\n'.join(lines) + '\n'
@@ -76,18 +76,67 @@ REACTIVE_ARGS="${2-}"
 declare -A REACTIVE_HANDLERS
 declare -A REACTIVE_TESTS
 
+declare -A REACTIVE_DECORATED
+declare -A REACTIVE_PARSED
+
+function _scan_decorators() {
+    # print "decorator_line function_line last_decorator function_line_text"
+    # for each decorator in the given file, in a single pass
+    awk '
+        /^[ \t]*@/ { decorators[n++] = NR; next }
+        n {
+            for (i = 0; i < n; i++)
+                print decorators[i], NR, (i == n - 1 ? "yes" : "no"), $0
+            n = 0
+        }
+    ' "$1"
+}
+
+function _load_decorators() {
+    # read the output of _scan_decorators for the given file into
+    # REACTIVE_DECORATED, extracting the function names
+    local re='(function)? *(.*) *\(\) *\{'
+    local decorator_line func_line last line name
+    while read -r decorator_line func_line last line; do
+        name="$line"
+        if [[ "$line" =~ $re ]]; then
+            name="${line%%"${BASH_REMATCH[0]}"*}${BASH_REMATCH[2]}${line#*"${BASH_REMATCH[0]}"}"
+        fi
+        REACTIVE_DECORATED["$1:$decorator_line"]="$func_line $last $name"
+    done
+}
+
+function _parse_decorators() {
+    # map all of the decorators in the given file to the functions they
+    # decorate; if REACTIVE_BASH_CACHE is "true", the results are also cached
+    # in the charm dir, until the file is modified
+    local cache=""
+    if [[ "$REACTIVE_BASH_CACHE" == "true" && -n "$CHARM_DIR" ]]; then
+        cache="$CHARM_DIR/.reactive.sh.cache/${1//\//%}"
+    fi
+    if [[ -n "$cache" && "$cache" -nt "$1" ]]; then
+        _load_decorators "$1" < "$cache"
+    elif [[ -n "$cache" ]] && mkdir -p "${cache%/*}" 2> /dev/null && \
+            _scan_decorators "$1" > "$cache" 2> /dev/null; then
+        _load_decorators "$1" < "$cache"
+    else
+        _load_decorators "$1" < <(_scan_decorators "$1")
+    fi
+    REACTIVE_PARSED["$1"]=yes
+}
+
 function _get_decorated() {
     # find the name of the "decorated" function, given
     # that there may be more decorators between us and it
     filename=${BASH_SOURCE[2]}
-    lineno=$((BASH_LINENO[1]+1))
-    last_decorator=yes
-    while sed "${lineno}q;d" $filename | grep -qE "^\s*@"; do
-        # there are other decorators between us and the function
-        last_decorator=no
-        ((lineno++))
-    done
-    func=$(sed "${lineno}q;d" $filename | sed "s/\(function\)\? *\(.*\) *() *{/\2/")
+    if [ ! ${REACTIVE_PARSED[$filename]+_} ]; then
+        _parse_decorators "$filename"
+    fi
+    decorated="${REACTIVE_DECORATED[$filename:${BASH_LINENO[1]}]}"
+    lineno=${decorated%% *}
+    decorated=${decorated#* }
+    last_decorator=${decorated%% *}
+    func=${decorated#* }
     if [[ "$old_opts" == *x* && $last_decorator == yes ]]; then
         # pseudo-xtrace function definition when xtrace is active, since
         # the @decorator line will be logged anyway (can't suppress it)
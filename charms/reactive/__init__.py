@@ -52,6 +52,20 @@ def main(relation_name=None):
     Finally, :meth:`unitdata.kv().flush <charmhelpers.core.unitdata.Storage.flush>`
     is called to persist the flags and other data.
 
+    While running, changes to the framework's own data (flags, triggers,
+    invocation markers, etc.) are buffered in memory and written to the
+    unit's database in a single batch just before the final flush.  If the
+    hook fails, they are discarded.  Log messages are also buffered, and
+    written out in a few batches; see :mod:`charms.reactive.log`.
+
+    If the ``REACTIVE_CLI_SERVER`` environment variable is set to ``true``,
+    external handlers' calls to the ``charms.reactive`` command are answered
+    by this process; see :mod:`charms.reactive.cliserver`.
+
+    If the ``REACTIVE_TRACE_FILE`` environment variable is set, a trace
+    of the run is recorded for use with ``charms.reactive replay``; see
+    :mod:`charms.reactive.trace`.
+
     :param str relation_name: Optional name of the relation which is being handled.
     """
     restricted_mode = hookenv.hook_name() in ['meter-status-changed', 'collect-metrics']
@@ -65,19 +79,25 @@ def main(relation_name=None):
     if 'JUJU_HOOK_NAME' not in os.environ:
         os.environ['JUJU_HOOK_NAME'] = os.path.basename(sys.argv[0])
 
-    try:
-        bus.discover()
-        if not restricted_mode:  # limit what gets run in restricted mode
-            hookenv._run_atstart()
-        bus.dispatch(restricted=restricted_mode)
-    except Exception:
-        tb = traceback.format_exc()
-        hookenv.log('Hook error:\n{}'.format(tb), level=hookenv.ERROR)
-        raise
-    except SystemExit as x:
-        if x.code not in (None, 0):
+    # imported here, as only a hook needs them
+    from . import cliserver, log, storage, trace
+
+    log_buffer = log.buffered(enabled=not bus.LOG_OPTS['unbuffered'])
+    cli_server = cliserver.serving(enabled=cliserver.enabled())
+    with trace.recording(), storage.buffered_writes(), log_buffer, cli_server:
+        try:
+            bus.discover()
+            if not restricted_mode:  # limit what gets run in restricted mode
+                hookenv._run_atstart()
+            bus.dispatch(restricted=restricted_mode)
+        except Exception:
+            tb = traceback.format_exc()
+            hookenv.log('Hook error:\n{}'.format(tb), level=hookenv.ERROR)
             raise
+        except SystemExit as x:
+            if x.code not in (None, 0):
+                raise
 
-    if not restricted_mode:  # limit what gets run in restricted mode
-        hookenv._run_atexit()
+        if not restricted_mode:  # limit what gets run in restricted mode
+            hookenv._run_atexit()
     unitdata._KV.flush()
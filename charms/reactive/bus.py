@@ -24,11 +24,13 @@ from functools import partial
 
 from charmhelpers.core import hookenv
 from charmhelpers.core import unitdata
+from charms.reactive.log import log, enabled as log_enabled, flush as flush_log
 
 
 _log_opts = os.environ.get('REACTIVE_LOG_OPTS', '').split(',')
 LOG_OPTS = {
     'register': 'register' in _log_opts,
+    'unbuffered': 'unbuffered' in _log_opts,
 }
 
 
@@ -84,9 +86,9 @@ class Handler(object):
         """
         action_id = _action_id(action, suffix)
         if action_id not in cls._HANDLERS:
-            if LOG_OPTS['register']:
-                hookenv.log('Registering reactive handler for %s' % _short_action_id(action, suffix),
-                            level=hookenv.DEBUG)
+            if LOG_OPTS['register'] and log_enabled(hookenv.DEBUG):
+                log('Registering reactive handler for %s', _short_action_id(action, suffix),
+                    level=hookenv.DEBUG)
             cls._HANDLERS[action_id] = cls(action, suffix)
         return cls._HANDLERS[action_id]
 
@@ -113,6 +115,7 @@ class Handler(object):
         """
         self._action_id = _short_action_id(action, suffix)
         self._action = action
+        self._suffix = suffix
         self._args = []
         self._predicates = []
         self._post_callbacks = []
@@ -135,11 +138,11 @@ class Handler(object):
         """
         Add a new predicate callback to this handler.
         """
-        _predicate = predicate
-        if isinstance(predicate, partial):
-            _predicate = 'partial(%s, %s, %s)' % (predicate.func, predicate.args, predicate.keywords)
-        if LOG_OPTS['register']:
-            hookenv.log('  Adding predicate for %s: %s' % (self.id(), _predicate), level=hookenv.DEBUG)
+        if LOG_OPTS['register'] and log_enabled(hookenv.DEBUG):
+            _predicate = predicate
+            if isinstance(predicate, partial):
+                _predicate = 'partial(%s, %s, %s)' % (predicate.func, predicate.args, predicate.keywords)
+            log('  Adding predicate for %s: %s', self.id(), _predicate, level=hookenv.DEBUG)
         self._predicates.append(predicate)
 
     def add_post_callback(self, callback):
@@ -215,7 +218,7 @@ class ExternalHandler(Handler):
         if filepath not in Handler._HANDLERS:
             _filepath = os.path.relpath(filepath, hookenv.charm_dir())
             if LOG_OPTS['register']:
-                hookenv.log('Registering external reactive handler for %s' % _filepath, level=hookenv.DEBUG)
+                log('Registering external reactive handler for %s', _filepath, level=hookenv.DEBUG)
             Handler._HANDLERS[filepath] = cls(filepath)
         return Handler._HANDLERS[filepath]
 
@@ -231,30 +234,41 @@ class ExternalHandler(Handler):
         """
         Call the external handler to test whether it should be invoked.
         """
+        # imported here, as only external handlers need it
+        from charms.reactive import cliserver
+
         # flush to ensure external process can see flags as they currently
         # are, and write flags (flush releases lock)
         unitdata.kv().flush()
+        flush_log()
         try:
-            proc = subprocess.Popen([self._filepath, '--test'], stdout=subprocess.PIPE, env=os.environ)
+            proc = subprocess.Popen([self._filepath, '--test'], stdout=subprocess.PIPE,
+                                    env=cliserver.child_env())
         except OSError as oserr:
             if oserr.errno == errno.ENOEXEC:
                 raise BrokenHandlerException(self._filepath)
             raise
-        self._test_output, _ = proc.communicate()
+        self._test_output, _ = cliserver.communicate(proc)
         return proc.returncode == 0
 
     def invoke(self):
         """
         Call the external handler to be invoked.
         """
+        # imported here, as only external handlers need it
+        from charms.reactive import cliserver
+
         # flush to ensure external process can see flags as they currently
         # are, and write flags (flush releases lock)
         unitdata.kv().flush()
-        subprocess.check_call([self._filepath, '--invoke', self._test_output], env=os.environ)
+        flush_log()
+        cliserver.check_call([self._filepath, '--invoke', self._test_output],
+                             env=cliserver.child_env())
 
 
 class FlagWatch(object):
     key = 'reactive.state_watch'
+    generations_key = 'reactive.flag_generations'
 
     @classmethod
     def _store(cls):
@@ -294,6 +308,31 @@ class FlagWatch(object):
         data = cls._get()
         data['pending'].append(flag)
         cls._set(data)
+        generations = cls._generations()
+        generation = generations['generation'] = generations['generation'] + 1
+        generations['flags'][flag] = generation
+        cls._store().set(cls.generations_key, generations)
+        return generation
+
+    @classmethod
+    def _generations(cls):
+        return cls._store().get(cls.generations_key, {
+            'generation': 0,
+            'flags': {},
+        })
+
+    @classmethod
+    def generation(cls, flag=None):
+        """
+        Return the current flag generation, which is incremented on every
+        change to a flag and is not reset between hooks, or the generation
+        in which the given flag last changed.  Either is 0 if there have
+        been no changes.
+        """
+        generations = cls._generations()
+        if flag is None:
+            return generations['generation']
+        return generations['flags'].get(flag, 0)
 
     @classmethod
     def commit(cls):
@@ -330,6 +369,12 @@ def dispatch(restricted=False):
     * Other than the guarantees mentioned above, the order in which matching
       handlers are invoked is undefined.
 
+    * If an iteration starts with the same flags active, and the same flags
+      changed by the previous iteration, as an earlier iteration did, the
+      handlers are in a loop which would never settle, so dispatch stops
+      and logs the handlers and flags involved.  Otherwise, dispatch stops
+      after 100 iterations.
+
     * Flags are preserved between hook and action invocations, and all matching
       handlers are re-invoked for every hook and action.  There are
       :doc:`decorators <charms.reactive.decorators>` and
@@ -347,7 +392,10 @@ def dispatch(restricted=False):
             unitdata.kv().set('reactive.dispatch.removed_state', False)
             for handler in list(to_invoke):
                 to_invoke.remove(handler)
-                hookenv.log('Invoking reactive handler: %s' % handler.id(), level=hookenv.INFO)
+                log('Invoking reactive handler: %s', handler.id(), level=hookenv.INFO)
+                # so that the handler shows up in the log even if it never
+                # returns, such as if it hangs and the hook is killed
+                flush_log()
                 handler.invoke()
                 if unitdata.kv().get('reactive.dispatch.removed_state'):
                     # re-test remaining handlers
@@ -367,16 +415,104 @@ def dispatch(restricted=False):
     _invoke(hook_handlers)
 
     unitdata.kv().set('reactive.dispatch.phase', 'other')
+    history = _DispatchHistory()
+    loop = None
+    iterations = 100
     for i in range(100):
         FlagWatch.iteration(i)
         other_handlers = _test(Handler.get_handlers())
         if not other_handlers:
+            iterations = i
+            break
+        loop = history.repeated()
+        if loop is not None:
+            iterations = i
+            _log_loop(i, loop)
             break
+        handler_ids = [handler.id() for handler in other_handlers]
         _invoke(other_handlers)
+        history.record(handler_ids)
+    else:
+        log('Reactive dispatch stopped after %s iterations without settling',
+            iterations, level=hookenv.WARNING)
+    _record_metrics(iterations, loop is not None)
 
     FlagWatch.reset()
 
 
+class _DispatchHistory(object):
+    """
+    The state of the flags at the start of each dispatch iteration, and the
+    handlers invoked and flags changed by it, to detect when the handlers
+    are in a loop.
+    """
+    def __init__(self):
+        self._seen = {}
+        self._iterations = []
+
+    def repeated(self):
+        """
+        Check whether the current state has been seen at the start of an
+        earlier iteration.
+
+        :return: A list of ``(handler_ids, changed_flags)`` tuples for the
+            iterations since then, or None if the state is new.
+        """
+        flags = unitdata.kv().getrange('reactive.states.', strip=True)
+        state = hash((frozenset(flags), frozenset(FlagWatch._get()['changes'])))
+        if state in self._seen:
+            return self._iterations[self._seen[state]:]
+        self._seen[state] = len(self._iterations)
+        return None
+
+    def record(self, handler_ids):
+        """
+        Record the handlers invoked in an iteration, and the flags it changed.
+        """
+        self._iterations.append((handler_ids, FlagWatch._get()['changes']))
+
+
+def _log_loop(iteration, loop):
+    handler_ids = sorted(set(chain.from_iterable(ids for ids, flags in loop)))
+    flags = sorted(set(chain.from_iterable(flags for ids, flags in loop)))
+    log('Reactive dispatch stopped after %s iterations, because the '
+        'handlers are in a loop. Handlers: %s. Flags: %s.',
+        iteration, ', '.join(handler_ids), ', '.join(flags),
+        level=hookenv.WARNING)
+
+
+def _record_metrics(iterations, looped):
+    key = 'reactive.dispatch.metrics'
+    metrics = unitdata.kv().get(key, {})
+    hook_metrics = metrics.setdefault(hookenv.hook_name(), {
+        'runs': 0,
+        'total_iterations': 0,
+        'max_iterations': 0,
+        'loops': 0,
+    })
+    hook_metrics['runs'] += 1
+    hook_metrics['last_iterations'] = iterations
+    hook_metrics['total_iterations'] += iterations
+    hook_metrics['max_iterations'] = max(hook_metrics['max_iterations'],
+                                         iterations)
+    hook_metrics['loops'] += int(looped)
+    unitdata.kv().set(key, metrics)
+    log('Reactive dispatch took %s iterations', iterations, level=hookenv.DEBUG)
+
+
+def dispatch_metrics():
+    """
+    Return the number of dispatch iterations that each hook has needed.
+
+    The result maps hook names to dicts with the number of ``runs`` of the
+    hook, the ``last_iterations``, ``max_iterations`` and
+    ``total_iterations`` that dispatch needed for them, and the number of
+    times that dispatch was stopped due to the handlers being in a loop
+    (``loops``).
+    """
+    return unitdata.kv().get('reactive.dispatch.metrics', {})
+
+
 def discover():
     """
     Discover handlers based on convention.
@@ -15,10 +15,10 @@
 # along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import json
 import shlex
 
 from charmhelpers.cli import cmdline
-from charmhelpers.core import templating
 from charms.reactive import helpers
 from charms.reactive import bus
 
@@ -183,4 +183,63 @@ def render_template(source, target):
     Render a Jinja2 template from $CHARM_DIR/templates using the current
     environment variables as the template context.
     """
+    # imported here, as it pulls in Jinja2 and charmhelpers.core.host, which
+    # no other command needs
+    from charmhelpers.core import templating
     templating.render(source, target, os.environ)
+
+
+@cmdline.subcommand()
+def dispatch_metrics():
+    """
+    Show how many dispatch iterations each hook has needed.
+    """
+    return bus.dispatch_metrics()
+
+
+@cmdline.subcommand()
+def replay(trace_file, charm_dir=None, output=None):
+    """
+    Run a hook again from a trace recorded by setting REACTIVE_TRACE_FILE,
+    serving hook tool calls from the trace, and compare the two runs.
+
+    The charm is expected to be at the same location as when the trace was
+    recorded, unless --charm_dir is given.  The trace of the replayed run
+    can be saved with --output.
+    """
+    # imported here, as only the replay and graph commands need it
+    from charms.reactive import trace
+    recorded = trace.load(trace_file)
+    replayed = trace.replay(recorded, charm_dir)
+    if output:
+        trace.save(replayed, output)
+    return trace.compare(recorded, replayed)
+
+
+@cmdline.subcommand()
+def graph(view='summary', hook=None, charm_dir=None, traces=None, *initial_flags):
+    """
+    Analyse which flags the charm's handlers test, set, and clear, and show
+    which handlers can never run and the order in which the handlers are
+    predicted to run if the given flags are set at the start of a hook
+    (and, with --hook, in which hook).
+
+    With --view json or --view dot, the graph is exported as JSON or in
+    Graphviz DOT format instead.  Flags set by handlers in ways that can't
+    be seen from their source can be learned from traces recorded by setting
+    REACTIVE_TRACE_FILE, given as a comma-separated list with --traces.
+    """
+    if view not in ('summary', 'json', 'dot'):
+        raise ValueError('Invalid view: %s' % view)
+    # imported here, as no other command needs them
+    from charms.reactive import depgraph
+    from charms.reactive import trace
+    with depgraph.discovered(charm_dir) as handler_graph:
+        for trace_file in filter(None, (traces or '').split(',')):
+            handler_graph.add_trace(trace.load(trace_file))
+        if view == 'json':
+            return json.dumps(handler_graph.to_dict(initial_flags, hook),
+                              indent=2, sort_keys=True)
+        if view == 'dot':
+            return handler_graph.to_dot(initial_flags)
+        return handler_graph.summary(initial_flags, hook)
@@ -0,0 +1,280 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Serving of the ``charms.reactive`` command-line tool from the process
+running :func:`~charms.reactive.main`.
+
+External handlers, such as those written in bash, call the
+``charms.reactive`` command for every flag they set or test, and each call
+would otherwise start a new interpreter and import the framework again.  If
+the ``REACTIVE_CLI_SERVER`` environment variable is set to ``true``, the
+hook instead listens on a UNIX socket while dispatching, and passes its
+path to the handlers in the ``CHARMS_REACTIVE_SOCKET`` environment variable
+(see :func:`child_env`).  The ``charms.reactive`` command then sends its
+arguments, environment and working directory to the hook, which runs the
+subcommand against its own, already loaded, state and sends back the output
+and exit code.  If the socket can't be reached, or the hook doesn't accept
+the connection in time, the command falls back to running the subcommand
+itself.
+
+Requests are only answered while the hook is waiting for an external
+handler to finish (see :func:`communicate` and :func:`check_call`), so the
+subcommands always run on the hook's main thread.  The hook greets each
+connection it accepts with a single byte, and the command only sends its
+request after that, so a command which gives up waiting is never run by
+the hook as well.
+"""
+
+import io
+import json
+import os
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import traceback
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+
+from charmhelpers.cli import cmdline
+from charmhelpers.core import hookenv
+
+
+SOCKET_ENV = 'CHARMS_REACTIVE_SOCKET'
+POLL_INTERVAL = 0.01
+REQUEST_TIMEOUT = 10
+GREETING = b'\n'
+
+_server = {
+    'socket': None,
+    'path': None,
+}
+
+
+def enabled():
+    """
+    Whether the server has been requested with ``REACTIVE_CLI_SERVER=true``.
+    """
+    return os.environ.get('REACTIVE_CLI_SERVER') == 'true'
+
+
+@contextmanager
+def serving(enabled=True):
+    """
+    Listen for ``charms.reactive`` commands for the duration of the block.
+
+    :param bool enabled: If ``False``, this does nothing, so that the server
+        can be made optional without changing the calling code.
+    """
+    if not enabled or _server['socket'] is not None:
+        yield
+        return
+    tmpdir = tempfile.mkdtemp(prefix='charms.reactive.')
+    path = os.path.join(tmpdir, 'cli.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        sock.listen(16)
+    except OSError as e:
+        hookenv.log('Unable to start CLI server: {}'.format(e), hookenv.DEBUG)
+        sock.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        yield
+        return
+    sock.setblocking(False)
+    _server.update({
+        'socket': sock,
+        'path': path,
+    })
+    try:
+        yield
+    finally:
+        _server.update({
+            'socket': None,
+            'path': None,
+        })
+        sock.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def child_env():
+    """
+    The environment for an external handler, which includes the path to the
+    socket while :func:`serving`.
+
+    The path is only given to the processes waited on with
+    :func:`communicate` or :func:`check_call`, since commands from any other
+    process would not be answered until then.
+    """
+    if _server['path'] is None:
+        return os.environ
+    return dict(os.environ, **{SOCKET_ENV: _server['path']})
+
+
+def communicate(proc):
+    """
+    Wait for a :class:`subprocess.Popen` process to finish, answering any
+    commands it sends in the meantime.
+
+    Outside of :func:`serving`, this is just ``proc.communicate()``.
+
+    :returns: Tuple of the process' output (if its ``stdout`` was piped) and
+        ``None``, as returned by :meth:`~subprocess.Popen.communicate`.
+    """
+    sock = _server['socket']
+    if sock is None:
+        return proc.communicate()
+    output = []
+    readers = [sock]
+    if proc.stdout is not None:
+        readers.append(proc.stdout)
+    while proc.stdout in readers or proc.poll() is None:
+        ready, _, _ = select.select(readers, [], [], POLL_INTERVAL)
+        if sock in ready:
+            _accept(sock)
+        if proc.stdout in ready:
+            chunk = os.read(proc.stdout.fileno(), io.DEFAULT_BUFFER_SIZE)
+            if chunk:
+                output.append(chunk)
+            else:
+                readers.remove(proc.stdout)
+                proc.stdout.close()
+    proc.wait()
+    if proc.stdout is None:
+        return None, None
+    return b''.join(output), None
+
+
+def check_call(args, **kwargs):
+    """
+    Equivalent of :func:`subprocess.check_call` which answers any commands
+    sent by the process while waiting for it.
+    """
+    if _server['socket'] is None:
+        return subprocess.check_call(args, **kwargs)
+    proc = subprocess.Popen(args, **kwargs)
+    communicate(proc)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+    return 0
+
+
+def _accept(sock):
+    try:
+        conn, _ = sock.accept()
+    except (BlockingIOError, InterruptedError):
+        return
+    with conn:
+        conn.setblocking(True)
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            conn.sendall(GREETING)
+            request = _recv_all(conn)
+            if not request:
+                # the command gave up waiting, and has run itself
+                return
+            request = json.loads(request.decode('utf8'))
+            response = run_command(request['argv'],
+                                   request.get('env'), request.get('cwd'))
+            conn.sendall(json.dumps(response).encode('utf8'))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            hookenv.log('Invalid CLI server request: {}'.format(e),
+                        hookenv.WARNING)
+
+
+def _recv_all(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(io.DEFAULT_BUFFER_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def run_command(argv, env=None, cwd=None):
+    """
+    Run a ``charms.reactive`` subcommand in this process.
+
+    :param list argv: The command-line arguments, without the program name.
+    :param dict env: The environment to run the command in, in place of
+        ``os.environ``, if given.
+    :param str cwd: The directory to run the command in, if given.
+    :returns: Dict with the ``stdout`` and ``stderr`` output of the command,
+        and its ``exit_code``.
+    """
+    # these all have commands defined in them
+    from charms.reactive import bus  # noqa
+    from charms.reactive import cli  # noqa
+    from charms.reactive import helpers  # noqa
+    from charms.reactive import relations  # noqa
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    saved_argv, sys.argv = sys.argv, ['charms.reactive'] + list(argv)
+    saved_outfile, cmdline.formatter.outfile = cmdline.formatter.outfile, stdout
+    cmdline.exit_code = 0
+    try:
+        with _environment(env, cwd), \
+                redirect_stdout(stdout), redirect_stderr(stderr):
+            cmdline.run()
+        exit_code = cmdline.exit_code
+    except SystemExit as e:
+        exit_code = _exit_code(e, stderr)
+    except Exception:
+        stderr.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        sys.argv = saved_argv
+        cmdline.formatter.outfile = saved_outfile
+        cmdline.exit_code = 0
+    return {
+        'stdout': stdout.getvalue(),
+        'stderr': stderr.getvalue(),
+        'exit_code': exit_code,
+    }
+
+
+@contextmanager
+def _environment(env, cwd):
+    saved_env = dict(os.environ)
+    saved_cwd = os.getcwd()
+    if env is not None:
+        # nothing is answered while the command runs, so don't let anything
+        # it starts wait on the socket
+        env = dict(env)
+        env.pop(SOCKET_ENV, None)
+        os.environ.clear()
+        os.environ.update(env)
+    if cwd is not None:
+        os.chdir(cwd)
+    try:
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        if env is not None:
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+
+def _exit_code(exc, stderr):
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    stderr.write('{}\n'.format(exc.code))
+    return 1
@@ -35,6 +35,7 @@ from charms.reactive.helpers import _when_not_all
 from charms.reactive.helpers import any_file_changed
 from charms.reactive.helpers import was_invoked
 from charms.reactive.helpers import mark_invoked
+from charms.reactive.metadata import endpoint_index
 
 
 __all__ = [
@@ -179,7 +180,9 @@ def when_file_changed(*filenames, **kwargs):
     Register the decorated function to run when one or more files have changed.
 
     :param list filenames: The names of one or more files to check for changes
-        (a callable returning the name is also accepted).
+        (a callable returning the name is also accepted).  Directories and
+        glob patterns can also be given, to check all of the files under
+        them.
     :param str hash_type: The type of hash to use for determining if a file has
         changed.  Defaults to 'md5'.  Must be given as a kwarg.
     """
@@ -278,7 +281,7 @@ def _get_endpoint_names(handler):
     interface = filepath.parent.name
     if role not in ('requires', 'provides', 'peers'):
         return []
-    endpoint_names = hookenv.role_and_interface_to_relations(role, interface)
+    endpoint_names = endpoint_index().role_and_interface_to_relations(role, interface)
     if not endpoint_names:
         return []
     return endpoint_names
@@ -303,6 +306,17 @@ def _is_endpoint_method(handler):
     """
     params = signature(handler).parameters
     has_self = len(params) == 1 and list(params.keys())[0] == 'self'
-    has_endpoint_class = any(isclass(g) and issubclass(g, Endpoint)
-                             for g in handler.__globals__.values())
-    return has_self and has_endpoint_class
+    if not has_self:
+        return False
+    module = handler.__module__
+    if module not in _endpoint_modules:
+        if not any(isclass(g) and issubclass(g, Endpoint)
+                   for g in handler.__globals__.values()):
+            return False
+        # once found, the Endpoint class will remain available to the module
+        _endpoint_modules.add(module)
+    return True
+
+
+# Names of the modules known to contain an Endpoint class.
+_endpoint_modules = set()
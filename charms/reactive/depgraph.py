@@ -0,0 +1,610 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Static analysis of a charm's handlers and the flags which connect them.
+
+A :class:`Graph` records, for each registered handler, the flags its
+decorators test (which it consumes), and the flags it sets and clears (which
+it produces), along with the flag triggers registered with
+:func:`~charms.reactive.flags.register_trigger`.  What a handler sets and
+clears is found by looking for calls such as ``set_flag('foo')`` with literal
+flag names in its source, and can be supplemented with what it was seen to
+do in traces recorded by setting ``REACTIVE_TRACE_FILE`` (see
+:mod:`charms.reactive.trace`).
+
+From this, the graph can work out which handlers can never run, because
+they need a flag that nothing sets, and predict in which dispatch
+iterations the handlers would run, given the flags set at the start of a
+hook.  The ``charms.reactive graph`` command reports both, or exports the
+graph as JSON or in Graphviz DOT format.
+
+The analysis is only as good as what can be seen of the handlers: flags
+set with computed names, or by external handlers or interface layers, are
+not found unless they appear in a trace.  Flags starting with ``endpoint.``
+are assumed to be managed by :class:`~charms.reactive.endpoints.Endpoint`
+and so could be set in any hook.
+"""
+
+import ast
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import textwrap
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+
+from charms.reactive import bus
+from charms.reactive import flags
+from charms.reactive import helpers
+
+
+# predicates added by the decorators, and the condition each one represents
+CONDITIONS = OrderedDict([
+    (helpers._when_all, 'when_all'),
+    (helpers._when_any, 'when_any'),
+    (helpers._when_none, 'when_none'),
+    (helpers._when_not_all, 'when_not_all'),
+    (helpers._hook, 'hook'),
+    (helpers._restricted_hook, 'restricted_hook'),
+    (helpers.any_file_changed, 'when_file_changed'),
+])
+FLAG_CONDITIONS = ('when_all', 'when_any', 'when_none', 'when_not_all')
+
+# functions and methods which change a flag, and what they do to it
+FLAG_CALLS = {
+    'set_flag': 'set',
+    'set_state': 'set',
+    'clear_flag': 'clear',
+    'remove_state': 'clear',
+    'toggle_flag': 'toggle',
+}
+
+# flags set by the framework itself, outside of any handler
+EXTERNAL_PREFIXES = ('endpoint.',)
+
+MAX_ITERATIONS = 100
+
+
+class HandlerNode(object):
+    """
+    What is known about one handler.
+
+    :ivar str id: The handler's ID, as used in logs and traces.
+    :ivar bool external: Whether it is an external (e.g., bash) handler, whose
+        conditions can't be seen.
+    :ivar list conditions: List of ``(type, args)`` tuples, where ``type`` is
+        the name of the decorator (e.g., ``'when_all'``) and ``args`` are the
+        flags, hook patterns, etc. given to it.  Predicates which aren't
+        recognised have a type of ``'unknown'``.
+    :ivar set watched: Flags which cause it to be tested again when they change.
+    :ivar set sets: Flags it is known to set.
+    :ivar set clears: Flags it is known to clear.
+    """
+    def __init__(self, id, external=False, conditions=(), watched=(),
+                 sets=(), clears=()):
+        self.id = id
+        self.external = external
+        self.conditions = list(conditions)
+        self.watched = set(watched)
+        self.sets = set(sets)
+        self.clears = set(clears)
+
+    @classmethod
+    def from_handler(cls, handler):
+        """
+        Describe a registered :class:`~charms.reactive.bus.Handler`.
+        """
+        if isinstance(handler, bus.ExternalHandler):
+            return cls(handler.id(), external=True)
+        conditions = [_describe_predicate(predicate)
+                      for predicate in handler._predicates]
+        sets, clears = _flag_calls(handler._action, getattr(handler, '_suffix', None))
+        return cls(handler.id(), conditions=conditions, watched=handler._flags,
+                   sets=sets, clears=clears)
+
+    def flag_conditions(self):
+        """
+        The conditions on flags, as a list of ``(type, flags)`` tuples.
+        """
+        return [(kind, args) for kind, args in self.conditions
+                if kind in FLAG_CONDITIONS]
+
+    def hook_patterns(self):
+        """
+        The hook patterns it is restricted to, or ``None`` if it isn't a
+        :func:`~charms.reactive.decorators.hook` handler.
+        """
+        for kind, args in self.conditions:
+            if kind == 'hook':
+                return args
+        return None
+
+    def consumes(self):
+        """
+        All of the flags it tests.
+        """
+        return set(flag for kind, args in self.flag_conditions() for flag in args)
+
+    def matches(self, active):
+        """
+        Whether its flag conditions are met by the given set of active flags.
+        """
+        for kind, args in self.flag_conditions():
+            if kind == 'when_all' and not all(flag in active for flag in args):
+                return False
+            if kind == 'when_any' and not any(flag in active for flag in args):
+                return False
+            if kind == 'when_none' and any(flag in active for flag in args):
+                return False
+            if kind == 'when_not_all' and all(flag in active for flag in args):
+                return False
+        return True
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'external': self.external,
+            'conditions': [{'type': kind, 'args': list(args)}
+                           for kind, args in self.conditions],
+            'watched': sorted(self.watched),
+            'sets': sorted(self.sets),
+            'clears': sorted(self.clears),
+        }
+
+
+class Graph(object):
+    """
+    The handlers of a charm, and the flags and triggers connecting them.
+
+    :param list handlers: The :class:`HandlerNode` for each handler, in the
+        order in which they were registered.
+    :param dict triggers: Map of flag names to dicts with the lists of flags
+        to ``set_flag`` and ``clear_flag`` when it is set, as stored by
+        :func:`~charms.reactive.flags.register_trigger`.
+    """
+    def __init__(self, handlers, triggers=None):
+        self.handlers = OrderedDict((node.id, node) for node in handlers)
+        self.triggers = {flag: {'set_flag': list(trigger.get('set_flag') or []),
+                                'clear_flag': list(trigger.get('clear_flag') or [])}
+                         for flag, trigger in (triggers or {}).items()}
+
+    @classmethod
+    def from_handlers(cls, handlers=None, triggers=None):
+        """
+        Build the graph for the registered handlers and triggers.
+        """
+        if handlers is None:
+            handlers = bus.Handler.get_handlers()
+        if triggers is None:
+            triggers = flags._get_triggers()
+        return cls([HandlerNode.from_handler(handler) for handler in handlers],
+                   triggers)
+
+    def add_trace(self, trace):
+        """
+        Add the flags which handlers were seen to set and clear in a trace
+        recorded by :mod:`charms.reactive.trace`.
+        """
+        for invoked in trace.get('handlers', []):
+            node = self.handlers.get(invoked['id'])
+            if node is not None:
+                node.sets.update(invoked.get('set', []))
+                node.clears.update(invoked.get('cleared', []))
+
+    def flags(self):
+        """
+        All flags consumed or produced by handlers or triggers.
+        """
+        result = set(self.triggers)
+        for trigger in self.triggers.values():
+            result.update(trigger['set_flag'], trigger['clear_flag'])
+        for node in self.handlers.values():
+            result.update(node.consumes(), node.sets, node.clears)
+        return result
+
+    def reachable(self, initial_flags=()):
+        """
+        Return the set of flags which could be set, starting from the given
+        flags, assuming that every handler which could run does.
+        """
+        possible = set(initial_flags)
+        possible.update(flag for flag in self.flags() if _is_external(flag))
+        ran = set()
+        pending = True
+        while pending:
+            pending = False
+            for node in self.handlers.values():
+                if node.id in ran or not _could_match(node, possible):
+                    continue
+                ran.add(node.id)
+                for flag in node.sets:
+                    self._set_possible(flag, possible)
+                pending = True
+        return possible
+
+    def _set_possible(self, flag, possible):
+        stack = [flag]
+        while stack:
+            flag = stack.pop()
+            if flag in possible:
+                continue
+            possible.add(flag)
+            stack.extend(self.triggers.get(flag, {}).get('set_flag', []))
+
+    def unreachable(self, initial_flags=()):
+        """
+        Return an ordered map of the IDs of the handlers which can never run,
+        starting from the given flags, to the flags they need which nothing
+        is known to set.
+        """
+        possible = self.reachable(initial_flags)
+        result = OrderedDict()
+        for node in self.handlers.values():
+            if _could_match(node, possible):
+                continue
+            missing = set()
+            for kind, args in node.flag_conditions():
+                if kind in ('when_all', 'when_any'):
+                    missing.update(flag for flag in args if flag not in possible)
+            result[node.id] = sorted(missing)
+        return result
+
+    def plan(self, initial_flags=(), hook=None):
+        """
+        Predict how :func:`~charms.reactive.bus.dispatch` would run the
+        handlers, starting from the given flags.
+
+        This assumes that every handler sets and clears all of the flags it
+        is known to, and that any conditions other than those on flags (such
+        as :func:`~charms.reactive.decorators.when_file_changed`) are met.
+        External handlers, and handlers with only such conditions, can't be
+        predicted and are listed separately.
+
+        :param list initial_flags: The flags set at the start of the hook.
+        :param str hook: The name of the hook, to predict which
+            :func:`~charms.reactive.decorators.hook` handlers would run.
+        :returns: A dict with the handler IDs run in the ``hooks`` phase, a
+            list of lists of handler IDs run in each iteration of the
+            ``other`` phase, the predicted ``flags`` set at the end, whether
+            dispatch would stop in a ``loop``, and the ``unpredictable``
+            handler IDs.
+        """
+        return _Planner(self, initial_flags, hook).run()
+
+    def to_dict(self, initial_flags=(), hook=None):
+        """
+        Return the graph, unreachable handlers, and plan, suitable for
+        serializing to JSON.
+        """
+        return {
+            'handlers': [node.to_dict() for node in self.handlers.values()],
+            'triggers': self.triggers,
+            'flags': sorted(self.flags()),
+            'unreachable': self.unreachable(initial_flags),
+            'plan': self.plan(initial_flags, hook),
+        }
+
+    def to_dot(self, initial_flags=()):
+        """
+        Return the graph in Graphviz DOT format.
+
+        Flags are drawn as ellipses and handlers as boxes, with edges from
+        the flags each handler tests to it (dashed if it needs them to not be
+        set), and from it to the flags it sets (or clears, in red).  Edges
+        between flags are triggers.  Unreachable handlers are grey.
+        """
+        unreachable = self.unreachable(initial_flags)
+        lines = ['digraph reactive {', '  rankdir=LR;']
+        for flag in sorted(self.flags()):
+            lines.append('  {} [shape=ellipse];'.format(_dot_id('flag', flag)))
+        for node in self.handlers.values():
+            lines.extend(_dot_handler(node, node.id in unreachable))
+        for flag, trigger in sorted(self.triggers.items()):
+            for target in trigger['set_flag']:
+                lines.append('  {} -> {} [label=trigger];'.format(
+                    _dot_id('flag', flag), _dot_id('flag', target)))
+            for target in trigger['clear_flag']:
+                lines.append('  {} -> {} [label=trigger, color=red];'.format(
+                    _dot_id('flag', flag), _dot_id('flag', target)))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def summary(self, initial_flags=(), hook=None):
+        """
+        Return a readable report of the unreachable handlers and the plan.
+        """
+        lines = ['{} handlers, {} flags, {} triggers'.format(
+            len(self.handlers), len(self.flags()), len(self.triggers))]
+        unreachable = self.unreachable(initial_flags)
+        if unreachable:
+            lines.append('')
+            lines.append('Unreachable handlers:')
+            for handler_id, missing in unreachable.items():
+                lines.append('  {} (needs {})'.format(
+                    handler_id, ', '.join(missing) or 'conflicting flags'))
+        plan = self.plan(initial_flags, hook)
+        lines.append('')
+        lines.append('Plan:')
+        if plan['hooks']:
+            lines.append('  hooks: {}'.format(', '.join(plan['hooks'])))
+        for i, handler_ids in enumerate(plan['iterations']):
+            lines.append('  {}: {}'.format(i, ', '.join(handler_ids)))
+        lines.append('Predicted iterations: {}{}'.format(
+            len(plan['iterations']), ' (loop)' if plan['loop'] else ''))
+        if plan['unpredictable']:
+            lines.append('Not predicted: {}'.format(', '.join(plan['unpredictable'])))
+        return '\n'.join(lines)
+
+
+class _Planner(object):
+    """
+    Simulation of :func:`~charms.reactive.bus.dispatch` over a :class:`Graph`.
+    """
+    def __init__(self, graph, initial_flags, hook):
+        self.graph = graph
+        self.hook = hook
+        self.active = set(initial_flags)
+        self.changed = set()
+        self.removed = False
+
+    def run(self):
+        nodes = list(self.graph.handlers.values())
+        unpredictable = [node.id for node in nodes if _unpredictable(node)]
+        hook_nodes = [node for node in nodes
+                      if node.hook_patterns() is not None and self._hook_matches(node)]
+        other_nodes = [node for node in nodes
+                       if node.flag_conditions() and node.id not in unpredictable]
+        hooks = self._invoke(hook_nodes)
+
+        iterations = []
+        seen = set()
+        loop = False
+        self.changed = None
+        for i in range(MAX_ITERATIONS):
+            to_invoke = [node for node in other_nodes if self._test(node)]
+            if not to_invoke:
+                break
+            key = (frozenset(self.active), frozenset(self.changed or ()))
+            if key in seen:
+                loop = True
+                break
+            seen.add(key)
+            self.changed = set()
+            iterations.append(self._invoke(to_invoke))
+        return {
+            'hooks': hooks,
+            'iterations': iterations,
+            'flags': sorted(self.active),
+            'loop': loop,
+            'unpredictable': unpredictable,
+        }
+
+    def _hook_matches(self, node):
+        return self.hook is not None and \
+            self.hook in helpers._hook_names(node.hook_patterns())
+
+    def _test(self, node):
+        if self.changed is not None and node.watched and \
+                not node.watched & self.changed:
+            return False
+        return node.matches(self.active)
+
+    def _invoke(self, to_invoke):
+        invoked = []
+        to_invoke = list(to_invoke)
+        while to_invoke:
+            node = to_invoke.pop(0)
+            invoked.append(node.id)
+            self.removed = False
+            self._apply(node)
+            if self.removed:
+                # dispatch re-tests the rest when a flag is removed
+                to_invoke = [other for other in to_invoke
+                             if other.matches(self.active)]
+        return invoked
+
+    def _apply(self, node):
+        # flags which are both set and cleared depend on what the handler
+        # finds, so are left as they are
+        for flag in sorted(node.sets - node.clears):
+            self._set(flag)
+        for flag in sorted(node.clears - node.sets):
+            self._clear(flag)
+
+    def _set(self, flag, followed=None):
+        if flag in self.active:
+            return
+        self.active.add(flag)
+        self._changed(flag)
+        followed = followed if followed is not None else set()
+        if flag in followed:
+            return
+        followed.add(flag)
+        trigger = self.graph.triggers.get(flag, {})
+        for target in trigger.get('set_flag', []):
+            self._set(target, followed)
+        for target in trigger.get('clear_flag', []):
+            self._clear(target)
+
+    def _clear(self, flag):
+        if flag not in self.active:
+            return
+        self.active.discard(flag)
+        self._changed(flag)
+        self.removed = True
+
+    def _changed(self, flag):
+        if self.changed is not None:
+            self.changed.add(flag)
+
+
+def _is_external(flag):
+    return flag.startswith(EXTERNAL_PREFIXES)
+
+
+def _could_match(node, possible):
+    """
+    Whether the node's conditions could be met, if any of the ``possible``
+    flags were set.  Conditions requiring flags to not be set are assumed
+    to be met.
+    """
+    for kind, args in node.flag_conditions():
+        if kind == 'when_all' and not all(flag in possible for flag in args):
+            return False
+        if kind == 'when_any' and not any(flag in possible for flag in args):
+            return False
+    return True
+
+
+def _unpredictable(node):
+    if node.external:
+        return True
+    return node.hook_patterns() is None and not node.flag_conditions()
+
+
+def _describe_predicate(predicate):
+    func = getattr(predicate, 'func', None)
+    kind = CONDITIONS.get(func)
+    if kind is None:
+        return 'unknown', [repr(predicate)]
+    args = predicate.args[0] if predicate.args else []
+    if isinstance(args, str):
+        args = [args]
+    return kind, list(args)
+
+
+def _flag_calls(action, endpoint_name=None):
+    """
+    Find the flags set and cleared with literal names in a function's source.
+    """
+    sets, clears = set(), set()
+    try:
+        source = textwrap.dedent(inspect.getsource(action))
+        tree = ast.parse(source)
+    except (OSError, TypeError, SyntaxError):
+        return sets, clears
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call) or not node.args:
+            continue
+        func = node.func
+        name = getattr(func, 'id', None) or getattr(func, 'attr', None)
+        if name not in FLAG_CALLS:
+            continue
+        flag = _flag_name(node.args[0], endpoint_name)
+        if flag is None:
+            continue
+        if FLAG_CALLS[name] in ('set', 'toggle'):
+            sets.add(flag)
+        if FLAG_CALLS[name] in ('clear', 'toggle'):
+            clears.add(flag)
+    return sets, clears
+
+
+def _flag_name(node, endpoint_name):
+    """
+    Return the flag named by an argument node, if it is a string literal, or
+    a call to :meth:`~charms.reactive.endpoints.Endpoint.expand_name` with one.
+    """
+    if isinstance(node, ast.Call) and getattr(node.func, 'attr', None) == 'expand_name':
+        if endpoint_name is None or not node.args:
+            return None
+        flag = _string_literal(node.args[0])
+        if flag is None:
+            return None
+        if '{endpoint_name}' not in flag:
+            flag = 'endpoint.{endpoint_name}.' + flag
+        return flag.format(endpoint_name=endpoint_name)
+    flag = _string_literal(node)
+    if flag is None or '{' in flag:
+        return None
+    return flag
+
+
+def _string_literal(node):
+    # string literals are ast.Str before Python 3.8, and ast.Constant since
+    node_type = type(node).__name__
+    if node_type == 'Constant':
+        value = node.value
+    elif node_type == 'Str':
+        value = node.s
+    else:
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _dot_handler(node, unreachable):
+    node_id = _dot_id('handler', node.id)
+    attrs = ['shape=box', 'label={}'.format(_dot_quote(node.id))]
+    if unreachable:
+        attrs.append('color=grey')
+    lines = ['  {} [{}];'.format(node_id, ', '.join(attrs))]
+    for kind, args in node.flag_conditions():
+        style = 'dashed' if kind in ('when_none', 'when_not_all') else 'solid'
+        for flag in OrderedDict.fromkeys(args):
+            lines.append('  {} -> {} [label={}, style={}];'.format(
+                _dot_id('flag', flag), node_id, kind, style))
+    for flag in sorted(node.sets):
+        lines.append('  {} -> {};'.format(node_id, _dot_id('flag', flag)))
+    for flag in sorted(node.clears):
+        lines.append('  {} -> {} [color=red];'.format(node_id, _dot_id('flag', flag)))
+    return lines
+
+
+def _dot_quote(value):
+    return json.dumps(value)
+
+
+def _dot_id(kind, name):
+    return _dot_quote('{}:{}'.format(kind, name))
+
+
+@contextmanager
+def discovered(charm_dir=None):
+    """
+    Discover a charm's handlers and yield its :class:`Graph`.
+
+    The handlers are loaded against a temporary, empty unit database, so
+    that triggers registered as they are loaded are seen without touching
+    the unit's own data.  This should be run in a fresh process, since it
+    loads the charm's handlers.
+
+    :param str charm_dir: Path to the charm, if not ``$CHARM_DIR``.
+    """
+    state_dir = tempfile.mkdtemp()
+    saved_env = dict(os.environ)
+    saved_kv = unitdata._KV
+    if charm_dir:
+        os.environ['CHARM_DIR'] = os.environ['JUJU_CHARM_DIR'] = charm_dir
+    os.environ['UNIT_STATE_DB'] = os.path.join(state_dir, 'state.db')
+    unitdata._KV = None
+    hookenv.cache.clear()
+    try:
+        bus.discover()
+        yield Graph.from_handlers()
+    finally:
+        if unitdata._KV is not None:
+            unitdata._KV.conn.close()
+        unitdata._KV = saved_kv
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(state_dir)
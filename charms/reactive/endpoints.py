@@ -20,7 +20,8 @@ from itertools import chain
 
 from charmhelpers.core import hookenv
 from charms.reactive.flags import set_flag, toggle_flag, is_flag_set
-from charms.reactive.helpers import data_changed
+from charms.reactive.helpers import data_changed_many
+from charms.reactive.metadata import endpoint_index
 from charms.reactive.relations import RelationFactory, relation_factory
 
 
@@ -103,7 +104,7 @@ class Endpoint(RelationFactory):
         """
         Create Endpoint instances and manage automatic flags.
         """
-        for endpoint_name in sorted(hookenv.relation_types()):
+        for endpoint_name in sorted(endpoint_index().relation_types()):
             # populate context based on attached relations
             relf = relation_factory(endpoint_name)
             if not relf or not issubclass(relf, cls):
@@ -188,15 +189,22 @@ class Endpoint(RelationFactory):
             # the joined flag before, since then we might migrating to Endpoints)
             return
 
+        received = {}
+        keys = {}
         for unit in self.all_units:
             for key, value in unit.received.items():
                 data_key = 'endpoint.{}.{}.{}.{}'.format(self.endpoint_name,
                                                          unit.relation.relation_id,
                                                          unit.unit_name,
                                                          key)
-                if data_changed(data_key, value):
-                    set_flag(self.expand_name('changed'))
-                    set_flag(self.expand_name('changed.{}'.format(key)))
+                received[data_key] = value
+                keys[data_key] = key
+        # md5 to match the hashes stored by data_changed in earlier releases
+        changed = data_changed_many(received, hash_type='md5')
+        for data_key in sorted(received):
+            if changed[data_key]:
+                set_flag(self.expand_name('changed'))
+                set_flag(self.expand_name('changed.{}'.format(keys[data_key])))
 
     @property
     def all_units(self):
@@ -1,3 +1,5 @@
+from bisect import bisect_left
+
 from charmhelpers.cli import cmdline
 from charmhelpers.core import unitdata
 
@@ -6,11 +8,16 @@ from charms.reactive.bus import FlagWatch
 __all__ = [
     'set_flag',
     'clear_flag',
+    'clear_flags',
     'toggle_flag',
     'register_trigger',
     'is_flag_set',
     'all_flags_set',
     'any_flags_set',
+    'get_flags',
+    'flag_generation',
+    'flag_changed_generation',
+    'flags_changed_since',
     'set_state',  # DEPRECATED
     'remove_state',  # DEPRECATED
     'toggle_state',  # DEPRECATED
@@ -21,6 +28,14 @@ __all__ = [
 ]
 
 
+# arbitrary obj instance to use as a default instead of None
+_UNSET = object()
+
+# Functions called with the name and last value of each flag that is cleared,
+# so that other modules can drop anything they keep alongside the flag.
+_clear_hooks = []
+
+
 class State(str):
     """
     .. deprecated:: 0.5.0
@@ -69,15 +84,11 @@ def set_flag(flag, value=None):
        complete and successful run of the reactive framework. All unpersisted
        changes are discarded when a hook crashes.
     """
-    old_flags = get_flags()
+    was_set = _is_flag_set(flag)
     unitdata.kv().update({flag: value}, prefix='reactive.states.')
-    if flag not in old_flags:
-        FlagWatch.change(flag)
-        trigger = _get_trigger(flag)
-        for flag_name in trigger['set_flag']:
-            set_flag(flag_name)
-        for flag_name in trigger['clear_flag']:
-            clear_flag(flag_name)
+    if not was_set:
+        _flag_changed(flag, True)
+        _apply_triggers(flag)
 
 
 @cmdline.subcommand()
@@ -93,11 +104,29 @@ def clear_flag(flag):
        complete and successful run of the reactive framework. All unpersisted
        changes are discarded when a hook crashes.
     """
-    old_flags = get_flags()
+    value = _get_flag_value(flag, _UNSET)
     unitdata.kv().unset('reactive.states.%s' % flag)
     unitdata.kv().set('reactive.dispatch.removed_state', True)
-    if flag in old_flags:
-        FlagWatch.change(flag)
+    if value is _UNSET:
+        return
+    for hook in _clear_hooks:
+        hook(flag, value)
+    _flag_changed(flag, False)
+
+
+@cmdline.subcommand()
+@cmdline.no_output
+def clear_flags(prefix):
+    """
+    Clear all of the flags whose names start with the given prefix.
+
+    For example, ``clear_flags('endpoint.db.changed.')`` clears all of the
+    ``endpoint.db.changed.*`` flags.
+
+    :param str prefix: Prefix of the names of the flags to clear.
+    """
+    for flag in get_flags(prefix=prefix):
+        clear_flag(flag)
 
 
 @cmdline.subcommand()
@@ -141,24 +170,94 @@ def register_trigger(when, set_flag=None, clear_flag=None):
     :param str clear_flag: If given, this flag will be cleared when `when` is set.
     """
     trigger = _get_trigger(when)
+    changed = False
     if set_flag and set_flag not in trigger['set_flag']:
         trigger['set_flag'].append(set_flag)
+        changed = True
     if clear_flag and clear_flag not in trigger['clear_flag']:
         trigger['clear_flag'].append(clear_flag)
-    _save_trigger(when, trigger)
+        changed = True
+    if changed:
+        _save_trigger(when, trigger)
+
+
+# In-memory copy of all registered triggers, as a map of flag name to the
+# trigger data for that flag.  It is reloaded if the storage changes or
+# if another process has registered a trigger since it was loaded.
+_triggers_cache = {
+    'storage': None,
+    'version': None,
+    'triggers': {},
+}
+
+
+def _get_triggers():
+    kv = unitdata.kv()
+    version = kv.get('reactive.flag_triggers_version')
+    if _triggers_cache['storage'] is not kv or _triggers_cache['version'] != version:
+        _triggers_cache.update({
+            'storage': kv,
+            'version': version,
+            'triggers': kv.getrange('reactive.flag_triggers.', strip=True) or {},
+        })
+    return _triggers_cache['triggers']
 
 
 def _get_trigger(when):
-    key = 'reactive.flag_triggers.{}'.format(when)
-    return unitdata.kv().get(key, {
+    trigger = _get_triggers().get(when, {
         'set_flag': [],
         'clear_flag': [],
     })
+    return {
+        'set_flag': list(trigger['set_flag']),
+        'clear_flag': list(trigger['clear_flag']),
+    }
 
 
 def _save_trigger(when, data):
-    key = 'reactive.flag_triggers.{}'.format(when)
-    return unitdata.kv().set(key, data)
+    kv = unitdata.kv()
+    triggers = _get_triggers()
+    version = (_triggers_cache['version'] or 0) + 1
+    kv.set('reactive.flag_triggers.{}'.format(when), data)
+    kv.set('reactive.flag_triggers_version', version)
+    triggers[when] = data
+    _triggers_cache['version'] = version
+
+
+def _apply_triggers(flag):
+    """
+    Apply the cascade of triggers for a flag that has just been set.
+
+    Triggers are followed depth-first, in the order in which they were
+    registered, with the flags set by a trigger having their own triggers
+    applied before the flags cleared by it.  Each flag's triggers are only
+    followed once per cascade, so cycles of triggers will terminate.
+    """
+    triggers = _get_triggers()
+    followed = set()
+    pending = []
+
+    def follow(when):
+        followed.add(when)
+        trigger = triggers.get(when)
+        if not trigger:
+            return
+        # pending is used as a stack, so push in reverse order
+        pending.extend(('clear_flag', f) for f in reversed(trigger['clear_flag']))
+        pending.extend(('set_flag', f) for f in reversed(trigger['set_flag']))
+
+    follow(flag)
+    while pending:
+        action, target = pending.pop()
+        if action == 'clear_flag':
+            clear_flag(target)
+            continue
+        was_set = _is_flag_set(target)
+        unitdata.kv().update({target: None}, prefix='reactive.states.')
+        if not was_set:
+            _flag_changed(target, True)
+            if target not in followed:
+                follow(target)
 
 
 @cmdline.subcommand()
@@ -172,31 +271,126 @@ def is_flag_set(flag):
 @cmdline.test_command
 def all_flags_set(*desired_flags):
     """Assert that all desired_flags are set"""
-    active_flags = get_flags()
-    return all(flag in active_flags for flag in desired_flags)
+    active_flags = _sorted_flags()
+    return all(_contains(active_flags, flag) for flag in desired_flags)
 
 
 @cmdline.subcommand()
 @cmdline.test_command
 def any_flags_set(*desired_flags):
     """Assert that any of the desired_flags are set"""
-    active_flags = get_flags()
-    return any(flag in active_flags for flag in desired_flags)
+    active_flags = _sorted_flags()
+    return any(_contains(active_flags, flag) for flag in desired_flags)
 
 
 @cmdline.subcommand()
-def get_flags():
+def get_flags(prefix=None):
+    """
+    Return a sorted list of all flags which are set.
+
+    :param str prefix: If given, only return the flags whose names start
+        with this prefix, such as ``'endpoint.db.'``.
     """
-    Return a list of all flags which are set.
+    flags = _sorted_flags()
+    if not prefix:
+        return list(flags)
+    i = bisect_left(flags, prefix)
+    matching = []
+    while i < len(flags) and flags[i].startswith(prefix):
+        matching.append(flags[i])
+        i += 1
+    return matching
+
+
+# Sorted in-memory list of the names of the flags which are set.  It is
+# reloaded if the storage changes, or if the flag generation doesn't match,
+# such as after another process has changed flags.
+_flags_cache = {
+    'storage': None,
+    'generation': None,
+    'flags': [],
+}
+
+
+def _sorted_flags():
+    kv = unitdata.kv()
+    generation = FlagWatch.generation()
+    if _flags_cache['storage'] is not kv or _flags_cache['generation'] != generation:
+        _flags_cache.update({
+            'storage': kv,
+            'generation': generation,
+            'flags': sorted(kv.getrange('reactive.states.', strip=True) or {}),
+        })
+    return _flags_cache['flags']
+
+
+def _contains(flags, flag):
+    i = bisect_left(flags, flag)
+    return i < len(flags) and flags[i] == flag
+
+
+def _flag_changed(flag, is_set):
     """
-    flags = unitdata.kv().getrange('reactive.states.', strip=True) or {}
-    return sorted(flags.keys())
+    Record a change to a flag with the FlagWatch, and in the flags cache if
+    it is up to date.
+    """
+    generation = FlagWatch.change(flag)
+    if _flags_cache['storage'] is not unitdata.kv() or \
+            _flags_cache['generation'] != generation - 1:
+        # out of step; reload it when next used
+        _flags_cache['storage'] = None
+        return
+    flags = _flags_cache['flags']
+    i = bisect_left(flags, flag)
+    present = i < len(flags) and flags[i] == flag
+    if is_set and not present:
+        flags.insert(i, flag)
+    elif not is_set and present:
+        del flags[i]
+    _flags_cache['generation'] = generation
+
+
+def flag_generation():
+    """
+    Return the current flag generation.
+
+    This is a number which is incremented every time a flag is set or
+    cleared (setting a flag which is already set, or clearing one which
+    isn't, doesn't count), and is never reset.  Save it and pass it to
+    :func:`flags_changed_since` later to check for changes without comparing
+    lists of flags.
+    """
+    return FlagWatch.generation()
+
+
+def flag_changed_generation(flag):
+    """
+    Return the :func:`flag generation <flag_generation>` in which the given
+    flag was last set or cleared, or 0 if it never has been.
+    """
+    return FlagWatch.generation(flag)
+
+
+def flags_changed_since(generation, *flags):
+    """
+    Check whether any of the given flags, or any flag at all if none are
+    given, have been set or cleared since the given
+    :func:`flag generation <flag_generation>`.
+    """
+    if not flags:
+        return FlagWatch.generation() > generation
+    return any(FlagWatch.generation(flag) > generation for flag in flags)
 
 
 def _get_flag_value(flag, default=None):
     return unitdata.kv().get('reactive.states.%s' % flag, default)
 
 
+def _is_flag_set(flag):
+    # flags can be set with a value of None, so use a marker as the default
+    return _get_flag_value(flag, _UNSET) is not _UNSET
+
+
 # DEPRECATED
 
 @cmdline.subcommand()
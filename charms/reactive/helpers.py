@@ -14,21 +14,27 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import re
+import glob
 import json
+import time
 import hashlib
+import functools
+from collections import OrderedDict
 
-from charmhelpers.core import host
 from charmhelpers.core import hookenv
 from charmhelpers.core import unitdata
 from charmhelpers.cli import cmdline
 from charms.reactive.flags import any_flags_set, all_flags_set
+from charms.reactive.metadata import endpoint_index
 # import deprecated functions for backwards compatibility
 from charms.reactive.flags import is_state, all_states, any_states  # noqa
 
 
 __all__ = [
     'data_changed',
+    'data_changed_many',
     'any_file_changed',
 ]
 
@@ -68,17 +74,46 @@ def any_hook(*hook_patterns):
         must be one of ``provides``, ``requires``, or ``peer``.
       * The previous two can be combined, of course: ``{provides:mysql}-relation-{joined,changed}``
     """
-    current_hook = hookenv.hook_name()
+    return hookenv.hook_name() in _hook_names(hook_patterns)
+
 
-    # expand {role:interface} patterns
-    i_pat = re.compile(r'{([^:}]+):([^}]+)}')
-    hook_patterns = _expand_replacements(i_pat, hookenv.role_and_interface_to_relations, hook_patterns)
+# {role:interface} and {A,B,C,...} patterns, respectively
+_INTERFACE_PATTERN = re.compile(r'{([^:}]+):([^}]+)}')
+_CHOICE_PATTERN = re.compile(r'{((?:[^:,}]+,?)+)}')
 
-    # expand {A,B,C,...} patterns
-    c_pat = re.compile(r'{((?:[^:,}]+,?)+)}')
-    hook_patterns = _expand_replacements(c_pat, lambda v: v.split(','), hook_patterns)
+# Map of hook patterns to the endpoint index they were expanded against (or
+# None if they don't depend on it) and the set of hook names they match.
+_hook_names_cache = {}
 
-    return current_hook in hook_patterns
+
+def _hook_names(hook_patterns):
+    """
+    Return the set of hook names matched by any of the given hook patterns.
+
+    The result is cached, so that testing the same patterns again is just
+    a set lookup.  Patterns using ``{role:interface}`` are expanded again if
+    the charm metadata changes.
+    """
+    hook_patterns = tuple(hook_patterns)
+    cached = _hook_names_cache.get(hook_patterns)
+    if cached is not None:
+        index, hook_names = cached
+        if index is None or index is endpoint_index():
+            return hook_names
+
+    index = None
+    hook_names = hook_patterns
+    if any(_INTERFACE_PATTERN.search(pattern) for pattern in hook_patterns):
+        index = endpoint_index()
+        hook_names = _expand_replacements(_INTERFACE_PATTERN,
+                                          index.role_and_interface_to_relations,
+                                          hook_names)
+    hook_names = _expand_replacements(_CHOICE_PATTERN,
+                                      lambda v: v.split(','),
+                                      hook_names)
+    hook_names = frozenset(hook_names)
+    _hook_names_cache[hook_patterns] = (index, hook_names)
+    return hook_names
 
 
 def any_file_changed(filenames, hash_type='md5'):
@@ -86,24 +121,231 @@ def any_file_changed(filenames, hash_type='md5'):
     Check if any of the given files have changed since the last time this
     was called.
 
+    To avoid re-reading large files, the size, modification time and inode
+    of each file are stored along with its hash, and the file is only hashed
+    again if those have changed; the hashes are also remembered for the rest
+    of the hook.  Files modified within the last couple of
+    seconds are always hashed, since a quick succession of writes may not
+    change their modification time.
+
+    Directories and glob patterns (including ``**``) can also be given, in
+    which case all files under them are checked, and files being added or
+    removed also counts as a change.  A manifest of the files' details and
+    hashes is stored for each one, so that only the files whose details have
+    changed need to be hashed.
+
     :param list filenames: Names of files to check. Accepts callables returning
         the filename.
     :param str hash_type: Algorithm to use to check the files.
     """
-    changed = False
+    kv = unitdata.kv()
+    checks = []
+    trees_changed = False
     for filename in filenames:
         if callable(filename):
             filename = str(filename())
         else:
             filename = str(filename)
-        old_hash = unitdata.kv().get('reactive.files_changed.%s' % filename)
-        new_hash = host.file_hash(filename, hash_type=hash_type)
+        if os.path.isdir(filename) or (_GLOB_CHARS.search(filename) and
+                                       not os.path.exists(filename)):
+            trees_changed |= _tree_changed(filename, hash_type)
+            continue
+        old_hash = kv.get('reactive.files_changed.%s' % filename)
+        stat = _file_stat(filename, hash_type)
+        new_hash = _known_hash(filename, old_hash, stat)
+        checks.append((filename, old_hash, stat, new_hash))
+
+    hashes = _hash_files([filename for filename, old_hash, stat, new_hash
+                          in checks if new_hash is _UNHASHED], hash_type)
+    changed = trees_changed
+    for filename, old_hash, stat, new_hash in checks:
+        if new_hash is _UNHASHED:
+            new_hash = hashes[filename]
+            stat_key = 'reactive.files_stat.%s' % filename
+            if stat is not None:
+                kv.set(stat_key, stat)
+                _file_hashes[filename] = (stat, new_hash)
+            elif kv.get(stat_key) is not None:
+                kv.unset(stat_key)
         if old_hash != new_hash:
-            unitdata.kv().set('reactive.files_changed.%s' % filename, new_hash)
+            kv.set('reactive.files_changed.%s' % filename, new_hash)
             changed = True  # mark as changed, but keep updating hashes
     return changed
 
 
+_UNHASHED = object()
+
+
+def _known_hash(filename, old_hash, stat):
+    """
+    Return the hash of the file if it can be known without reading it, or
+    ``_UNHASHED`` if the file needs to be hashed.
+    """
+    if stat is None:
+        return _UNHASHED
+    memo = _file_hashes.get(filename)
+    if memo is not None and memo[0] == stat:
+        return memo[1]  # already checked by this process
+    if old_hash is not None and \
+            unitdata.kv().get('reactive.files_stat.%s' % filename) == stat:
+        _file_hashes[filename] = (stat, old_hash)
+        return old_hash  # unchanged since it was last hashed
+    return _UNHASHED
+
+
+# hashes of files which have been hashed by this process, by file name
+_file_hashes = {}
+
+# files modified more recently than this (in ns) may change again without
+# changing their modification time
+_STAT_GRACE = 2 * 10 ** 9
+
+
+def _file_stat(filename, hash_type):
+    """
+    Return the details of the file which are checked before re-hashing it,
+    or None if the file doesn't exist or was modified too recently for them
+    to be relied on.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    if st.st_mtime_ns > time.time() * 10 ** 9 - _STAT_GRACE:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino, hash_type]
+
+
+_GLOB_CHARS = re.compile(r'[*?[]')
+
+
+def _tree_changed(pattern, hash_type):
+    """
+    Check if any of the files in a directory, or matching a glob pattern,
+    have changed, or been added or removed, since the last check.
+    """
+    kv = unitdata.kv()
+    key = 'reactive.files_manifest.%s' % pattern
+    old_manifest = kv.get(key) or {}
+    old_files = {}
+    if old_manifest.get('hash_type') == hash_type:
+        old_files = old_manifest['files']
+    trusted = time.time() * 10 ** 9 - _STAT_GRACE
+    files = {}
+    to_hash = []
+    for path, st in _walk_tree(pattern):
+        stat = [st.st_size, st.st_mtime_ns, st.st_ino]
+        old = old_files.get(path)
+        if old and old[:3] == stat and st.st_mtime_ns <= trusted:
+            files[path] = old
+        else:
+            files[path] = stat + [None]
+            to_hash.append(path)
+    hashes = _hash_files(to_hash, hash_type)
+    for path in to_hash:
+        files[path][3] = hashes[path]
+    if files != old_files or old_manifest.get('hash_type') != hash_type:
+        kv.set(key, {'hash_type': hash_type, 'files': files})
+    return ({path: f[3] for path, f in files.items()} !=
+            {path: f[3] for path, f in old_files.items()})
+
+
+def _walk_tree(pattern):
+    """
+    Yield the path and stat result of each file in a directory, or matching
+    a glob pattern, recursing into directories.
+    """
+    if _GLOB_CHARS.search(pattern):
+        paths = sorted(glob.glob(pattern, recursive=True))
+    else:
+        paths = [pattern]
+    for path in paths:
+        if os.path.isdir(path):
+            for item in _scan_dir(path):
+                yield item
+        else:
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                pass
+
+
+def _scan_dir(path):
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                for item in _scan_dir(entry.path):
+                    yield item
+            elif entry.is_file():
+                yield entry.path, entry.stat()
+        except OSError:
+            pass  # removed while scanning
+
+
+# files at least this big are hashed through mmap, in chunks of this size
+_HASH_CHUNK = 4 * 1024 * 1024
+
+# several files are hashed in parallel if they add up to at least this size
+_PARALLEL_HASH_SIZE = 64 * 1024 * 1024
+_MAX_HASH_WORKERS = 4
+
+
+def _hash_files(filenames, hash_type):
+    """
+    Return a dict of the hashes of the given files, hashing several large
+    files in parallel.
+    """
+    filenames = list(OrderedDict.fromkeys(filenames))
+    if len(filenames) > 1 and \
+            sum(map(_file_size, filenames)) >= _PARALLEL_HASH_SIZE:
+        from concurrent.futures import ThreadPoolExecutor
+        workers = min(len(filenames), _MAX_HASH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(functools.partial(_hash_file, hash_type=hash_type),
+                              filenames)
+            return dict(zip(filenames, hashes))
+    return {filename: _hash_file(filename, hash_type=hash_type)
+            for filename in filenames}
+
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _hash_file(filename, hash_type='md5'):
+    """
+    Return the hex digest of the contents of the file, or None if it doesn't
+    exist.
+
+    Large files are hashed through a memory map, a chunk at a time, so that
+    memory use stays constant and the interpreter lock is released while
+    hashing, allowing several files to be hashed in parallel threads.
+    """
+    try:
+        fp = open(filename, 'rb')
+    except FileNotFoundError:
+        return None
+    digest = hashlib.new(hash_type)
+    with fp:
+        if os.fstat(fp.fileno()).st_size < _HASH_CHUNK:
+            digest.update(fp.read())
+            return digest.hexdigest()
+        import mmap
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                memoryview(mapped) as view:
+            for offset in range(0, len(view), _HASH_CHUNK):
+                with view[offset:offset + _HASH_CHUNK] as chunk:
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
 def was_invoked(invocation_id):
     """
     Returns whether the given ID has been invoked before, as per :func:`mark_invoked`.
@@ -146,8 +388,56 @@ def data_changed(data_id, data, hash_type='md5'):
     serialized = json.dumps(data, sort_keys=True).encode('utf8')
     old_hash = unitdata.kv().get(key)
     new_hash = alg(serialized).hexdigest()
+    if old_hash == new_hash:
+        return False
     unitdata.kv().set(key, new_hash)
-    return old_hash != new_hash
+    return True
+
+
+def data_changed_many(data, hash_type=None):
+    """
+    Check which of several sets of data have changed since the previous call.
+
+    This is equivalent to calling :func:`data_changed` for each item, but the
+    previous hashes are all read at once, and only the ones which changed
+    are written back.
+
+    By default, the data is hashed with a 16 byte BLAKE2b digest (or MD5, if
+    :mod:`hashlib` doesn't support BLAKE2), which is faster than the MD5
+    used by :func:`data_changed`.  Since the hashes are stored under the same
+    keys, pass ``hash_type='md5'`` when switching existing calls to
+    :func:`data_changed` over, or they will be reported as changed once.
+
+    :param dict data: Mapping of unique identifiers to JSON-serializable data.
+    :param str hash_type: Any hash algorithm supported by :mod:`hashlib`.
+    :return: A dict mapping each identifier to whether its data has changed.
+    """
+    if not data:
+        return {}
+    prefix = 'reactive.data_changed.'
+    alg = _hash_function(hash_type)
+    kv = unitdata.kv()
+    old_hashes = kv.getrange(prefix + os.path.commonprefix(list(data)))
+    changed = {}
+    new_hashes = {}
+    for data_id, value in data.items():
+        key = prefix + data_id
+        serialized = json.dumps(value, sort_keys=True).encode('utf8')
+        new_hash = alg(serialized).hexdigest()
+        changed[data_id] = old_hashes.get(key) != new_hash
+        if changed[data_id]:
+            new_hashes[key] = new_hash
+    if new_hashes:
+        kv.update(new_hashes)
+    return changed
+
+
+def _hash_function(hash_type):
+    if hash_type is None:
+        if hasattr(hashlib, 'blake2b'):
+            return functools.partial(hashlib.blake2b, digest_size=16)
+        hash_type = 'md5'
+    return getattr(hashlib, hash_type)
 
 
 def _hook(hook_patterns):
@@ -0,0 +1,165 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Logging for charms.reactive.
+
+Each call to :func:`~charmhelpers.core.hookenv.log` runs ``juju-log``, which
+adds up when the dispatcher logs every handler that it invokes, or, with
+``REACTIVE_LOG_OPTS=register``, every handler and predicate that is
+registered.
+
+While :func:`buffered` is active (i.e., during :func:`~charms.reactive.main`),
+messages are collected in memory and written out in a few batches instead,
+with consecutive messages of the same level joined into a single
+``juju-log`` call.  So that messages from the charm keep their place among
+the framework's, ``hookenv.log`` is redirected into the buffer as well.  The
+buffer is written out before any warning or error, before invoking each
+handler (so that a handler which hangs still shows up in the log), whenever
+it grows large, and at the end of the block.  Setting
+``REACTIVE_LOG_OPTS=unbuffered`` disables this.
+
+The framework's own messages can be limited to those at or above a given
+level by setting the ``REACTIVE_LOG_LEVEL`` environment variable (e.g., to
+``INFO``); messages below it are not even formatted.
+"""
+
+import os
+from contextlib import contextmanager
+
+from charmhelpers.core import hookenv
+
+
+LEVELS = {
+    hookenv.TRACE: 5,
+    hookenv.DEBUG: 10,
+    hookenv.INFO: 20,
+    hookenv.WARNING: 30,
+    hookenv.ERROR: 40,
+    hookenv.CRITICAL: 50,
+}
+
+THRESHOLD = os.environ.get('REACTIVE_LOG_LEVEL', hookenv.DEBUG).upper()
+
+# largest batch to send in a single juju-log call, well within the maximum
+# argument size which hookenv.log truncates messages to
+BATCH_SIZE = 64 * 1024
+
+_buffer = {
+    'active': False,
+    'log': None,
+    'pending': [],
+    'size': 0,
+}
+
+
+def _rank(level):
+    # juju-log defaults to INFO
+    return LEVELS.get((level or hookenv.INFO).upper(), LEVELS[hookenv.INFO])
+
+
+def enabled(level):
+    """
+    Whether messages from charms.reactive at the given level are logged.
+    """
+    return _rank(level) >= _rank(THRESHOLD)
+
+
+def log(message, *args, level=None):
+    """
+    Log a message from charms.reactive, if its level is enabled.
+
+    :param str message: The message, which is formatted with ``args``, using
+        ``%``, only if it is going to be logged.
+    :param str level: The level of the message, as for
+        :func:`~charmhelpers.core.hookenv.log`.
+    """
+    if not enabled(level):
+        return
+    if args:
+        message = message % args
+    _emit(message, level)
+
+
+def _emit(message, level):
+    if not _buffer['active']:
+        hookenv.log(message, level=level)
+        return
+    if _rank(level) >= LEVELS[hookenv.WARNING]:
+        flush()
+        _buffer['log'](message, level=level)
+        return
+    _buffer['pending'].append((level, message))
+    _buffer['size'] += len(message) + 1
+    if _buffer['size'] >= BATCH_SIZE:
+        flush()
+
+
+def _buffered_hookenv_log(message, level=None):
+    if not isinstance(message, str):
+        message = repr(message)
+    _emit(message, level)
+
+
+def flush():
+    """
+    Write out the buffered messages, if any.
+    """
+    pending = _buffer['pending']
+    if not pending:
+        return
+    _buffer.update({
+        'pending': [],
+        'size': 0,
+    })
+    batch_level, batch, size = pending[0][0], [], 0
+    for level, message in pending:
+        if batch and (level != batch_level or size + len(message) > BATCH_SIZE):
+            _buffer['log']('\n'.join(batch), level=batch_level)
+            batch, size = [], 0
+        batch_level = level
+        batch.append(message)
+        size += len(message) + 1
+    _buffer['log']('\n'.join(batch), level=batch_level)
+
+
+@contextmanager
+def buffered(enabled=True):
+    """
+    Buffer log messages for the duration of the block.
+
+    :param bool enabled: If False, messages are not buffered.
+    """
+    if _buffer['active'] or not enabled:
+        # already buffering, e.g. from a nested main()
+        yield
+        return
+    original = hookenv.log
+    _buffer.update({
+        'active': True,
+        'log': original,
+        'pending': [],
+        'size': 0,
+    })
+    hookenv.log = _buffered_hookenv_log
+    try:
+        yield
+    finally:
+        if hookenv.log is _buffered_hookenv_log:
+            hookenv.log = original
+        flush()
+        _buffer['active'] = False
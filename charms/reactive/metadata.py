@@ -0,0 +1,173 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+
+import yaml
+
+from charmhelpers.core import hookenv
+
+
+ROLES = ('provides', 'requires', 'peers')
+CACHE_FILENAME = '.metadata.endpoints.json'
+
+
+class EndpointIndex(object):
+    """
+    Immutable index of the endpoints declared in a charm's ``metadata.yaml``.
+
+    This answers the same questions as
+    :func:`~charmhelpers.core.hookenv.relation_types`,
+    :func:`~charmhelpers.core.hookenv.relation_to_role_and_interface`, and
+    :func:`~charmhelpers.core.hookenv.role_and_interface_to_relations`, but
+    with simple dict lookups.
+
+    :param list endpoints: List of ``(name, role, interface)`` tuples, in the
+        order in which they are declared in the metadata.
+    """
+    def __init__(self, endpoints):
+        self._endpoints = tuple(tuple(endpoint) for endpoint in endpoints)
+        self._by_name = {}
+        self._by_role = {}
+        for name, role, interface in self._endpoints:
+            self._by_name.setdefault(name, (role, interface))
+            self._by_role.setdefault((role, interface), []).append(name)
+        self._by_role = {key: tuple(names)
+                         for key, names in self._by_role.items()}
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        """
+        Build an index from the parsed contents of ``metadata.yaml``.
+        """
+        endpoints = []
+        for role in ROLES:
+            for name, relation in (metadata.get(role) or {}).items():
+                endpoints.append((name, role, (relation or {}).get('interface')))
+        return cls(endpoints)
+
+    @property
+    def endpoints(self):
+        """
+        Tuple of ``(name, role, interface)`` tuples for all endpoints.
+        """
+        return self._endpoints
+
+    def relation_types(self):
+        """
+        Return a list of the names of all endpoints.
+        """
+        return [name for name, role, interface in self._endpoints]
+
+    def relation_to_role_and_interface(self, relation_name):
+        """
+        Return the ``(role, interface)`` tuple for the given endpoint name,
+        or ``(None, None)`` if it is not known or has no interface.
+        """
+        role, interface = self._by_name.get(relation_name, (None, None))
+        if not interface:
+            return None, None
+        return role, interface
+
+    def role_and_interface_to_relations(self, role, interface_name):
+        """
+        Return a list of the names of the endpoints with the given role and
+        interface.
+        """
+        return list(self._by_role.get((role, interface_name), ()))
+
+
+_index_cache = {
+    'key': None,
+    'index': None,
+}
+
+
+def endpoint_index():
+    """
+    Return the :class:`EndpointIndex` for the current charm.
+
+    The index is built once and reused until the charm's ``metadata.yaml``
+    changes.  If the ``REACTIVE_METADATA_CACHE`` environment variable is set
+    to ``true``, the index is also persisted to a file next to
+    ``metadata.yaml`` so that later processes can load it without having to
+    parse the YAML.
+    """
+    charm_dir = hookenv.charm_dir()
+    md_path = charm_dir and os.path.join(charm_dir, 'metadata.yaml')
+    md_key = md_path and _metadata_key(md_path)
+    if not md_key:
+        # can't tell when it changes, so don't hold on to it
+        return EndpointIndex.from_metadata(hookenv.metadata() or {})
+    key = (charm_dir, md_key)
+    if _index_cache['key'] == key:
+        return _index_cache['index']
+
+    use_cache_file = os.environ.get('REACTIVE_METADATA_CACHE') == 'true'
+    cache_path = os.path.join(charm_dir, CACHE_FILENAME)
+    index = None
+    if use_cache_file:
+        index = _load_cache_file(cache_path, md_key)
+    if index is None:
+        # hookenv.metadata() is cached for the life of the process, so would
+        # return the old contents if the file has changed
+        index = EndpointIndex.from_metadata(_load_metadata(md_path))
+        if use_cache_file:
+            _save_cache_file(cache_path, md_key, index)
+    _index_cache.update({
+        'key': key,
+        'index': index,
+    })
+    return index
+
+
+def _metadata_key(md_path):
+    try:
+        md_stat = os.stat(md_path)
+    except OSError:
+        return None
+    return [md_stat.st_size, md_stat.st_mtime_ns]
+
+
+def _load_metadata(md_path):
+    with open(md_path) as fp:
+        return yaml.safe_load(fp) or {}
+
+
+def _load_cache_file(cache_path, md_key):
+    try:
+        with open(cache_path) as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if data.get('metadata') != md_key:
+        return None
+    return EndpointIndex(data['endpoints'])
+
+
+def _save_cache_file(cache_path, md_key, index):
+    tmp_path = '{}.{}'.format(cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'w') as fp:
+            json.dump({
+                'metadata': md_key,
+                'endpoints': index.endpoints,
+            }, fp)
+        os.rename(tmp_path, cache_path)
+    except OSError as e:
+        hookenv.log('Unable to save endpoint cache: {}'.format(e),
+                    hookenv.DEBUG)
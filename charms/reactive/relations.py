@@ -17,17 +17,20 @@
 import os
 import sys
 import importlib
+from collections import OrderedDict
 from inspect import isclass
 
 from charmhelpers.core import hookenv
 from charmhelpers.core import unitdata
 from charmhelpers.cli import cmdline
-from charms.reactive.flags import get_flags
 from charms.reactive.flags import _get_flag_value
 from charms.reactive.flags import set_flag
 from charms.reactive.flags import clear_flag
+from charms.reactive.flags import flag_generation
 from charms.reactive.flags import StateList
+from charms.reactive.flags import _clear_hooks
 from charms.reactive.bus import _append_path
+from charms.reactive.metadata import endpoint_index
 
 __all__ = [
     'endpoint_from_flag',
@@ -42,6 +45,29 @@ __all__ = [
 ALL = object()
 TOGGLE = object()
 
+# version of the stored conversation format, recorded once the stored
+# conversations have been migrated to it
+CONVERSATION_SCHEMA = 3
+CONVERSATION_SCHEMA_KEY = 'reactive.conversations_schema'
+
+# data set on the remote end(s) of conversations during a hook, by relation
+# ID, which is published when the hook exits, and hookenv.relation_set, which
+# is replaced in the meantime (see _direct_relation_set)
+_remote_writes = {
+    'buffered': False,
+    'pending': OrderedDict(),
+    'relation_set': None,
+}
+
+# relation data read by _remote_data during the hook, by relation ID and unit
+_relation_data = {}
+
+# the conversations in each conversation-scoped flag are stored as separate
+# keys, so that they can be checked and changed without loading all of them
+CONVERSATION_STATES_PREFIX = 'reactive.conversation_states.'
+# marks the values of the flags whose conversations are stored that way
+MEMBER_KEYS = 'member_keys'
+
 
 def endpoint_from_name(endpoint_name):
     """The object used for interacting with the named relations, or None.
@@ -75,7 +101,7 @@ def endpoint_from_flag(flag):
     elif '.' in flag:
         # might be an unprefixed new-style Endpoint
         relation_name = flag.split('.')[0]
-        if relation_name not in hookenv.relation_types():
+        if relation_name not in endpoint_index().relation_types():
             return None
     if relation_name:
         factory = relation_factory(relation_name)
@@ -123,7 +149,7 @@ def relation_factory(relation_name):
     Looks for a RelationFactory in the first file matching:
     ``$CHARM_DIR/hooks/relations/{interface}/{provides,requires,peer}.py``
     """
-    role, interface = hookenv.relation_to_role_and_interface(relation_name)
+    role, interface = endpoint_index().relation_to_role_and_interface(relation_name)
     if not (role and interface):
         hookenv.log('Unable to determine role and interface for relation '
                     '{}'.format(relation_name), hookenv.ERROR)
@@ -152,7 +178,37 @@ def _relation_module(role, interface):
         hookenv.log('Unable to find implementation for relation: '
                     '{} of {}'.format(role, interface), hookenv.ERROR)
         return None
-    return sys.modules[module]
+    name, module = module, sys.modules[module]
+    cached = _factories_by_module.get(name)
+    if cached is None or cached[0] is not module:
+        # relation modules don't change once imported, so they only need
+        # to be scanned for factories once
+        _factories_by_module[name] = (module, _scan_factories(module))
+    return module
+
+
+def _scan_factories(module):
+    return [o for o in (getattr(module, attr) for attr in dir(module))
+            if isclass(o) and issubclass(o, RelationFactory)]
+
+
+def _module_factories(module):
+    """
+    Return the :class:`RelationFactory` subclasses available in the module,
+    in the order of ``dir(module)``.
+
+    Relation modules loaded by :func:`_relation_module` are only scanned
+    once; any other module is scanned each time.
+    """
+    cached = _factories_by_module.get(module.__name__)
+    if cached is not None and cached[0] is module:
+        return cached[1]
+    return _scan_factories(module)
+
+
+# Module name to the relation module and the RelationFactory subclasses
+# found in it.
+_factories_by_module = {}
 
 
 def _find_relation_factory(module):
@@ -166,11 +222,9 @@ def _find_relation_factory(module):
         return None
 
     # All the RelationFactory subclasses
-    candidates = [o for o in (getattr(module, attr) for attr in dir(module))
+    candidates = [o for o in _module_factories(module)
                   if (o is not RelationFactory and
-                      o is not RelationBase and
-                      isclass(o) and
-                      issubclass(o, RelationFactory))]
+                      o is not RelationBase)]
 
     # Filter out any factories that are superclasses of another factory
     # (none of the other factories subclass it). This usually makes
@@ -312,6 +366,18 @@ class RelationBase(RelationFactory, metaclass=AutoAccessors):
         # update data to be backwards compatible after fix for issue 28
         _migrate_conversations()
 
+        relation_set = hookenv.relation_set
+        if relation_set is _direct_relation_set:
+            relation_set = _remote_writes['relation_set']
+        _relation_data.clear()
+        _remote_writes.update({
+            'buffered': True,
+            'pending': OrderedDict(),
+            'relation_set': relation_set,
+        })
+        hookenv.relation_set = _direct_relation_set
+        hookenv.atexit(_flush_remote_writes)
+
         if hookenv.hook_name().endswith('-relation-departed'):
             def depart_conv():
                 cls(hookenv.relation_type()).conversation().depart()
@@ -349,7 +415,7 @@ class RelationBase(RelationFactory, metaclass=AutoAccessors):
         if value is None:
             return None
         relation_name = value['relation']
-        conversations = Conversation.load(value['conversations'])
+        conversations = Conversation.load(_flag_conversations(flag, value))
         return cls.from_name(relation_name, conversations)
 
     @classmethod
@@ -365,7 +431,7 @@ class RelationBase(RelationFactory, metaclass=AutoAccessors):
         relation_class = cls._cache.get(relation_name)
         if relation_class:
             return relation_class(relation_name, conversations)
-        role, interface = hookenv.relation_to_role_and_interface(relation_name)
+        role, interface = endpoint_index().relation_to_role_and_interface(relation_name)
         if role and interface:
             relation_class = cls._find_impl(role, interface)
             if relation_class:
@@ -392,10 +458,8 @@ class RelationBase(RelationFactory, metaclass=AutoAccessors):
         This is to prevent picking up :class:`RelationBase` being imported to be
         used as the base class.
         """
-        for attr in dir(module):
-            candidate = getattr(module, attr)
-            if (isclass(candidate) and issubclass(candidate, cls) and
-                    candidate is not RelationBase):
+        for candidate in _module_factories(module):
+            if issubclass(candidate, cls) and candidate is not RelationBase:
                 return candidate
         return None
 
@@ -506,6 +570,19 @@ class RelationBase(RelationFactory, metaclass=AutoAccessors):
         """
         return self.conversation(scope).get_remote(key, default)
 
+    def get_remote_many(self, keys, default=None, scope=None):
+        """
+        Get several values from the remote end(s) of the :class:`Conversation`
+        with the given scope.
+
+        In Python, this is equivalent to::
+
+            relation.conversation(scope).get_remote_many(keys, default)
+
+        See :meth:`conversation` and :meth:`Conversation.get_remote_many`.
+        """
+        return self.conversation(scope).get_remote_many(keys, default)
+
     def set_local(self, key=None, value=None, data=None, scope=None, **kwdata):
         """
         Locally store some data, namespaced by the current or given :class:`Conversation` scope.
@@ -676,12 +753,20 @@ class Conversation(object):
         :meth:`~charmhelpers.core.unitdata.Storage.flush` be called.
         """
         state = state.format(relation_name=self.relation_name)
-        value = _get_flag_value(state, {
-            'relation': self.relation_name,
-            'conversations': [],
-        })
-        if self.key not in value['conversations']:
-            value['conversations'].append(self.key)
+        value = _get_conversation_flag(state)
+        if not value:
+            # drop any members left over from an earlier time it was set
+            _drop_conversation_members(state)
+            value = {
+                'relation': self.relation_name,
+                'generation': flag_generation(),
+                'count': 0,
+                MEMBER_KEYS: True,
+            }
+        member_key = _member_key(state, self.key)
+        if unitdata.kv().get(member_key) != value['generation']:
+            unitdata.kv().set(member_key, value['generation'])
+            value['count'] += 1
         set_flag(state, value)
 
     def remove_state(self, state):
@@ -700,12 +785,14 @@ class Conversation(object):
         conversations are in this the state, will deactivate it.
         """
         state = state.format(relation_name=self.relation_name)
-        value = _get_flag_value(state)
+        value = _get_conversation_flag(state)
         if not value:
             return
-        if self.key in value['conversations']:
-            value['conversations'].remove(self.key)
-        if value['conversations']:
+        member_key = _member_key(state, self.key)
+        if unitdata.kv().get(member_key) == value['generation']:
+            unitdata.kv().unset(member_key)
+            value['count'] -= 1
+        if value['count'] > 0:
             set_flag(state, value)
         else:
             clear_flag(state)
@@ -715,10 +802,10 @@ class Conversation(object):
         Test if this conversation is in the given state.
         """
         state = state.format(relation_name=self.relation_name)
-        value = _get_flag_value(state)
+        value = _get_conversation_flag(state)
         if not value:
             return False
-        return self.key in value['conversations']
+        return unitdata.kv().get(_member_key(state, self.key)) == value['generation']
 
     def toggle_state(self, state, active=TOGGLE):
         """
@@ -756,6 +843,11 @@ class Conversation(object):
         However, if this conversation's scope encompasses multiple services,
         the data will be set for all of those services.
 
+        During a hook, the data is published when the hook exits successfully,
+        with a single ``relation-set`` call for each relation, or before any
+        other ``relation-set`` for the same relation, through
+        :func:`~charmhelpers.core.hookenv.relation_set`.
+
         :param str key: The name of a field to set.
         :param value: A value to set. This value must be json serializable.
         :param dict data: A mapping of keys to values.
@@ -769,7 +861,11 @@ class Conversation(object):
         if not data:
             return
         for relation_id in self.relation_ids:
-            hookenv.relation_set(relation_id, data)
+            if _remote_writes['buffered']:
+                pending = _remote_writes['pending'].setdefault(relation_id, {})
+                pending.update(data)
+            else:
+                hookenv.relation_set(relation_id, data)
 
     def get_remote(self, key, default=None):
         """
@@ -780,23 +876,50 @@ class Conversation(object):
         relying on a single leader to set the data or by all units eventually
         converging to identical data.  Thus, this method returns the first
         value that it finds set by any of its units.
+
+        All of the data for each remote unit is fetched at once, and cached
+        for the rest of the hook, so getting several values from the same
+        units doesn't cost a ``relation-get`` call for each one.  See also
+        :meth:`get_remote_many`.
+        """
+        return self.get_remote_many([key], default)[key]
+
+    def get_remote_many(self, keys, default=None):
+        """
+        Get several values from the remote end(s) of this conversation.
+
+        As with :meth:`get_remote`, the first value found set by any of the
+        conversation's units is used for each key.
+
+        :param list keys: The names of the fields to get.
+        :param default: The value to use for fields which are not set.
+        :return: A dict mapping each key to its value.
         """
+        missing = set(keys)
+        found = {}
         cur_rid = hookenv.relation_id()
         departing = hookenv.hook_name().endswith('-relation-departed')
         for relation_id in self.relation_ids:
+            if not missing:
+                break
             units = hookenv.related_units(relation_id)
             if departing and cur_rid == relation_id:
                 # Work around the fact that Juju 2.0 doesn't include the
                 # departing unit in relation-list during the -departed hook,
                 # by adding it back in ourselves.
-                units.append(hookenv.remote_unit())
+                units = units + [hookenv.remote_unit()]
             for unit in units:
                 if unit not in self.units:
                     continue
-                value = hookenv.relation_get(key, unit, relation_id)
-                if value:
-                    return value
-        return default
+                data = _remote_data(relation_id, unit)
+                for key in list(missing):
+                    value = data.get(key)
+                    if value:
+                        found[key] = value
+                        missing.remove(key)
+                if not missing:
+                    break
+        return {key: found.get(key, default) for key in keys}
 
     def set_local(self, key=None, value=None, data=None, **kwdata):
         """
@@ -838,16 +961,172 @@ class Conversation(object):
         return unitdata.kv().get(key, default)
 
 
-def _migrate_conversations():  # noqa
+def _flush_remote_writes():
+    """
+    Publish the data set by :meth:`Conversation.set_remote` during the hook,
+    and stop buffering it.
+    """
+    relation_set = _remote_writes['relation_set']
+    pending = _remote_writes['pending']
+    _remote_writes.update({
+        'buffered': False,
+        'pending': OrderedDict(),
+        'relation_set': None,
+    })
+    if relation_set is None:
+        return
+    hookenv.relation_set = relation_set
+    for relation_id, data in pending.items():
+        _publish(relation_set, relation_id, data)
+
+
+def _direct_relation_set(relation_id=None, *args, **kwargs):
+    """
+    Stand-in for :func:`~charmhelpers.core.hookenv.relation_set` while
+    :meth:`Conversation.set_remote` writes are buffered.
+
+    Any writes buffered for the relation are published first, so that they
+    can't overwrite the values set here when the hook exits.
+    """
+    relation_set = _remote_writes['relation_set']
+    rid = relation_id or hookenv.relation_id()
+    data = _remote_writes['pending'].pop(rid, None)
+    if data:
+        _publish(relation_set, rid, data)
+    _relation_data.pop((rid, hookenv.local_unit()), None)
+    return relation_set(relation_id, *args, **kwargs)
+
+
+def _publish(relation_set, relation_id, data):
+    # values which the unit is known to have published already are left
+    # out, but its published data isn't fetched just to check
+    published = _relation_data.pop((relation_id, hookenv.local_unit()), None)
+    if published is not None:
+        data = {key: value for key, value in data.items()
+                if _format_remote(value) != (published.get(key) or '')}
+    if data:
+        relation_set(relation_id, data)
+
+
+def _format_remote(value):
+    # relation-set stores all values as strings, and unsets empty ones
+    return '' if value is None else '{}'.format(value)
+
+
+def _remote_data(relation_id, unit):
+    """
+    Return all of the data published by a remote unit on a relation.
+
+    :func:`~charmhelpers.core.hookenv.relation_get` caches its results for the
+    rest of the hook, so each unit's data is only fetched once.
+    """
+    data = _relation_data[relation_id, unit] = \
+        hookenv.relation_get(unit=unit, rid=relation_id) or {}
+    return data
+
+
+def _member_key(flag, conversation_key):
+    return '%s%s.%s' % (CONVERSATION_STATES_PREFIX, flag, conversation_key)
+
+
+def _get_conversation_flag(flag):
+    """
+    Get the value of a conversation-scoped flag, moving its conversations out
+    to separate keys first if it is still in the old format.
+    """
+    value = _get_flag_value(flag)
+    if isinstance(value, dict) and 'conversations' in value:
+        value = _index_conversation_flag(flag, value)
+    return value
+
+
+def _index_conversation_flag(flag, value):
+    """
+    Move the list of conversations in the value of a conversation-scoped
+    flag out to separate keys.
+
+    Each key records the flag generation at which the flag was set, so that
+    keys left over from an earlier time that the flag was set are ignored.
+    """
+    kv = unitdata.kv()
+    conversations = set(value.pop('conversations'))
+    _drop_conversation_members(flag)
+    value['generation'] = flag_generation()
+    value['count'] = len(conversations)
+    value[MEMBER_KEYS] = True
+    kv.update({_member_key(flag, key): value['generation']
+               for key in conversations})
+    kv.set('reactive.states.%s' % flag, value)
+    return value
+
+
+def _drop_conversation_members(flag):
+    """
+    Remove the keys recording which conversations are in a conversation-scoped
+    flag, such as when it is cleared.
+    """
+    kv = unitdata.kv()
+    prefix = _member_key(flag, 'reactive.conversations.')
+    for key in list(kv.getrange(prefix)):
+        # getrange uses LIKE, which treats _ as a wildcard
+        if key.startswith(prefix):
+            kv.unset(key)
+
+
+def _conversation_flag_cleared(flag, value):
+    if isinstance(value, dict) and value.get(MEMBER_KEYS):
+        _drop_conversation_members(flag)
+
+
+_clear_hooks.append(_conversation_flag_cleared)
+
+
+def _flag_conversations(flag, value):
+    """
+    Return the sorted keys of the conversations in a conversation-scoped flag.
+    """
+    if 'conversations' in value:
+        return value['conversations']
+    base = _member_key(flag, '')
+    prefix = base + 'reactive.conversations.'
+    members = unitdata.kv().getrange(prefix)
+    return sorted(key[len(base):]
+                  for key, generation in members.items()
+                  # getrange uses LIKE, which treats _ as a wildcard
+                  if key.startswith(prefix) and generation == value['generation'])
+
+
+def _migrate_conversations():
+    """
+    Update the stored conversations, and the flags referring to them, to the
+    current format, if they have not been already.  The schema version is
+    recorded once done, so that later hooks don't have to scan them again.
+
+    TODO: Remove in 2.0.0
+    """
+    kv = unitdata.kv()
+    schema = kv.get(CONVERSATION_SCHEMA_KEY, 1)
+    if schema >= CONVERSATION_SCHEMA:
+        return
+    if schema < 2:
+        _split_conversations()
+    if schema < 3:
+        for flag, value in kv.getrange('reactive.states.', strip=True).items():
+            if isinstance(value, dict) and 'conversations' in value:
+                _index_conversation_flag(flag, value)
+    kv.set(CONVERSATION_SCHEMA_KEY, CONVERSATION_SCHEMA)
+
+
+def _split_conversations():
     """
     Due to issue #28 (https://github.com/juju-solutions/charms.reactive/issues/28),
     conversations needed to be updated to be namespaced per relation ID for SERVICE
     and UNIT scope.  To ensure backwards compatibility, this updates all convs in
     the old format to the new.
-
-    TODO: Remove in 2.0.0
     """
-    for key, data in unitdata.kv().getrange('reactive.conversations.').items():
+    kv = unitdata.kv()
+    renamed = {}
+    for key, data in kv.getrange('reactive.conversations.').items():
         if 'local-data' in key:
             continue
         if 'namespace' in data:
@@ -855,7 +1134,7 @@ def _migrate_conversations():  # noqa
         relation_name = data.pop('relation_name')
         if data['scope'] == scopes.GLOBAL:
             data['namespace'] = relation_name
-            unitdata.kv().set(key, data)
+            kv.set(key, data)
         else:
             # split the conv based on the relation ID
             new_keys = []
@@ -863,24 +1142,40 @@ def _migrate_conversations():  # noqa
                 new_key = Conversation._key(rel_id, data['scope'])
                 new_units = set(hookenv.related_units(rel_id)) & set(data['units'])
                 if new_units:
-                    unitdata.kv().set(new_key, {
+                    kv.set(new_key, {
                         'namespace': rel_id,
                         'scope': data['scope'],
                         'units': sorted(new_units),
                     })
                     new_keys.append(new_key)
-            unitdata.kv().unset(key)
-            # update the states pointing to the old conv key to point to the
-            # (potentially multiple) new key(s)
-            for flag in get_flags():
-                value = _get_flag_value(flag)
-                if not value:
-                    continue
-                if key not in value['conversations']:
-                    continue
-                value['conversations'].remove(key)
-                value['conversations'].extend(new_keys)
-                set_flag(flag, value)
+            kv.unset(key)
+            renamed[key] = new_keys
+    if renamed:
+        _rename_flag_conversations(renamed)
+
+
+def _rename_flag_conversations(renamed):
+    """
+    Update the flags pointing to the old conv keys to point to the
+    (potentially multiple) new key(s), in a single pass over the flags.
+
+    :param dict renamed: Mapping of old conv keys to lists of new keys.
+    """
+    kv = unitdata.kv()
+    updated = {}
+    for flag, value in kv.getrange('reactive.states.', strip=True).items():
+        if not isinstance(value, dict):
+            continue
+        conversations = value.get('conversations') or []
+        if not renamed.keys() & set(conversations):
+            continue
+        new_conversations = []
+        for conv_key in conversations:
+            new_conversations.extend(renamed.get(conv_key, [conv_key]))
+        value['conversations'] = new_conversations
+        updated[flag] = value
+    if updated:
+        kv.update(updated, prefix='reactive.states.')
 
 
 @cmdline.subcommand()
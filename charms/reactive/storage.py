@@ -0,0 +1,151 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from contextlib import contextmanager
+
+from charmhelpers.core import unitdata
+
+
+class BufferedStorage(object):
+    """
+    Write-back overlay for a :class:`~charmhelpers.core.unitdata.Storage`.
+
+    Changes to the keys owned by charms.reactive (those starting with
+    ``reactive.``) are held in memory and are only written to the underlying
+    database, in a single batch, when :meth:`flush` is called.  Reads of those
+    keys see the buffered changes.  All other keys, and any other attribute
+    of the underlying storage, are passed straight through.
+    """
+    prefix = 'reactive.'
+
+    def __init__(self, storage):
+        self._storage = storage
+        # maps key to its JSON-serialized value, or None if it was unset
+        self._pending = {}
+
+    def __getattr__(self, name):
+        # anything not handled here (e.g., hook_scope or direct cursor access)
+        # needs to see the buffered changes, so write them out first
+        self._write()
+        return getattr(self._storage, name)
+
+    def get(self, key, default=None, record=False):
+        if key not in self._pending:
+            if record:
+                return self._storage.get(key, default, record=record)
+            return self._storage.get(key, default)
+        serialized = self._pending[key]
+        if serialized is None:
+            return default
+        value = json.loads(serialized)
+        if record:
+            return unitdata.Record(value)
+        return value
+
+    def getrange(self, key_prefix, strip=False):
+        result = self._storage.getrange(key_prefix) or {}
+        for key, serialized in self._pending.items():
+            if not key.startswith(key_prefix):
+                continue
+            if serialized is None:
+                result.pop(key, None)
+            else:
+                result[key] = json.loads(serialized)
+        if strip:
+            result = {key[len(key_prefix):]: value
+                      for key, value in result.items()}
+        return result
+
+    def set(self, key, value):
+        if not key.startswith(self.prefix):
+            return self._storage.set(key, value)
+        self._pending[key] = json.dumps(value)
+        return value
+
+    def update(self, mapping, prefix=''):
+        for key, value in mapping.items():
+            self.set('%s%s' % (prefix, key), value)
+
+    def unset(self, key):
+        if not key.startswith(self.prefix):
+            return self._storage.unset(key)
+        self._pending[key] = None
+
+    def flush(self, save=True):
+        """
+        Write out any buffered changes and flush the underlying storage.
+
+        If ``save`` is ``False``, the buffered changes are discarded instead.
+        """
+        if save:
+            self._write()
+        else:
+            self._pending.clear()
+        self._storage.flush(save)
+
+    def _write(self):
+        """
+        Apply the buffered changes to the underlying storage, without
+        committing them.
+        """
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        cursor = getattr(self._storage, 'cursor', None)
+        if cursor is None or getattr(self._storage, 'revision', None):
+            # either not an SQLite storage, or it is recording a revision
+            # history for the current hook_scope, which only set and unset
+            # know how to maintain
+            for key, serialized in sorted(pending.items()):
+                if serialized is None:
+                    self._storage.unset(key)
+                else:
+                    self._storage.set(key, json.loads(serialized))
+            return
+        cursor.executemany('insert or replace into kv (key, data) values (?, ?)',
+                           [(key, serialized)
+                            for key, serialized in sorted(pending.items())
+                            if serialized is not None])
+        cursor.executemany('delete from kv where key=?',
+                           [(key,)
+                            for key, serialized in sorted(pending.items())
+                            if serialized is None])
+
+
+@contextmanager
+def buffered_writes():
+    """
+    Buffer changes to the keys owned by charms.reactive in
+    :func:`unitdata.kv() <charmhelpers.core.unitdata.kv>` for the duration of
+    the block.
+
+    The buffered changes are written out when the block completes
+    successfully, to be persisted with the next ``unitdata.kv().flush()``.
+    If the block raises, they are discarded, just as unflushed changes to the
+    storage itself would be.
+    """
+    storage = unitdata.kv()
+    if isinstance(storage, BufferedStorage):
+        # already buffering, e.g. from a nested main()
+        yield storage
+        return
+    buffered = unitdata._KV = BufferedStorage(storage)
+    try:
+        yield buffered
+        buffered._write()
+    finally:
+        unitdata._KV = storage
@@ -0,0 +1,451 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Recording and replaying of hook runs.
+
+If the ``REACTIVE_TRACE_FILE`` environment variable is set when
+:func:`~charms.reactive.main` runs, a trace of the run is written to the path
+it names (or, if it names a directory, to a file in it named after the hook).
+The trace contains the hook name and ``JUJU_*`` environment, the framework's
+data from the unit's database at the start of the hook (flags, triggers,
+etc.), the config saved by the previous hook, the results of the calls made
+to the Juju hook tools through :mod:`~charmhelpers.core.hookenv`, the
+handlers invoked, in order, with the flags that each one set and cleared,
+and how long each step took.
+
+The ``charms.reactive replay`` command runs the hook again, against the
+same charm, using a temporary copy of the recorded data and serving the
+hook tool calls from the trace, and compares the two runs.
+
+Note that traces contain relation data and config, which may include
+secrets.  Only calls made through the ``hookenv`` module are recorded, so
+code which imports the functions directly, and external handlers, will
+talk to the real hook tools when replayed.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from contextlib import contextmanager
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+
+from charms.reactive import bus
+from charms.reactive.flags import get_flags
+
+
+TRACE_ENV = 'REACTIVE_TRACE_FILE'
+TRACE_VERSION = 1
+
+# hookenv functions which get their answers from the Juju agent
+RECORDED_CALLS = (
+    'action_get',
+    'config',
+    'goal_state',
+    'is_leader',
+    'leader_get',
+    'network_get',
+    'related_units',
+    'relation_get',
+    'relation_ids',
+    'status_get',
+    'storage_get',
+    'storage_list',
+    'unit_get',
+)
+
+# hookenv functions which change something outside of the charm
+WRITE_CALLS = (
+    'action_fail',
+    'action_set',
+    'application_version_set',
+    'close_port',
+    'close_ports',
+    'leader_set',
+    'open_port',
+    'open_ports',
+    'relation_set',
+    'status_set',
+)
+
+# framework functions which are timed as the steps of the hook
+STEPS = (
+    (bus, 'discover'),
+    (hookenv, '_run_atstart'),
+    (bus, 'dispatch'),
+    (hookenv, '_run_atexit'),
+)
+
+
+class TraceError(Exception):
+    pass
+
+
+def _call_key(name, args, kwargs):
+    return json.dumps([name, args, kwargs], sort_keys=True, default=str)
+
+
+class _Patcher(object):
+    def __init__(self):
+        self._originals = []
+
+    def patch(self, obj, name, replacement):
+        self._originals.append((obj, name, obj.__dict__[name]))
+        setattr(obj, name, replacement)
+
+    def restore(self):
+        while self._originals:
+            obj, name, original = self._originals.pop()
+            setattr(obj, name, original)
+
+
+class Recorder(object):
+    """
+    Record a trace of a hook run, between :meth:`start` and :meth:`stop`.
+    """
+    def __init__(self):
+        self.trace = None
+        self._patcher = _Patcher()
+        self._start = None
+        self._started_at = None
+
+    def start(self):
+        env = {key: value for key, value in os.environ.items()
+               if key.startswith('JUJU_') or key == 'CHARM_DIR'}
+        self.trace = {
+            'version': TRACE_VERSION,
+            'hook': hookenv.hook_name(),
+            'env': env,
+            'initial': unitdata.kv().getrange('reactive.'),
+            'previous_config': _previous_config(),
+            'calls': {},
+            'writes': [],
+            'handlers': [],
+            'steps': {},
+        }
+        for name in RECORDED_CALLS:
+            if hasattr(hookenv, name):
+                self._patcher.patch(hookenv, name, self._recorded(name))
+        for name in WRITE_CALLS:
+            if hasattr(hookenv, name):
+                self._patcher.patch(hookenv, name, self._write(name))
+        for obj, name in STEPS:
+            self._patcher.patch(obj, name, self._step(name, getattr(obj, name)))
+        for cls in (bus.Handler, bus.ExternalHandler):
+            self._patcher.patch(cls, 'invoke', self._invoke(cls.__dict__['invoke']))
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.trace['steps']['total'] = time.perf_counter() - self._start
+        self._patcher.restore()
+
+    def save(self, path):
+        """
+        Write the trace to ``path``, or to a file in it if it is a directory.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, '{}-{}.json'.format(
+                self.trace['hook'], int(self._started_at)))
+        save(self.trace, path)
+        return path
+
+    def _recorded(self, name):
+        original = getattr(hookenv, name)
+        calls = self.trace['calls']
+
+        def recorded(*args, **kwargs):
+            result = original(*args, **kwargs)
+            calls[_call_key(name, args, kwargs)] = result
+            return result
+        return recorded
+
+    def _write(self, name):
+        original = getattr(hookenv, name)
+        writes = self.trace['writes']
+
+        def write(*args, **kwargs):
+            writes.append([name, args, kwargs])
+            return original(*args, **kwargs)
+        return write
+
+    def _step(self, name, original):
+        steps = self.trace['steps']
+
+        def step(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                steps[name] = steps.get(name, 0) + time.perf_counter() - start
+        return step
+
+    def _invoke(self, original):
+        handlers = self.trace['handlers']
+
+        def invoke(handler):
+            before = set(get_flags())
+            start = time.perf_counter()
+            try:
+                return original(handler)
+            finally:
+                duration = time.perf_counter() - start
+                after = set(get_flags())
+                handlers.append({
+                    'id': handler.id(),
+                    'phase': unitdata.kv().get('reactive.dispatch.phase'),
+                    'iteration': bus.FlagWatch._get()['iteration'],
+                    'time': duration,
+                    'set': sorted(after - before),
+                    'cleared': sorted(before - after),
+                })
+        return invoke
+
+
+def _previous_config():
+    path = os.path.join(hookenv.charm_dir(), hookenv.Config.CONFIG_FILE_NAME)
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+class _ReplayedConfig(hookenv.Config):
+    """
+    :class:`~charmhelpers.core.hookenv.Config` which keeps its previous
+    values in ``state_dir``, and is never saved implicitly, so that a replay
+    doesn't touch the charm's own persistent config.
+    """
+    def __init__(self, values, previous, state_dir):
+        # Config.__init__ is skipped, since it loads the charm's previous
+        # config and registers an atexit save
+        dict.__init__(self, values)
+        self.implicit_save = False
+        self._prev_dict = None
+        self.path = os.path.join(state_dir, hookenv.Config.CONFIG_FILE_NAME)
+        if previous is not None:
+            with open(self.path, 'w') as fp:
+                json.dump(previous, fp)
+            self.load_previous()
+
+
+class Player(object):
+    """
+    Serve hookenv calls from a recorded trace, between :meth:`start` and
+    :meth:`stop`.
+
+    Writes are not performed, and calls which are not in the trace return
+    ``None`` and are listed in :attr:`misses`.  The charm's config is
+    served as a single :class:`~charmhelpers.core.hookenv.Config`, whose
+    previous values are kept in ``state_dir``.
+    """
+    def __init__(self, trace, state_dir):
+        self.trace = trace
+        self.state_dir = state_dir
+        self.misses = []
+        self.log = []
+        self._config = None
+        self._patcher = _Patcher()
+
+    def start(self):
+        for name in RECORDED_CALLS:
+            if hasattr(hookenv, name):
+                self._patcher.patch(hookenv, name, self._played(name))
+        for name in WRITE_CALLS:
+            if hasattr(hookenv, name):
+                self._patcher.patch(hookenv, name, lambda *args, **kwargs: None)
+        self._patcher.patch(hookenv, 'log', self._log)
+
+    def stop(self):
+        self._patcher.restore()
+
+    def _log(self, message, level=None):
+        self.log.append((level, message))
+
+    def _played(self, name):
+        calls = self.trace['calls']
+
+        def played(*args, **kwargs):
+            key = _call_key(name, args, kwargs)
+            if key not in calls:
+                self.misses.append(key)
+                return None
+            if name == 'config' and not (args or kwargs):
+                return self._replayed_config(calls[key])
+            return calls[key]
+        return played
+
+    def _replayed_config(self, values):
+        # charms use the Config methods, such as changed(), and may store
+        # values on it for later in the hook
+        if self._config is None:
+            self._config = _ReplayedConfig(
+                values, self.trace.get('previous_config'), self.state_dir)
+        return self._config
+
+
+@contextmanager
+def recording():
+    """
+    Record a trace of the hook if ``REACTIVE_TRACE_FILE`` is set.
+    """
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        yield None
+        return
+    recorder = Recorder()
+    recorder.start()
+    try:
+        yield recorder
+    except Exception:
+        recorder.trace['error'] = traceback.format_exc()
+        raise
+    finally:
+        recorder.stop()
+        try:
+            path = recorder.save(path)
+            hookenv.log('Saved reactive trace to {}'.format(path),
+                        level=hookenv.DEBUG)
+        except OSError as e:
+            hookenv.log('Unable to save reactive trace: {}'.format(e),
+                        level=hookenv.WARNING)
+
+
+def save(trace, path):
+    """
+    Write a trace to ``path``.
+    """
+    with open(path, 'w') as fp:
+        json.dump(trace, fp, separators=(',', ':'), sort_keys=True, default=str)
+
+
+def load(path):
+    """
+    Load a trace written by :func:`recording`.
+    """
+    with open(path) as fp:
+        trace = json.load(fp)
+    if trace.get('version') != TRACE_VERSION:
+        raise TraceError('Unsupported trace version: {}'.format(trace.get('version')))
+    return trace
+
+
+def replay(trace, charm_dir=None):
+    """
+    Run the hook recorded in ``trace`` again, and return the trace of the
+    replayed run.
+
+    This should be run in a fresh process, since it loads the charm's
+    handlers.
+
+    :param dict trace: A trace, as returned by :func:`load`.
+    :param str charm_dir: Path to the charm to run, if it is not at the same
+        location as when the trace was recorded.
+    """
+    import charms.reactive
+
+    state_dir = tempfile.mkdtemp()
+    saved_env = dict(os.environ)
+    saved_kv = unitdata._KV
+    os.environ.pop(TRACE_ENV, None)
+    os.environ.update(trace['env'])
+    if charm_dir:
+        os.environ['CHARM_DIR'] = os.environ['JUJU_CHARM_DIR'] = charm_dir
+    os.environ['UNIT_STATE_DB'] = os.path.join(state_dir, 'state.db')
+    unitdata._KV = None
+    hookenv.cache.clear()
+    unitdata.kv().update(trace['initial'])
+
+    player = Player(trace, state_dir)
+    recorder = Recorder()
+    player.start()
+    try:
+        recorder.start()
+        try:
+            charms.reactive.main()
+        except Exception:
+            recorder.trace['error'] = traceback.format_exc()
+        finally:
+            recorder.stop()
+    finally:
+        player.stop()
+        unitdata._KV.conn.close()
+        unitdata._KV = saved_kv
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(state_dir)
+    recorder.trace['misses'] = player.misses
+    return recorder.trace
+
+
+def compare(recorded, replayed):
+    """
+    Return a report comparing a recorded trace with its replay.
+    """
+    lines = ['Hook: {}'.format(recorded['hook'])]
+    for label, trace in (('Recorded', recorded), ('Replayed', replayed)):
+        if trace.get('error'):
+            lines.append('{} run failed:'.format(label))
+            lines.append(trace['error'].rstrip())
+    lines.append('')
+    lines.append('{:<40} {:>12} {:>12}'.format('Step', 'Recorded', 'Replayed'))
+    for name in [name for obj, name in STEPS] + ['total']:
+        lines.append('{:<40} {:>12} {:>12}'.format(
+            name, _format_time(recorded['steps'].get(name)),
+            _format_time(replayed['steps'].get(name))))
+
+    recorded_ids = [h['id'] for h in recorded['handlers']]
+    replayed_ids = [h['id'] for h in replayed['handlers']]
+    lines.append('')
+    if recorded_ids == replayed_ids:
+        lines.append('Handlers were invoked in the same order')
+    else:
+        for i in range(max(len(recorded_ids), len(replayed_ids))):
+            a = recorded_ids[i] if i < len(recorded_ids) else None
+            b = replayed_ids[i] if i < len(replayed_ids) else None
+            if a != b:
+                lines.append('Handlers diverge at invocation {}: {} != {}'.format(
+                    i + 1, a, b))
+                break
+    lines.append('{:<40} {:>12} {:>12}'.format('Handler', 'Recorded', 'Replayed'))
+    recorded_times = {}
+    for handler in recorded['handlers']:
+        recorded_times.setdefault(handler['id'], []).append(handler['time'])
+    for handler in replayed['handlers']:
+        times = recorded_times.get(handler['id'])
+        lines.append('{:<40} {:>12} {:>12}'.format(
+            handler['id'], _format_time(times.pop(0) if times else None),
+            _format_time(handler['time'])))
+
+    misses = replayed.get('misses')
+    if misses:
+        lines.append('')
+        lines.append('Calls not found in the trace:')
+        lines.extend('  {}'.format(key) for key in sorted(set(misses)))
+    return '\n'.join(lines)
+
+
+def _format_time(seconds):
+    if seconds is None:
+        return '-'
+    return '{:.2f}ms'.format(seconds * 1000)
@@ -0,0 +1,81 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.attrib import attr
+
+from charms.reactive import bus
+
+from benchmarks import dispatch
+from benchmarks import relation_data
+from benchmarks import synthetic
+
+
+class TestDispatchBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        synthetic.generate_charm(self.charm_dir, layers=2, handlers=6,
+                                 flags=5, chains=1, chain_length=3)
+
+    @attr('slow')
+    def test_run_benchmark(self):
+        timings, counts = dispatch.run_benchmark(self.charm_dir, repeat=1)
+        self.assertEqual(list(timings), ['discover', 'dispatch', 'main'])
+        self.assertEqual(timings['main']['runs'], 1)
+        # 2 layers * (6 handlers + 1 hook) + bootstrap + chain head
+        self.assertEqual(counts['handlers'], 16)
+        self.assertGreater(counts['iterations'], 1)
+        self.assertGreater(counts['handler invocations'], 2)
+        self.assertGreater(counts['peak memory (KiB)'], 0)
+        # the harness leaves nothing behind
+        self.assertEqual(list(bus.Handler.get_handlers()), [])
+
+    @attr('slow')
+    def test_warm(self):
+        cold = dispatch.run_benchmark(self.charm_dir, repeat=1)[1]
+        warm = dispatch.run_benchmark(self.charm_dir, repeat=1, warm=True)[1]
+        # flags set by the first hook stop the producers from running again
+        self.assertLess(warm['handler invocations'],
+                        cold['handler invocations'])
+
+
+class TestRelationDataBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        relation_data.generate_charm(self.charm_dir)
+
+    @attr('slow')
+    def test_run_benchmark(self):
+        timings, counts = relation_data.run_benchmark(
+            self.charm_dir, relations=2, units=3, keys=4, repeat=1)
+        self.assertIn('Endpoint._startup', timings)
+        self.assertIn('Relation._flush_data', timings)
+        self.assertEqual(counts['relation-ids calls'], 1)
+        self.assertEqual(counts['relation-list calls'], 2)
+        # one per remote unit, plus the local unit's data for each relation
+        self.assertEqual(counts['relation-get calls'], 8)
+        # one per relation, plus checking for --file support
+        self.assertEqual(counts['relation-set calls'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
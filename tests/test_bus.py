@@ -378,6 +378,70 @@ class TestReactiveBus(unittest.TestCase):
             'bar2',
         ])
 
+    @mock.patch('charmhelpers.core.hookenv.hook_name', lambda: 'config-changed')
+    def test_dispatch_loop(self):
+        calls = []
+
+        @reactive.when_not('foo')
+        def set_foo():
+            calls.append('set_foo')
+            reactive.set_flag('foo')
+
+        @reactive.when('foo')
+        def clear_foo():
+            calls.append('clear_foo')
+            reactive.clear_flag('foo')
+
+        @reactive.when('bar')
+        def bar():
+            calls.append('bar')
+
+        self.log.reset_mock()
+        reactive.set_flag('bar')
+        reactive.bus.dispatch()
+        # stopped as soon as the state repeats, rather than after 100 iterations
+        self.assertEqual(calls, ['set_foo', 'bar', 'clear_foo', 'set_foo'])
+        warnings = [c[0][0] for c in self.log.call_args_list
+                    if c[1].get('level') == reactive.hookenv.WARNING]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('in a loop', warnings[0])
+        self.assertIn('set_foo', warnings[0])
+        self.assertIn('clear_foo', warnings[0])
+        self.assertNotIn(':bar', warnings[0])
+        self.assertIn('Flags: foo.', warnings[0])
+        self.assertEqual(reactive.bus.dispatch_metrics(), {
+            'config-changed': {
+                'runs': 1,
+                'last_iterations': 3,
+                'max_iterations': 3,
+                'total_iterations': 3,
+                'loops': 1,
+            },
+        })
+
+    @mock.patch('charmhelpers.core.hookenv.hook_name', lambda: 'config-changed')
+    def test_dispatch_metrics(self):
+        @reactive.when('foo')
+        def foo():
+            reactive.set_flag('bar')
+
+        @reactive.when('bar')
+        def bar():
+            pass
+
+        reactive.bus.dispatch()
+        reactive.set_flag('foo')
+        reactive.bus.dispatch()
+        self.assertEqual(reactive.bus.dispatch_metrics(), {
+            'config-changed': {
+                'runs': 2,
+                'last_iterations': 2,
+                'max_iterations': 2,
+                'total_iterations': 2,
+                'loops': 0,
+            },
+        })
+
     @mock.patch.object(reactive.bus.Handler, 'get_handlers')
     def test_dispatch_remove(self, get_handlers):
         a = mock.Mock(name='a')
@@ -457,7 +521,7 @@ class TestReactiveBus(unittest.TestCase):
 
     @attr('slow')
     @mock.patch.dict('sys.modules')
-    @mock.patch('charmhelpers.core.hookenv.relation_to_role_and_interface')
+    @mock.patch('charms.reactive.metadata.EndpointIndex.relation_to_role_and_interface')
     @mock.patch('subprocess.check_call')
     @mock.patch('subprocess.Popen')
     @mock.patch('charmhelpers.core.hookenv.relation_type')
@@ -658,6 +722,85 @@ class TestReactiveBus(unittest.TestCase):
         assert not register.called
 
 
+BASH_HANDLER = '''#!/bin/bash
+. {reactive_sh}
+
+@when 'foo'
+    function indented() {{
+        :
+    }}
+
+@when 'bar'
+@when_not 'qux'
+function {name}() {{
+    :
+}}
+
+for func in "${{!REACTIVE_HANDLERS[@]}}"; do
+    echo "${{REACTIVE_HANDLERS[$func]}}"
+done
+'''
+
+
+class TestBashHandler(unittest.TestCase):
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        os.mkdir(os.path.join(self.charm_dir, 'reactive'))
+        self.handler = os.path.join(self.charm_dir, 'reactive', 'handler.sh')
+        self.cache = os.path.join(self.charm_dir, '.reactive.sh.cache',
+                                  self.handler.replace('/', '%'))
+        self.write_handler('plain')
+
+    def write_handler(self, name):
+        reactive_sh = os.path.join(os.path.dirname(__file__),
+                                   '..', 'bin', 'charms.reactive.sh')
+        with open(self.handler, 'w') as fp:
+            fp.write(BASH_HANDLER.format(reactive_sh=reactive_sh, name=name))
+
+    def handlers(self, cache='true'):
+        env = dict(os.environ, CHARM_DIR=self.charm_dir,
+                   REACTIVE_BASH_CACHE=cache)
+        output = subprocess.check_output(['bash', self.handler, '--list'],
+                                         env=env, universal_newlines=True)
+        return sorted(output.splitlines())
+
+    def test_indented(self):
+        self.assertEqual(self.handlers(cache='false'), [
+            self.handler + ':11:plain',
+            self.handler + ':5:indented',
+        ])
+        assert not os.path.exists(self.cache)
+
+    def test_cache(self):
+        self.assertEqual(self.handlers(), [
+            self.handler + ':11:plain',
+            self.handler + ':5:indented',
+        ])
+        assert os.path.exists(self.cache)
+
+        # the cache is used for as long as it is newer than the handler
+        with open(self.cache) as fp:
+            cached = fp.read()
+        with open(self.cache, 'w') as fp:
+            fp.write(cached.replace('plain', 'from_cache'))
+        self.assertEqual(self.handlers(), [
+            self.handler + ':11:from_cache',
+            self.handler + ':5:indented',
+        ])
+
+        # and is refreshed once the handler changes
+        self.write_handler('changed')
+        mtime = os.path.getmtime(self.cache)
+        os.utime(self.handler, (mtime + 1, mtime + 1))
+        self.assertEqual(self.handlers(), [
+            self.handler + ':11:changed',
+            self.handler + ':5:indented',
+        ])
+        with open(self.cache) as fp:
+            assert 'changed' in fp.read()
+
+
 @contextmanager
 def extended_sys_path(extras_list):
     extras_list = [p for p in extras_list if p not in sys.path]
@@ -0,0 +1,128 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.cli import cmdline
+from charmhelpers.core import unitdata
+from charms.reactive import cliserver
+from charms.reactive import flags
+
+
+CLIENT = os.path.join(os.path.dirname(__file__), '..', 'bin', 'charms.reactive')
+
+
+class TestCLIServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.db = os.path.join(tmpdir, 'kv.db')
+        kv = mock.patch.object(unitdata, '_KV', unitdata.Storage(self.db))
+        kv.start()
+        self.addCleanup(kv.stop)
+
+    def client(self, *args):
+        return [sys.executable, CLIENT] + list(args)
+
+    def test_run_command(self):
+        self.assertEqual(cliserver.run_command(['set_flag', 'foo']),
+                         {'stdout': '', 'stderr': '', 'exit_code': 0})
+        assert flags.is_flag_set('foo')
+        self.assertEqual(cliserver.run_command(['is_flag_set', 'foo'])['exit_code'], 0)
+        self.assertEqual(cliserver.run_command(['is_flag_set', 'bar'])['exit_code'], 1)
+        self.assertEqual(cliserver.run_command(['get_flags'])['stdout'], 'foo')
+        response = cliserver.run_command(['no_such_command'])
+        self.assertEqual(response['exit_code'], 2)
+        self.assertIn('invalid choice', response['stderr'])
+
+    def test_run_command_env(self):
+        seen = {}
+
+        def run():
+            seen.update(foo=os.environ.get('FOO'), cwd=os.getcwd())
+
+        cwd = os.getcwd()
+        with mock.patch.object(cmdline, 'run', run):
+            cliserver.run_command(['get_flags'], {'FOO': 'bar'}, self.tmpdir)
+        self.assertEqual(seen, {'foo': 'bar',
+                                'cwd': os.path.realpath(self.tmpdir)})
+        self.assertEqual(os.getcwd(), cwd)
+        assert 'FOO' not in os.environ
+
+    def test_serving(self):
+        with cliserver.serving():
+            assert cliserver.SOCKET_ENV not in os.environ
+            env = cliserver.child_env()
+            path = env[cliserver.SOCKET_ENV]
+            assert os.path.exists(path)
+
+            cliserver.check_call(self.client('set_flag', 'foo'), env=env)
+            assert flags.is_flag_set('foo')
+
+            proc = subprocess.Popen(self.client('get_flags'),
+                                    stdout=subprocess.PIPE, env=env)
+            self.assertEqual(cliserver.communicate(proc), (b'foo', None))
+
+            with self.assertRaises(subprocess.CalledProcessError):
+                cliserver.check_call(self.client('is_flag_set', 'bar'), env=env)
+        self.assertIs(cliserver.child_env(), os.environ)
+        assert not os.path.exists(path)
+
+    def test_serving_env(self):
+        seen = {}
+
+        def run():
+            seen.update(foo=os.environ.get('FOO'), cwd=os.getcwd())
+
+        with cliserver.serving(), mock.patch.object(cmdline, 'run', run):
+            env = dict(cliserver.child_env(), FOO='bar')
+            cliserver.check_call(self.client('get_flags'), env=env,
+                                 cwd=self.tmpdir)
+        self.assertEqual(seen, {'foo': 'bar',
+                                'cwd': os.path.realpath(self.tmpdir)})
+        assert 'FOO' not in os.environ
+
+    def test_not_served(self):
+        # a command which isn't being waited on falls back to running itself
+        flags.set_flag('foo')
+        unitdata.kv().flush()
+        with cliserver.serving():
+            env = dict(cliserver.child_env(), UNIT_STATE_DB=self.db,
+                       PYTHONPATH=os.pathsep.join(sys.path))
+            output = subprocess.check_output(self.client('get_flags'), env=env)
+        self.assertEqual(output, b'foo')
+
+    def test_disabled(self):
+        with cliserver.serving(enabled=False):
+            assert cliserver.SOCKET_ENV not in os.environ
+            proc = mock.Mock()
+            proc.communicate.return_value = (b'out', None)
+            self.assertEqual(cliserver.communicate(proc), (b'out', None))
+            with mock.patch.object(subprocess, 'check_call') as check_call:
+                cliserver.check_call(['foo'])
+                check_call.assert_called_once_with(['foo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
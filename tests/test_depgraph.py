@@ -0,0 +1,184 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import unitdata
+from charms import reactive
+from charms.reactive import depgraph
+from charms.reactive import when, when_not, when_any, hook
+from charms.reactive import set_flag, clear_flag, register_trigger
+
+from benchmarks import harness
+from benchmarks import synthetic
+
+
+class TestGraph(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        kv = mock.patch.object(unitdata, '_KV',
+                               unitdata.Storage(os.path.join(tmpdir, 'kv.db')))
+        kv.start()
+        self.addCleanup(kv.stop)
+        for name in ('log', 'charm_dir'):
+            patcher = mock.patch('charmhelpers.core.hookenv.' + name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(reactive.bus.Handler.clear)
+
+    def register(self):
+        @when_not('installed')
+        def install():
+            set_flag('installed')
+
+        @when('installed')
+        @when_not('configured')
+        def configure():
+            set_flag('configured')
+            clear_flag('needs.restart')
+
+        @when_any('configured', 'never.set')
+        def restart():
+            pass
+
+        @when('never.set')
+        def orphan():
+            pass
+
+        @hook('config-changed')
+        def config_changed():
+            set_flag('needs.restart')
+
+        register_trigger(when='configured', set_flag='ready')
+        return {func.__name__: reactive.bus._short_action_id(func)
+                for func in (install, configure, restart, orphan, config_changed)}
+
+    def test_nodes(self):
+        ids = self.register()
+        graph = depgraph.Graph.from_handlers()
+        self.assertEqual(list(graph.handlers), list(ids.values()))
+        configure = graph.handlers[ids['configure']]
+        self.assertEqual(configure.conditions, [('when_none', ['configured']),
+                                                ('when_all', ['installed'])])
+        self.assertEqual(configure.consumes(), {'installed', 'configured'})
+        self.assertEqual(configure.sets, {'configured'})
+        self.assertEqual(configure.clears, {'needs.restart'})
+        self.assertEqual(graph.handlers[ids['config_changed']].hook_patterns(),
+                         ['config-changed'])
+        self.assertEqual(graph.triggers, {'configured': {'set_flag': ['ready'],
+                                                         'clear_flag': []}})
+        self.assertEqual(graph.flags(), {'installed', 'configured', 'ready',
+                                         'needs.restart', 'never.set'})
+
+    def test_unreachable(self):
+        ids = self.register()
+        graph = depgraph.Graph.from_handlers()
+        self.assertEqual(graph.unreachable(), {ids['orphan']: ['never.set']})
+        self.assertEqual(graph.unreachable(['never.set']), {})
+        self.assertEqual(graph.reachable(), {'installed', 'configured', 'ready',
+                                             'needs.restart'})
+
+    def test_plan(self):
+        ids = self.register()
+        graph = depgraph.Graph.from_handlers()
+        plan = graph.plan(hook='config-changed')
+        self.assertEqual(plan, {
+            'hooks': [ids['config_changed']],
+            'iterations': [
+                [ids['install']],
+                [ids['configure']],
+                [ids['restart']],
+            ],
+            'flags': ['configured', 'installed', 'ready'],
+            'loop': False,
+            'unpredictable': [],
+        })
+        plan = graph.plan(['installed', 'configured'])
+        self.assertEqual(plan['hooks'], [])
+        self.assertEqual(plan['iterations'], [[ids['restart']]])
+
+    def test_plan_loop(self):
+        @when('a')
+        def flip():
+            clear_flag('a')
+            set_flag('b')
+
+        @when('b')
+        def flop():
+            clear_flag('b')
+            set_flag('a')
+
+        graph = depgraph.Graph.from_handlers()
+        plan = graph.plan(['a'])
+        self.assertTrue(plan['loop'])
+        self.assertEqual(len(plan['iterations']), 3)
+
+    def test_trace(self):
+        ids = self.register()
+        graph = depgraph.Graph.from_handlers()
+        graph.add_trace({'handlers': [
+            {'id': ids['orphan'], 'set': ['found'], 'cleared': []},
+            {'id': 'unknown', 'set': ['other'], 'cleared': []},
+        ]})
+        self.assertEqual(graph.handlers[ids['orphan']].sets, {'found'})
+        self.assertNotIn('other', graph.flags())
+
+    def test_export(self):
+        ids = self.register()
+        graph = depgraph.Graph.from_handlers()
+        data = json.loads(json.dumps(graph.to_dict()))
+        self.assertEqual(data['unreachable'], {ids['orphan']: ['never.set']})
+        self.assertEqual(len(data['handlers']), 5)
+        dot = graph.to_dot()
+        assert dot.startswith('digraph reactive {')
+        self.assertIn('"flag:installed" -> "handler:{}" [label=when_all, '
+                      'style=solid];'.format(ids['configure']), dot)
+        self.assertIn('"flag:configured" -> "flag:ready" [label=trigger];', dot)
+        self.assertIn('"handler:{}" [shape=box, label="{}", color=grey];'.format(
+            ids['orphan'], ids['orphan']), dot)
+        summary = graph.summary()
+        self.assertIn('{} (needs never.set)'.format(ids['orphan']), summary)
+        self.assertIn('Predicted iterations: 3', summary)
+
+
+class TestDiscovered(unittest.TestCase):
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        synthetic.generate_charm(self.charm_dir, layers=2, handlers=4,
+                                 flags=4, chains=1, chain_length=3)
+
+    def test_predicted_iterations(self):
+        with harness.HookEnvironment(self.charm_dir, 'config-changed') as env:
+            with depgraph.discovered() as graph:
+                plan = graph.plan(hook='config-changed')
+            self.assertEqual(graph.unreachable(), {})
+            env.reset(fresh_state=True)
+            reactive.main()
+            metrics = reactive.bus.dispatch_metrics()['config-changed']
+        self.assertEqual(len(plan['iterations']), metrics['last_iterations'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -86,8 +86,10 @@ class TestEndpoint(unittest.TestCase):
         self.rel_set_p = mock.patch('charmhelpers.core.hookenv.relation_set')
         self.relation_set = self.rel_set_p.start()
 
-        self.data_changed_p = mock.patch('charms.reactive.endpoints.data_changed')
+        self.data_changed_p = mock.patch('charms.reactive.endpoints.data_changed_many')
         self.data_changed = self.data_changed_p.start()
+        self.data_changed.side_effect = lambda data, hash_type: dict.fromkeys(
+            data, self.data_changed.return_value)
 
         self.atexit_p = mock.patch('charmhelpers.core.hookenv.atexit')
         self.atexit = self.atexit_p.start()
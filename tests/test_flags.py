@@ -28,6 +28,123 @@ class TestTriggers(unittest.TestCase):
         flags.set_flag('foo')
         assert not flags.is_flag_set('qux')
 
+    @mock.patch('charmhelpers.core.unitdata.kv')
+    def test_trigger_cascade(self, kv):
+        kv.return_value = MockKV()
+
+        flags.register_trigger(when='a', set_flag='b')
+        flags.register_trigger(when='b', set_flag='c')
+        flags.register_trigger(when='b', clear_flag='x')
+        flags.register_trigger(when='c', clear_flag='y')
+        flags.set_flag('x')
+        flags.set_flag('y')
+        flags.set_flag('a')
+        assert flags.all_flags_set('a', 'b', 'c')
+        assert not flags.any_flags_set('x', 'y')
+
+    @mock.patch('charmhelpers.core.unitdata.kv')
+    def test_trigger_cycle(self, kv):
+        kv.return_value = MockKV()
+
+        flags.register_trigger(when='a', set_flag='b')
+        flags.register_trigger(when='a', set_flag='c')
+        flags.register_trigger(when='b', clear_flag='a')
+        flags.register_trigger(when='c', set_flag='a')
+        flags.set_flag('a')
+        assert flags.all_flags_set('a', 'b', 'c')
+
+    @mock.patch('charmhelpers.core.unitdata.kv')
+    def test_triggers_reloaded(self, kv):
+        kv.return_value = MockKV()
+
+        flags.set_flag('foo')
+        flags.clear_flag('foo')
+        # simulate another process registering a trigger
+        kv.return_value.set('reactive.flag_triggers.foo', {
+            'set_flag': ['bar'],
+            'clear_flag': [],
+        })
+        kv.return_value.set('reactive.flag_triggers_version', 1)
+        flags.set_flag('foo')
+        assert flags.is_flag_set('bar')
+
+
+class TestFlagGeneration(unittest.TestCase):
+    @mock.patch('charmhelpers.core.unitdata.kv')
+    def test_generation(self, kv):
+        kv.return_value = MockKV()
+
+        self.assertEqual(flags.flag_generation(), 0)
+        self.assertEqual(flags.flag_changed_generation('foo'), 0)
+        flags.set_flag('foo')
+        flags.set_flag('foo')  # no change
+        flags.clear_flag('bar')  # no change
+        self.assertEqual(flags.flag_generation(), 1)
+        self.assertEqual(flags.flag_changed_generation('foo'), 1)
+
+        generation = flags.flag_generation()
+        assert not flags.flags_changed_since(generation)
+        flags.register_trigger(when='bar', set_flag='qux')
+        flags.set_flag('bar')
+        self.assertEqual(flags.flag_generation(), 3)
+        self.assertEqual(flags.flag_changed_generation('qux'), 3)
+        assert flags.flags_changed_since(generation)
+        assert flags.flags_changed_since(generation, 'foo', 'qux')
+        assert not flags.flags_changed_since(generation, 'foo')
+
+        flags.clear_flag('foo')
+        self.assertEqual(flags.flag_changed_generation('foo'), 4)
+        assert flags.flags_changed_since(generation, 'foo')
+        # all kept under a single key
+        self.assertEqual([key for key in kv.return_value.data
+                          if 'generation' in key],
+                         ['reactive.flag_generations'])
+
+
+class TestFlagPrefixes(unittest.TestCase):
+    def setUp(self):
+        kv = mock.patch('charmhelpers.core.unitdata.kv')
+        self.kv = kv.start()
+        self.addCleanup(kv.stop)
+        self.kv.return_value = MockKV()
+
+    def test_get_flags_prefix(self):
+        for flag in ('endpoint.db.joined', 'endpoint.db.changed.host',
+                     'endpoint.dbx.joined', 'endpoint.cache.joined', 'foo'):
+            flags.set_flag(flag)
+        self.assertEqual(flags.get_flags(prefix='endpoint.db.'),
+                         ['endpoint.db.changed.host', 'endpoint.db.joined'])
+        self.assertEqual(flags.get_flags(prefix='endpoint.db'),
+                         ['endpoint.db.changed.host', 'endpoint.db.joined',
+                          'endpoint.dbx.joined'])
+        self.assertEqual(flags.get_flags(prefix='nope.'), [])
+        self.assertEqual(len(flags.get_flags()), 5)
+
+        flags.clear_flag('endpoint.db.joined')
+        self.assertEqual(flags.get_flags(prefix='endpoint.db.'),
+                         ['endpoint.db.changed.host'])
+
+    def test_clear_flags(self):
+        for flag in ('endpoint.db.joined', 'endpoint.db.changed.host',
+                     'endpoint.dbx.joined'):
+            flags.set_flag(flag)
+        flags.clear_flags('endpoint.db.')
+        self.assertEqual(flags.get_flags(), ['endpoint.dbx.joined'])
+        self.assertEqual(flags.flag_generation(), 5)
+
+    def test_external_changes(self):
+        flags.set_flag('foo.a')
+        self.assertEqual(flags.get_flags(prefix='foo.'), ['foo.a'])
+        # simulate another process setting a flag
+        kv = self.kv.return_value
+        kv.set('reactive.states.foo.b', None)
+        kv.set('reactive.flag_generations', {'generation': 2,
+                                             'flags': {'foo.a': 1, 'foo.b': 2}})
+        self.assertEqual(flags.get_flags(prefix='foo.'), ['foo.a', 'foo.b'])
+        # and a new storage
+        self.kv.return_value = MockKV()
+        self.assertEqual(flags.get_flags(prefix='foo.'), [])
+
 
 class MockKV:
     def __init__(self):
@@ -17,10 +17,14 @@
 import re
 import os
 import mock
+import hashlib
 import shutil
 import tempfile
+import time
 import unittest
+from concurrent import futures
 
+from charmhelpers.core import hookenv
 from charmhelpers.core import unitdata
 from charms import reactive
 
@@ -117,7 +121,30 @@ class TestReactiveHelpers(unittest.TestCase):
         assert reactive.helpers.any_hook('{provides:mysql}-relation-changed')
         assert reactive.helpers.any_hook('{provides:mysql}-relation-{joined,changed}')
 
-    @mock.patch('charmhelpers.core.host.file_hash')
+    @mock.patch('charmhelpers.core.hookenv.hook_name')
+    def test_any_hook_cached(self, hook_name):
+        hook_name.return_value = 'db-relation-joined'
+        charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, charm_dir)
+        md_path = os.path.join(charm_dir, 'metadata.yaml')
+        with open(md_path, 'w') as fp:
+            fp.write('requires: {db: {interface: pgsql}}\n')
+        pattern = '{requires:pgsql}-relation-{joined,changed}'
+        expand = mock.Mock(wraps=reactive.helpers._expand_replacements)
+        with mock.patch.object(reactive.helpers, '_expand_replacements', expand), \
+                mock.patch('charmhelpers.core.hookenv.charm_dir', return_value=charm_dir):
+            hookenv.cache.clear()
+            assert reactive.helpers.any_hook(pattern)
+            assert reactive.helpers.any_hook(pattern)
+            self.assertEqual(expand.call_count, 2)
+
+            # patterns are expanded again if the metadata changes
+            with open(md_path, 'w') as fp:
+                fp.write('requires: {other-db: {interface: pgsql}}\n')
+            assert not reactive.helpers.any_hook(pattern)
+            self.assertEqual(expand.call_count, 4)
+
+    @mock.patch('charms.reactive.helpers._hash_file')
     def test_any_file_changed(self, file_hash):
         self.kv.update({
             'file1': 'hash1',
@@ -155,7 +182,110 @@ class TestReactiveHelpers(unittest.TestCase):
             mock.call('file3', hash_type='md5'),
         ])
 
-    @mock.patch('charmhelpers.core.host.file_hash')
+    def test_any_file_changed_stat(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'big')
+        with open(filename, 'w') as fp:
+            fp.write('data')
+        old = time.time() - 60
+        os.utime(filename, (old, old))
+
+        afc = reactive.helpers.any_file_changed
+        with mock.patch('charms.reactive.helpers._hash_file',
+                        wraps=reactive.helpers._hash_file) as file_hash:
+            assert afc([filename])
+            assert not afc([filename])
+            reactive.helpers._file_hashes.clear()
+            assert not afc([filename])  # a new process uses the stored stat
+            self.assertEqual(file_hash.call_count, 1)
+
+            with open(filename, 'w') as fp:
+                fp.write('DATA')
+            os.utime(filename, (old, old + 1))
+            assert afc([filename])
+            self.assertEqual(file_hash.call_count, 2)
+
+            # recently modified files are always hashed
+            with open(filename, 'w') as fp:
+                fp.write('more')
+            assert afc([filename])
+            assert not afc([filename])
+            self.assertEqual(file_hash.call_count, 4)
+
+    def test_any_file_changed_tree(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        mtimes = iter(range(int(time.time()) - 60, int(time.time())))
+
+        def write(name, data):
+            path = os.path.join(tmpdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fp:
+                fp.write(data)
+            mtime = next(mtimes)
+            os.utime(path, (mtime, mtime))
+            return path
+
+        write('conf.d/a.conf', 'a')
+        write('conf.d/sub/b.conf', 'b')
+        write('conf.d/c.txt', 'c')
+        conf_d = os.path.join(tmpdir, 'conf.d')
+        pattern = os.path.join(tmpdir, 'conf.d', '**', '*.conf')
+
+        afc = reactive.helpers.any_file_changed
+        assert afc([conf_d])
+        assert afc([pattern])
+        with mock.patch('charms.reactive.helpers._hash_file',
+                        wraps=reactive.helpers._hash_file) as file_hash:
+            assert not afc([conf_d])
+            assert not afc([pattern])
+            # nothing is hashed when the files' details haven't changed
+            assert not file_hash.called
+
+            write('conf.d/sub/b.conf', 'B')
+            assert afc([conf_d])
+            assert afc([pattern])
+            self.assertEqual(file_hash.call_count, 2)
+
+        write('conf.d/d.txt', 'd')
+        assert afc([conf_d])
+        assert not afc([pattern])
+        os.remove(os.path.join(conf_d, 'a.conf'))
+        assert afc([conf_d])
+        assert afc([pattern])
+        assert not afc([os.path.join(tmpdir, 'missing', '*')])
+
+    @mock.patch.object(reactive.helpers, '_HASH_CHUNK', 10)
+    def test_hash_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        small = os.path.join(tmpdir, 'small')
+        large = os.path.join(tmpdir, 'large')
+        with open(small, 'wb') as fp:
+            fp.write(b'small')
+        with open(large, 'wb') as fp:
+            fp.write(b'large' * 11)
+        hash_file = reactive.helpers._hash_file
+        self.assertEqual(hash_file(small), hashlib.md5(b'small').hexdigest())
+        self.assertEqual(hash_file(large, hash_type='sha256'),
+                         hashlib.sha256(b'large' * 11).hexdigest())
+        self.assertIsNone(hash_file(os.path.join(tmpdir, 'missing')))
+
+        # several files are hashed in a thread pool
+        with mock.patch.object(reactive.helpers, '_PARALLEL_HASH_SIZE', 50), \
+                mock.patch.object(futures, 'ThreadPoolExecutor',
+                                  wraps=futures.ThreadPoolExecutor) as pool:
+            self.assertEqual(reactive.helpers._hash_files([small, large], 'md5'), {
+                small: hashlib.md5(b'small').hexdigest(),
+                large: hashlib.md5(b'large' * 11).hexdigest(),
+            })
+            assert pool.called
+            assert reactive.helpers.any_file_changed([small, large])
+            self.assertEqual(pool.call_count, 2)
+
+    @mock.patch('charms.reactive.helpers._hash_file')
     def test_any_file_changed_argtypes(self, file_hash):
         file_hash.return_value = 'beep'
         # A filename may be a callable, in which case it is called and
@@ -178,6 +308,24 @@ class TestReactiveHelpers(unittest.TestCase):
         assert reactive.helpers.data_changed('foo', {'foo': 'QUX', 'bar': u'\ua000BAR'})
         assert not reactive.helpers.data_changed('foo', {'foo': 'QUX', 'bar': u'\ua000BAR'})
 
+    def test_data_changed_many(self):
+        data_changed_many = reactive.helpers.data_changed_many
+        self.assertEqual(data_changed_many({}), {})
+        self.assertEqual(data_changed_many({'a.x': 1, 'a.y': [2]}),
+                         {'a.x': True, 'a.y': True})
+        with mock.patch.object(self.kv, 'update') as update:
+            self.assertEqual(data_changed_many({'a.x': 1, 'a.y': [3], 'b': 4}),
+                             {'a.x': False, 'a.y': True, 'b': True})
+            # only the changed hashes are written
+            self.assertEqual(sorted(update.call_args[0][0]),
+                             ['reactive.data_changed.a.y', 'reactive.data_changed.b'])
+
+        # compatible with data_changed when using the same hash
+        reactive.helpers.data_changed('c', {'foo': 'FOO'})
+        self.assertEqual(data_changed_many({'c': {'foo': 'FOO'}}, hash_type='md5'),
+                         {'c': False})
+        self.assertEqual(data_changed_many({'c': {'foo': 'FOO'}}), {'c': True})
+
     @mock.patch.object(reactive.helpers, 'any_hook')
     def test__hook(self, any_hook):
         pats = ['pat1', 'pat2']
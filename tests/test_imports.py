@@ -0,0 +1,79 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+# modules only needed by a few commands or helpers, which should not be
+# loaded just by importing the framework
+DEFERRED = [
+    'charmhelpers.core.templating',
+    'jinja2',
+    'concurrent.futures',
+    'mmap',
+    'charms.reactive.trace',
+    'charms.reactive.cliserver',
+    'charms.reactive.depgraph',
+    'charms.reactive.storage',
+]
+
+# bound on the time spent importing the framework's own modules, in
+# microseconds; measured at around 40ms, with some margin for slow machines
+BUDGET = 80000
+
+
+@unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires Python 3.7')
+class TestImportTime(unittest.TestCase):
+    def import_times(self, *modules):
+        """
+        Import the modules in a fresh interpreter and return a dict mapping
+        the name of each module loaded to the time spent importing it, not
+        including the modules it imported.
+        """
+        source = '; '.join('import {}'.format(module) for module in modules)
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', source],
+                              cwd=ROOT, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        times = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_time, _, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(self_time)
+        return times
+
+    def test_deferred_imports(self):
+        times = self.import_times('charms.reactive', 'charms.reactive.cli')
+        self.assertIn('charms.reactive.cli', times)
+        for module in DEFERRED:
+            self.assertNotIn(module, times)
+
+    def test_budget(self):
+        times = self.import_times('charms.reactive')
+        total = sum(self_time for name, self_time in times.items()
+                    if name.startswith('charms.reactive'))
+        self.assertLess(total, BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+from charms.reactive import bus
+from charms.reactive import log
+
+
+class TestLog(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(hookenv, 'log')
+        self.hookenv_log = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unbuffered(self):
+        log.log('foo %s', 'bar', level=hookenv.INFO)
+        self.hookenv_log.assert_called_once_with('foo bar', level=hookenv.INFO)
+
+    @mock.patch.object(log, 'THRESHOLD', hookenv.INFO)
+    def test_threshold(self):
+        arg = mock.MagicMock()
+        log.log('foo %s', arg, level=hookenv.DEBUG)
+        assert not self.hookenv_log.called
+        assert not arg.__str__.called
+        assert not log.enabled(hookenv.DEBUG)
+        assert log.enabled(hookenv.INFO)
+        assert log.enabled(None)
+
+    def test_buffered(self):
+        with log.buffered():
+            log.log('one', level=hookenv.DEBUG)
+            log.log('two %s', 2, level=hookenv.DEBUG)
+            hookenv.log('from the charm')
+            log.log('three', level=hookenv.DEBUG)
+            assert not self.hookenv_log.called
+            log.log('uh oh', level=hookenv.WARNING)
+            self.assertEqual(self.hookenv_log.call_args_list, [
+                mock.call('one\ntwo 2', level=hookenv.DEBUG),
+                mock.call('from the charm', level=None),
+                mock.call('three', level=hookenv.DEBUG),
+                mock.call('uh oh', level=hookenv.WARNING),
+            ])
+            self.hookenv_log.reset_mock()
+            log.log('four', level=hookenv.DEBUG)
+        self.hookenv_log.assert_called_once_with('four', level=hookenv.DEBUG)
+        self.assertIs(hookenv.log, self.hookenv_log)
+
+        self.hookenv_log.reset_mock()
+        with log.buffered(enabled=False):
+            log.log('five', level=hookenv.DEBUG)
+            self.hookenv_log.assert_called_once_with('five', level=hookenv.DEBUG)
+
+    @mock.patch.object(log, 'BATCH_SIZE', 10)
+    def test_batch_size(self):
+        with log.buffered():
+            for message in ('aaaa', 'bbbb', 'cccc'):
+                log.log(message, level=hookenv.DEBUG)
+            self.hookenv_log.assert_called_once_with('aaaa\nbbbb', level=hookenv.DEBUG)
+        self.assertEqual(self.hookenv_log.call_count, 2)
+        self.hookenv_log.assert_called_with('cccc', level=hookenv.DEBUG)
+
+    def test_dispatch(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        kv = mock.patch.object(unitdata, '_KV',
+                               unitdata.Storage(os.path.join(tmpdir, 'kv.db')))
+        kv.start()
+        self.addCleanup(kv.stop)
+        self.addCleanup(bus.Handler.clear)
+        logged = []
+
+        def action():
+            # the handler has been logged by the time it runs
+            logged.extend(call[0][0] for call in self.hookenv_log.call_args_list)
+        handler = bus.Handler.get(action)
+
+        with log.buffered(), \
+                mock.patch.object(hookenv, 'hook_name', lambda: 'start'):
+            bus.dispatch()
+        self.assertIn('Invoking reactive handler: %s' % handler.id(), logged)
+
+
+if __name__ == '__main__':
+    unittest.main()
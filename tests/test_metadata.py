@@ -0,0 +1,103 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import hookenv
+from charms.reactive import metadata
+
+
+class TestEndpointIndex(unittest.TestCase):
+    def test_lookups(self):
+        index = metadata.EndpointIndex.from_metadata({
+            'provides': {
+                'website': {'interface': 'http'},
+                'db-admin': {'interface': 'mysql'},
+            },
+            'requires': {
+                'db': {'interface': 'mysql'},
+                'backup': {'interface': 'mysql'},
+            },
+            'peers': {
+                'cluster': {'interface': 'my-peers'},
+            },
+        })
+        self.assertEqual(index.relation_types(),
+                         ['website', 'db-admin', 'db', 'backup', 'cluster'])
+        self.assertEqual(index.relation_to_role_and_interface('db'),
+                         ('requires', 'mysql'))
+        self.assertEqual(index.relation_to_role_and_interface('cluster'),
+                         ('peers', 'my-peers'))
+        self.assertEqual(index.relation_to_role_and_interface('unknown'),
+                         (None, None))
+        self.assertEqual(index.role_and_interface_to_relations('requires', 'mysql'),
+                         ['db', 'backup'])
+        self.assertEqual(index.role_and_interface_to_relations('provides', 'mysql'),
+                         ['db-admin'])
+        self.assertEqual(index.role_and_interface_to_relations('requires', 'http'),
+                         [])
+
+
+class TestEndpointIndexCache(unittest.TestCase):
+    def setUp(self):
+        self.charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.charm_dir)
+        self.md_path = os.path.join(self.charm_dir, 'metadata.yaml')
+        with open(self.md_path, 'w') as fp:
+            fp.write('requires: {db: {interface: mysql}}\n')
+        charm_dir = mock.patch.object(hookenv, 'charm_dir',
+                                      return_value=self.charm_dir)
+        charm_dir.start()
+        self.addCleanup(charm_dir.stop)
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+
+    def test_reused(self):
+        index = metadata.endpoint_index()
+        self.assertIs(metadata.endpoint_index(), index)
+        self.assertEqual(index.relation_types(), ['db'])
+
+        # the change is seen even though hookenv.metadata() has the old
+        # contents cached
+        hookenv.metadata()
+        with open(self.md_path, 'w') as fp:
+            fp.write('requires: {db: {interface: pgsql}}\n')
+        index = metadata.endpoint_index()
+        self.assertEqual(index.relation_to_role_and_interface('db'),
+                         ('requires', 'pgsql'))
+
+    @mock.patch.dict(os.environ, {'REACTIVE_METADATA_CACHE': 'true'})
+    def test_cache_file(self):
+        cache_path = os.path.join(self.charm_dir, metadata.CACHE_FILENAME)
+        metadata.endpoint_index()
+        assert os.path.exists(cache_path)
+
+        # a fresh process can load the index without parsing the YAML
+        metadata._index_cache['key'] = None
+        with mock.patch.object(metadata, '_load_metadata') as md:
+            index = metadata.endpoint_index()
+            assert not md.called
+        self.assertEqual(index.relation_to_role_and_interface('db'),
+                         ('requires', 'mysql'))
+
+
+if __name__ == '__main__':
+    unittest.main()
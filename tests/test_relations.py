@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
 
+import abc
 import os
 import sys
 import types
@@ -32,9 +33,10 @@ class TestFactory(unittest.TestCase):
     @mock.patch.object(relations.hookenv, 'log')
     @mock.patch.object(relations, 'importlib')
     @mock.patch.object(relations.hookenv, 'charm_dir')
-    @mock.patch.object(relations.hookenv, 'relation_to_role_and_interface')
-    def test_relation_factory_import_fail(self, relation_to_role_and_interface,
+    @mock.patch.object(relations, 'endpoint_index')
+    def test_relation_factory_import_fail(self, endpoint_index,
                                           charm_dir, importlib, log):
+        relation_to_role_and_interface = endpoint_index().relation_to_role_and_interface
         relation_to_role_and_interface.return_value = ('role', 'interface')
         charm_dir.return_value = 'charm_dir'
         importlib.import_module.side_effect = ImportError
@@ -50,9 +52,10 @@ class TestFactory(unittest.TestCase):
     @mock.patch.object(relations.hookenv, 'log')
     @mock.patch.object(relations, '_relation_module')
     @mock.patch.object(relations.hookenv, 'charm_dir')
-    @mock.patch.object(relations.hookenv, 'relation_to_role_and_interface')
-    def test_relation_factory(self, relation_to_role_and_interface,
+    @mock.patch.object(relations, 'endpoint_index')
+    def test_relation_factory(self, endpoint_index,
                               charm_dir, rel_mod, log, find_factory):
+        relation_to_role_and_interface = endpoint_index().relation_to_role_and_interface
         relation_to_role_and_interface.return_value = ('role', 'interface')
         charm_dir.return_value = 'charm_dir'
         rel_mod.return_value = 'module'
@@ -95,6 +98,43 @@ class TestFactory(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             relations._find_relation_factory(mod)
 
+    @mock.patch.object(relations, '_append_path')
+    @mock.patch.object(relations.hookenv, 'charm_dir')
+    def test_module_factories(self, charm_dir, append_path):
+        charm_dir.return_value = 'charm_dir'
+        mod = types.ModuleType('reactive.relations.iface.role')
+
+        class Zed(relations.RelationBase):
+            pass
+
+        class Alpha(relations.RelationBase):
+            pass
+        mod.Zed = Zed
+        mod.Alpha = Alpha
+        mod.RelationBase = relations.RelationBase
+        self.assertEqual(relations._module_factories(mod),
+                         [Alpha, relations.RelationBase, Zed])
+
+        with mock.patch.dict(sys.modules, {mod.__name__: mod}), \
+                mock.patch.dict(relations._factories_by_module):
+            self.assertIs(relations._relation_module('role', 'iface'), mod)
+            # the module is only scanned once, when it's loaded
+            del mod.Zed
+            self.assertEqual(relations._module_factories(mod),
+                             [Alpha, relations.RelationBase, Zed])
+            self.assertIs(relations.RelationBase._find_subclass(mod), Alpha)
+
+    def test_metaclass_mixin(self):
+        class Mixin(metaclass=abc.ABCMeta):
+            pass
+
+        class Rel(relations.RelationFactory, Mixin):
+            pass
+
+        mod = types.ModuleType('mod')
+        mod.Rel = Rel
+        self.assertIs(relations._find_relation_factory(mod), Rel)
+
     def test_endpoint_from_name_missing_name(self):
         self.assertIsNone(relations.endpoint_from_name(None))
 
@@ -160,11 +200,11 @@ class TestRelationBase(unittest.TestCase):
         self.assertEqual(relations.RelationBase.from_flag('state'), 'from_name(relname, conv.load)')
         self.assertEqual(relations.RelationBase.from_flag('no-state'), None)
 
-    @mock.patch.object(relations.hookenv, 'relation_to_role_and_interface')
+    @mock.patch.object(relations, 'endpoint_index')
     @mock.patch.object(relations.Conversation, 'join')
     @mock.patch.object(relations.RelationBase, '_find_impl')
-    def test_from_name(self, _find_impl, join, relation_to_role_and_interface):
-        relation_to_role_and_interface.return_value = ('role', 'interface')
+    def test_from_name(self, _find_impl, join, endpoint_index):
+        endpoint_index().relation_to_role_and_interface.return_value = ('role', 'interface')
         r1 = mock.Mock(name='R1')
         _find_impl.side_effect = [None, r1, None]
         join.return_value = 'conv.join'
@@ -189,13 +229,14 @@ class TestRelationBase(unittest.TestCase):
 
     @mock.patch.dict('sys.modules')
     @mock.patch.object(relations.Conversation, 'join')
+    @mock.patch.object(relations, 'endpoint_index')
     @mock.patch.object(relations, 'hookenv')
-    def test_cold_import(self, hookenv, conv_join):
+    def test_cold_import(self, hookenv, endpoint_index, conv_join):
         tests_dir = os.path.dirname(__file__)
         hookenv.charm_dir.return_value = os.path.join(tests_dir, 'data')
         sys.modules.pop('relations.hyphen-ated.peer', None)
-        hookenv.relation_to_role_and_interface.return_value = ('peer',
-                                                               'hyphen-ated')
+        endpoint_index().relation_to_role_and_interface.return_value = (
+            'peer', 'hyphen-ated')
         relations.RelationBase._cache.clear()
         assert relations.RelationBase.from_name('test') is not None
 
@@ -292,6 +333,14 @@ class TestRelationBase(unittest.TestCase):
         rb.conversation.assert_called_once_with('scope')
         conv.get_remote.assert_called_once_with('key', 'default')
 
+    def test_get_remote_many(self):
+        conv = mock.Mock(name='conv')
+        rb = relations.RelationBase('relname', 'unit')
+        rb.conversation = mock.Mock(return_value=conv)
+        rb.get_remote_many(['key'], 'default', 'scope')
+        rb.conversation.assert_called_once_with('scope')
+        conv.get_remote_many.assert_called_once_with(['key'], 'default')
+
     def test_set_local(self):
         conv = mock.Mock(name='conv')
         rb = relations.RelationBase('relname', 'unit')
@@ -438,56 +487,106 @@ class TestConversation(unittest.TestCase):
             mock.call('key1'), mock.call('key2'), mock.call('key3'),
         ])
 
-    @mock.patch.object(relations, 'set_flag')
-    @mock.patch.object(relations, '_get_flag_value')
-    def test_set_state(self, get_flag_value, set_flag):
+    def test_set_state(self):
+        data = patch_kv(self)
         conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
-        get_flag_value.return_value = {'conversations': ['foo']}
+        other = relations.Conversation('rel', ['service/2'], 'other')
         conv.set_state('{relation_name}.bar')
-        set_flag.assert_called_once_with('rel.bar', {'conversations': ['foo', 'reactive.conversations.rel.scope']})
-        get_flag_value.assert_called_once_with('rel.bar', {'relation': 'rel', 'conversations': []})
         conv.set_state('{relation_name}.bar')
-        self.assertEqual(set_flag.call_count, 2)
-        set_flag.assert_called_with('rel.bar', {'conversations': ['foo', 'reactive.conversations.rel.scope']})
+        other.set_state('{relation_name}.bar')
+        self.assertEqual(data['reactive.states.rel.bar'], {
+            'relation': 'rel',
+            'generation': 0,
+            'count': 2,
+            'member_keys': True,
+        })
+        self.assertEqual(relations._flag_conversations('rel.bar', data['reactive.states.rel.bar']), [
+            'reactive.conversations.rel.other',
+            'reactive.conversations.rel.scope',
+        ])
 
-    @mock.patch.object(relations, 'clear_flag')
-    @mock.patch.object(relations, 'set_flag')
-    @mock.patch.object(relations, '_get_flag_value')
-    def test_remove_state(self, get_flag_value, set_flag, clear_flag):
+    def test_remove_state(self):
+        data = patch_kv(self)
         conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
-        get_flag_value.side_effect = [
-            None,
-            {'conversations': ['foo', 'reactive.conversations.rel.scope']},
-            {'conversations': ['reactive.conversations.rel.scope']},
-        ]
-
+        other = relations.Conversation('rel', ['service/2'], 'other')
         conv.remove_state('{relation_name}.bar')
-        get_flag_value.assert_called_once_with('rel.bar')
-        assert not set_flag.called
-        assert not clear_flag.called
+        assert 'reactive.states.rel.bar' not in data
 
+        conv.set_state('{relation_name}.bar')
+        other.set_state('{relation_name}.bar')
         conv.remove_state('{relation_name}.bar')
-        set_flag.assert_called_once_with('rel.bar', {'conversations': ['foo']})
-        assert not clear_flag.called
-
-        set_flag.reset_mock()
         conv.remove_state('{relation_name}.bar')
-        assert not set_flag.called
-        clear_flag.assert_called_once_with('rel.bar')
+        self.assertEqual(data['reactive.states.rel.bar']['count'], 1)
+        self.assertEqual(relations._flag_conversations('rel.bar', data['reactive.states.rel.bar']), [
+            'reactive.conversations.rel.other',
+        ])
 
-    @mock.patch.object(relations, '_get_flag_value')
-    def test_is_state(self, get_flag_value):
+        other.remove_state('{relation_name}.bar')
+        assert 'reactive.states.rel.bar' not in data
+        assert not [key for key in data if key.startswith(relations.CONVERSATION_STATES_PREFIX)]
+
+    def test_clear_state_members(self):
+        data = patch_kv(self)
         conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
-        get_flag_value.side_effect = [
-            None,
-            {'conversations': ['foo']},
-            {'conversations': ['reactive.conversations.rel.scope']},
-        ]
+        other = relations.Conversation('rel', ['service/2'], 'other')
+        conv.set_state('{relation_name}.bar')
+        other.set_state('{relation_name}.bar.baz')
+
+        # clearing the flag directly drops its members, but not those of
+        # other flags sharing its prefix
+        relations.clear_flag('rel.bar')
+        self.assertEqual([key for key in data
+                          if key.startswith(relations.CONVERSATION_STATES_PREFIX)],
+                         [relations._member_key('rel.bar.baz', other.key)])
 
+        # as does setting it again after it was lost some other way
+        conv.set_state('{relation_name}.bar')
+        data.pop('reactive.states.rel.bar')
+        data['reactive.flag_generations']['generation'] = 5
+        other.set_state('{relation_name}.bar')
+        self.assertEqual(data['reactive.states.rel.bar']['count'], 1)
+        assert relations._member_key('rel.bar', conv.key) not in data
+
+        # other flags which happen to have similar values are left alone
+        member_key = relations._member_key('rel.user', conv.key)
+        data[member_key] = 0
+        relations.set_flag('rel.user', {'relation': 'rel', 'generation': 0})
+        relations.clear_flag('rel.user')
+        assert member_key in data
+
+    def test_is_state(self):
+        data = patch_kv(self)
+        conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
+        other = relations.Conversation('rel', ['service/2'], 'other')
         assert not conv.is_state('{relation_name}.bar')
+        other.set_state('{relation_name}.bar')
         assert not conv.is_state('{relation_name}.bar')
+        conv.set_state('{relation_name}.bar')
         assert conv.is_state('{relation_name}.bar')
 
+        # membership from an earlier time that the flag was set doesn't count
+        relations.clear_flag('rel.bar')
+        other.set_state('{relation_name}.bar')
+        assert not conv.is_state('{relation_name}.bar')
+        self.assertEqual(data['reactive.states.rel.bar']['count'], 1)
+
+    def test_old_format_state(self):
+        data = patch_kv(self)
+        conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
+        data['reactive.states.rel.bar'] = {
+            'relation': 'rel',
+            'conversations': ['reactive.conversations.rel.other',
+                              'reactive.conversations.rel.scope'],
+        }
+        assert conv.is_state('{relation_name}.bar')
+        conv.remove_state('{relation_name}.bar')
+        self.assertEqual(data['reactive.states.rel.bar'], {
+            'relation': 'rel',
+            'generation': 0,
+            'count': 1,
+            'member_keys': True,
+        })
+
     def test_toggle_state(self):
         conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
         conv.is_state = mock.Mock(side_effect=[True, False])
@@ -541,6 +640,56 @@ class TestConversation(unittest.TestCase):
         conv.set_remote()
         assert not relation_set.called
 
+    @mock.patch.object(relations.hookenv, 'local_unit', lambda: 'local/0')
+    @mock.patch.object(relations.hookenv, 'relation_get')
+    @mock.patch.object(relations.hookenv, 'relation_set')
+    @mock.patch.object(relations.hookenv, 'atexit')
+    @mock.patch.object(relations, '_migrate_conversations')
+    @mock.patch.object(relations.hookenv, 'hook_name', lambda: 'config-changed')
+    @mock.patch.object(relations.Conversation, 'relation_ids', ['rel:1',
+                                                                'rel:2'])
+    def test_set_remote_buffered(self, _migrate, atexit, relation_set, relation_get):
+        self.addCleanup(relations._remote_writes.update, {
+            'buffered': False,
+            'pending': relations.OrderedDict(),
+        })
+        relations.RelationBase._startup()
+        atexit.assert_called_once_with(relations._flush_remote_writes)
+        conv = relations.Conversation('rel', ['service/0', 'service/1'], 'scope')
+
+        conv.set_remote('foo', 'bar')
+        conv.set_remote(port=80, host='h1')
+        conv.set_remote(host='h2', gone=None)
+        assert not relation_set.called
+
+        # values already known to be published are left out, but the
+        # published data isn't fetched just to check
+        relation_get.return_value = {'foo': 'bar', 'port': '80', 'host': 'h1'}
+        relations._remote_data('rel:1', 'local/0')
+        relation_get.reset_mock()
+
+        # setting data directly publishes what's buffered for the relation
+        # first, so that it isn't overwritten at exit
+        relations.hookenv.relation_set('rel:2', {'foo': 'direct'})
+        self.assertEqual(relation_set.call_args_list, [
+            mock.call('rel:2', {'foo': 'bar', 'port': 80, 'host': 'h2',
+                                'gone': None}),
+            mock.call('rel:2', {'foo': 'direct'}),
+        ])
+
+        relation_set.reset_mock()
+        relations._flush_remote_writes()
+        self.assertEqual(relation_set.call_args_list, [
+            mock.call('rel:1', {'host': 'h2'}),
+        ])
+        assert not relation_get.called
+        self.assertIs(relations.hookenv.relation_set, relation_set)
+
+        # once flushed, writes are no longer buffered
+        relation_set.reset_mock()
+        conv.set_remote('foo', 'bar')
+        relation_set.assert_any_call('rel:1', {'foo': 'bar'})
+
     @mock.patch.object(relations.hookenv, 'relation_get')
     @mock.patch.object(relations.hookenv, 'related_units')
     @mock.patch.object(relations.Conversation, 'relation_ids', ['rel:1',
@@ -552,13 +701,13 @@ class TestConversation(unittest.TestCase):
 
         # set on at least one remote
         related_units.side_effect = [['srv1/0', 'srv1/1'], ['srv2/1']]
-        relation_get.side_effect = [None, 'value']
+        relation_get.side_effect = [{'other': 'foo'}, {'key': 'value'}]
         self.assertEqual(conv.get_remote('key', 'default'), 'value')
         self.assertEqual(related_units.call_args_list, [mock.call('rel:1'),
                                                         mock.call('rel:2')])
         self.assertEqual(relation_get.call_args_list, [
-            mock.call('key', 'srv1/0', 'rel:1'),
-            mock.call('key', 'srv2/1', 'rel:2'),
+            mock.call(unit='srv1/0', rid='rel:1'),
+            mock.call(unit='srv2/1', rid='rel:2'),
         ])
 
         # not set on any remote
@@ -571,6 +720,36 @@ class TestConversation(unittest.TestCase):
         relation_get.side_effect = AssertionError('relation_get should not be called')
         self.assertEqual(conv.get_remote('key', 'default'), 'default')
 
+    @mock.patch.object(relations.hookenv, 'relation_get')
+    @mock.patch.object(relations.hookenv, 'related_units')
+    @mock.patch.object(relations.Conversation, 'relation_ids', ['rel:1',
+                                                                'rel:2'])
+    def test_get_remote_many(self, related_units, relation_get):
+        conv = relations.Conversation('rel',
+                                      ['srv1/0', 'srv2/0', 'srv2/1'],
+                                      'scope')
+        related_units.side_effect = lambda rid: {
+            'rel:1': ['srv1/0'],
+            'rel:2': ['srv2/0', 'srv2/1'],
+        }[rid]
+        relation_get.side_effect = lambda unit, rid: {
+            'srv1/0': {'host': 'h1', 'port': ''},
+            'srv2/0': {'port': '80'},
+            'srv2/1': {'user': 'u'},
+        }[unit]
+        self.assertEqual(conv.get_remote_many(['host', 'port'], 'default'), {
+            'host': 'h1',
+            'port': '80',
+        })
+        self.assertEqual(relation_get.call_args_list, [
+            mock.call(unit='srv1/0', rid='rel:1'),
+            mock.call(unit='srv2/0', rid='rel:2'),
+        ])
+        self.assertEqual(conv.get_remote_many(['host', 'pass'], 'default'), {
+            'host': 'h1',
+            'pass': 'default',
+        })
+
     @mock.patch.object(relations.hookenv, 'relation_get')
     @mock.patch.object(relations.hookenv, 'related_units')
     @mock.patch.object(relations.Conversation, 'relation_ids', ['rel:1',
@@ -584,14 +763,17 @@ class TestConversation(unittest.TestCase):
                                       ['srv1/0', 'srv2/0'],
                                       'scope')
 
-        related_units.side_effect = [['srv1/0'], ['srv2/0']]
-        relation_get.side_effect = [None, 'value']
+        rel2_units = []
+        related_units.side_effect = [['srv1/0'], rel2_units]
+        relation_get.side_effect = [{}, {'key': 'value'}]
         self.assertEqual(conv.get_remote('key', 'default'), 'value')
         self.assertEqual(related_units.call_args_list, [mock.call('rel:1'),
                                                         mock.call('rel:2')])
         self.assertEqual(relation_get.call_args_list,
-                         [mock.call('key', 'srv1/0', 'rel:1'),
-                          mock.call('key', 'srv2/0', 'rel:2')])
+                         [mock.call(unit='srv1/0', rid='rel:1'),
+                          mock.call(unit='srv2/0', rid='rel:2')])
+        # the (cached) list of related units is left alone
+        self.assertEqual(rel2_units, [])
 
     @mock.patch.object(relations.unitdata, 'kv')
     def test_set_local(self, kv):
@@ -618,86 +800,132 @@ class TestConversation(unittest.TestCase):
 
 
 class TestMigrateConvs(unittest.TestCase):
-    @mock.patch.object(relations, '_get_flag_value')
-    @mock.patch.object(relations, 'set_flag')
-    @mock.patch.object(relations, 'get_flags')
+    def setUp(self):
+        self.data = patch_kv(self)
+        self.kv = relations.unitdata.kv
+
     @mock.patch.object(relations, 'hookenv')
-    @mock.patch.object(relations.unitdata, 'kv')
-    def test_migrate(self, kv, mhookenv, get_flags, set_flag, _get_flag_value):
-        kv().getrange.side_effect = [
-            {'reactive.conversations.rel:0.service': {
+    def test_migrate(self, mhookenv):
+        self.data.update({
+            'reactive.conversations.rel:0.service': {
                 'namespace': 'rel:0',
-            }},
-            {'reactive.conversations.rel.global': {
+            },
+            'reactive.conversations.rel.global': {
                 'relation_name': 'rel',
                 'scope': 'global',
                 'units': ['service/0', 'service/1', 'service/3'],
-            }},
-            {'reactive.conversations.rel.service': {
+            },
+            'reactive.conversations.rel.service': {
                 'relation_name': 'rel',
                 'scope': 'service',
                 'units': ['service/0', 'service/1', 'service/3'],
-            }},
-            {'reactive.conversations.rel.service/3': {
+            },
+            'reactive.conversations.rel.service/3': {
                 'relation_name': 'rel',
                 'scope': 'service/3',
                 'units': ['service/3'],
-            }},
-        ]
+            },
+            'reactive.states.rel.joined': {
+                'relation': 'rel',
+                'conversations': ['reactive.conversations.rel.service'],
+            },
+            'reactive.states.rel.unit': {
+                'relation': 'rel',
+                'conversations': ['reactive.conversations.rel.service/3'],
+            },
+            'reactive.states.rel.none': {
+                'relation': 'rel',
+                'conversations': [],
+            },
+            'reactive.states.foo': None,
+        })
         mhookenv.relation_ids.return_value = ['rel:1', 'rel:2']
-        mhookenv.related_units.side_effect = [
-            ['service/0', 'service/2'], ['service/3'],
-            ['service/0', 'service/2'], ['service/3'],
-        ]
-        get_flags.side_effect = [['rel.joined', 'foo'], ['rel.joined', 'foo']]
-        _get_flag_value.side_effect = [
-            {'conversations': ['reactive.conversations.rel.service']},
-            None,
-            {'conversations': ['reactive.conversations.rel.service/3']},
-            {'conversations': []},
-        ]
-        relations._migrate_conversations()
-        assert not kv().set.called
+        units = {'rel:1': ['service/0', 'service/2'], 'rel:2': ['service/3']}
+        mhookenv.related_units.side_effect = units.get
 
-        kv().set.reset_mock()
         relations._migrate_conversations()
-        kv().set.assert_called_with('reactive.conversations.rel.global', {
-            'namespace': 'rel',
-            'scope': 'global',
-            'units': ['service/0', 'service/1', 'service/3'],
+        self.assertEqual(self.data, {
+            'reactive.conversations_schema': relations.CONVERSATION_SCHEMA,
+            'reactive.conversations.rel:0.service': {
+                'namespace': 'rel:0',
+            },
+            'reactive.conversations.rel.global': {
+                'namespace': 'rel',
+                'scope': 'global',
+                'units': ['service/0', 'service/1', 'service/3'],
+            },
+            'reactive.conversations.rel:1.service': {
+                'namespace': 'rel:1',
+                'scope': 'service',
+                'units': ['service/0'],
+            },
+            'reactive.conversations.rel:2.service': {
+                'namespace': 'rel:2',
+                'scope': 'service',
+                'units': ['service/3'],
+            },
+            'reactive.conversations.rel:2.service/3': {
+                'namespace': 'rel:2',
+                'scope': 'service/3',
+                'units': ['service/3'],
+            },
+            'reactive.states.rel.joined': {
+                'relation': 'rel',
+                'generation': 0,
+                'count': 2,
+                'member_keys': True,
+            },
+            'reactive.states.rel.unit': {
+                'relation': 'rel',
+                'generation': 0,
+                'count': 1,
+                'member_keys': True,
+            },
+            'reactive.states.rel.none': {
+                'relation': 'rel',
+                'generation': 0,
+                'count': 0,
+                'member_keys': True,
+            },
+            'reactive.states.foo': None,
+            'reactive.conversation_states.rel.joined.reactive.conversations.rel:1.service': 0,
+            'reactive.conversation_states.rel.joined.reactive.conversations.rel:2.service': 0,
+            'reactive.conversation_states.rel.unit.reactive.conversations.rel:2.service/3': 0,
         })
-        assert not kv().unset.called
-        assert not set_flag.called
 
-        kv().set.reset_mock()
+    def test_migrate_once(self):
         relations._migrate_conversations()
-        kv().set.assert_any_call('reactive.conversations.rel:1.service', {
-            'namespace': 'rel:1',
-            'scope': 'service',
-            'units': ['service/0'],
+        self.assertEqual(self.data, {
+            'reactive.conversations_schema': relations.CONVERSATION_SCHEMA,
         })
-        kv().set.assert_called_with('reactive.conversations.rel:2.service', {
-            'namespace': 'rel:2',
-            'scope': 'service',
-            'units': ['service/3'],
-        })
-        kv().unset.assert_called_with('reactive.conversations.rel.service')
-        set_flag.assert_called_with('rel.joined', {'conversations': [
-            'reactive.conversations.rel:1.service',
-            'reactive.conversations.rel:2.service',
-        ]})
-
-        kv().set.reset_mock()
+        self.kv().getrange.reset_mock()
         relations._migrate_conversations()
-        kv().set.assert_called_with('reactive.conversations.rel:2.service/3', {
-            'namespace': 'rel:2',
-            'scope': 'service/3',
-            'units': ['service/3'],
-        })
-        kv().unset.assert_called_with('reactive.conversations.rel.service/3')
-        set_flag.assert_called_with('rel.joined', {'conversations': [
-            'reactive.conversations.rel:2.service/3',
-        ]})
+        assert not self.kv().getrange.called
+
+
+def patch_kv(test):
+    """
+    Patch unitdata.kv() for the test case with a mock backed by a dict, which
+    is returned.
+    """
+    data = {}
+    kv_p = mock.patch.object(relations.unitdata, 'kv')
+    kv = kv_p.start()
+    test.addCleanup(kv_p.stop)
+    kv().get.side_effect = data.get
+    kv().set.side_effect = data.__setitem__
+    kv().unset.side_effect = lambda key: data.pop(key, None)
+
+    def getrange(prefix, strip=False):
+        return {(k[len(prefix):] if strip else k): v
+                for k, v in data.items() if k.startswith(prefix)}
+    kv().getrange.side_effect = getrange
+
+    def update(mapping, prefix=''):
+        for k, v in mapping.items():
+            data[prefix + k] = v
+    kv().update.side_effect = update
+    return data
 
 
 class TestRelationCall(unittest.TestCase):
@@ -0,0 +1,100 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from charmhelpers.core import unitdata
+from charms.reactive import storage
+
+
+class TestBufferedStorage(unittest.TestCase):
+    def setUp(self):
+        self.test_db_dir = tempfile.mkdtemp()
+        self.test_db = os.path.join(self.test_db_dir, 'test-state.db')
+        unitdata._KV = self.kv = unitdata.Storage(self.test_db)
+
+    def tearDown(self):
+        self.kv.close()
+        unitdata._KV = None
+        shutil.rmtree(self.test_db_dir)
+
+    def _stored(self):
+        self.kv.cursor.execute('select key from kv')
+        return sorted(row[0] for row in self.kv.cursor.fetchall())
+
+    def test_buffers_reactive_keys(self):
+        self.kv.set('reactive.states.old', None)
+        with storage.buffered_writes() as kv:
+            assert unitdata.kv() is kv
+            kv.set('reactive.states.foo', {'value': 1})
+            kv.update({'bar': None}, prefix='reactive.states.')
+            kv.unset('reactive.states.old')
+            kv.set('other', 'passed through')
+            self.assertEqual(self._stored(), ['other', 'reactive.states.old'])
+            self.assertEqual(kv.get('reactive.states.foo'), {'value': 1})
+            self.assertIsNone(kv.get('reactive.states.old'))
+            self.assertEqual(kv.getrange('reactive.states.', strip=True),
+                             {'foo': {'value': 1}, 'bar': None})
+        assert unitdata.kv() is self.kv
+        self.assertEqual(self._stored(), ['other',
+                                          'reactive.states.bar',
+                                          'reactive.states.foo'])
+        self.assertEqual(self.kv.get('reactive.states.foo'), {'value': 1})
+
+    def test_values_are_copies(self):
+        with storage.buffered_writes() as kv:
+            kv.set('reactive.foo', {'items': []})
+            kv.get('reactive.foo')['items'].append(1)
+            self.assertEqual(kv.get('reactive.foo'), {'items': []})
+
+    def test_discarded_on_error(self):
+        with self.assertRaises(ValueError):
+            with storage.buffered_writes() as kv:
+                kv.set('reactive.states.foo', None)
+                raise ValueError()
+        assert unitdata.kv() is self.kv
+        self.assertEqual(self._stored(), [])
+
+    def test_flush(self):
+        with storage.buffered_writes() as kv:
+            kv.set('reactive.states.foo', None)
+            kv.flush()
+            self.assertEqual(self._stored(), ['reactive.states.foo'])
+            kv.set('reactive.states.bar', None)
+            kv.flush(False)
+            self.assertEqual(self._stored(), ['reactive.states.foo'])
+            self.assertEqual(kv.get('reactive.states.bar', 'unset'), 'unset')
+
+    def test_revision_history(self):
+        with self.kv.hook_scope('install'):
+            with storage.buffered_writes() as kv:
+                kv.set('reactive.states.foo', True)
+            self.assertEqual(len(self.kv.gethistory('reactive.states.foo')), 1)
+
+    def test_nested(self):
+        with storage.buffered_writes() as outer:
+            with storage.buffered_writes() as inner:
+                assert inner is outer
+                inner.set('reactive.states.foo', None)
+            self.assertEqual(self._stored(), [])
+        self.assertEqual(self._stored(), ['reactive.states.foo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
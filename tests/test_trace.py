@@ -0,0 +1,179 @@
+# Copyright 2017 Canonical Limited.
+#
+# This file is part of charms.reactive.
+#
+# charms.reactive is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# charms.reactive is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with charm-helpers.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+from charms import reactive
+from charms.reactive import bus
+from charms.reactive import trace
+
+
+HANDLERS = '''\
+from charmhelpers.core import hookenv
+from charms.reactive import when, when_not, set_flag
+
+
+@when_not('first')
+def first():
+    if hookenv.relation_ids('db'):
+        set_flag('first')
+
+
+@when('first')
+@when_not('second')
+def second():
+    if hookenv.config()['enabled']:
+        set_flag('second')
+    hookenv.status_set('active', 'ready')
+'''
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.charm_dir = os.path.join(self.tmpdir, 'charm')
+        os.makedirs(os.path.join(self.charm_dir, 'reactive'))
+        with open(os.path.join(self.charm_dir, 'metadata.yaml'), 'w') as fp:
+            fp.write('name: test\n')
+        with open(os.path.join(self.charm_dir, 'reactive', 'traced.py'), 'w') as fp:
+            fp.write(HANDLERS)
+        self.trace_path = os.path.join(self.tmpdir, 'trace.json')
+
+        patch_env = mock.patch.dict(os.environ, {
+            'CHARM_DIR': self.charm_dir,
+            'JUJU_HOOK_NAME': 'config-changed',
+            'JUJU_UNIT_NAME': 'test/0',
+            'UNIT_STATE_DB': os.path.join(self.tmpdir, 'state.db'),
+        })
+        patch_env.start()
+        self.addCleanup(patch_env.stop)
+        for patcher in (mock.patch.object(hookenv, 'log'),
+                        mock.patch.object(hookenv, '_atstart',
+                                          list(hookenv._atstart))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self._reset)
+        self._reset()
+
+    def _reset(self):
+        if unitdata._KV:
+            unitdata._KV.conn.close()
+        unitdata._KV = None
+        bus.Handler.clear()
+        hookenv.cache.clear()
+        sys.modules.pop('reactive.traced', None)
+        sys.modules.pop('reactive', None)
+
+    def _run(self, env):
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(hookenv, 'relation_ids', return_value=['db:1']), \
+                mock.patch.object(hookenv, 'config', return_value={'enabled': True}), \
+                mock.patch.object(hookenv, 'status_set'):
+            reactive.main()
+        self._reset()
+
+    def _record(self):
+        self._run({trace.TRACE_ENV: self.trace_path})
+        return trace.load(self.trace_path)
+
+    def test_record(self):
+        recorded = self._record()
+        self.assertEqual(recorded['hook'], 'config-changed')
+        self.assertEqual(recorded['env']['CHARM_DIR'], self.charm_dir)
+        self.assertEqual(recorded['initial'], {})
+        self.assertEqual([(h['id'].split(':')[-1], h['set'], h['cleared'])
+                          for h in recorded['handlers']],
+                         [('first', ['first'], []),
+                          ('second', ['second'], [])])
+        self.assertEqual(recorded['calls'], {
+            '["relation_ids", ["db"], {}]': ['db:1'],
+            '["config", [], {}]': {'enabled': True},
+        })
+        self.assertEqual(recorded['writes'], [['status_set', ['active', 'ready'], {}]])
+        self.assertEqual(set(recorded['steps']),
+                         {'discover', '_run_atstart', 'dispatch', '_run_atexit',
+                          'total'})
+
+    def test_no_trace(self):
+        with mock.patch.object(trace.Recorder, 'start') as start:
+            self._run({})
+        assert not start.called
+        assert not os.path.exists(self.trace_path)
+
+    def test_replay(self):
+        recorded = self._record()
+        with mock.patch.object(hookenv, 'status_set') as status_set:
+            replayed = trace.replay(recorded)
+        assert not status_set.called
+        self.assertEqual(replayed['misses'], [])
+        self.assertEqual([h['id'] for h in replayed['handlers']],
+                         [h['id'] for h in recorded['handlers']])
+        self.assertEqual(replayed['handlers'][1]['set'], ['second'])
+        report = trace.compare(recorded, replayed)
+        self.assertIn('Handlers were invoked in the same order', report)
+
+    def test_replay_from_recorded_state(self):
+        first = self._record()
+        # the flags set by the first run are in the next trace, so replaying
+        # that has nothing left to do
+        second = self._record()
+        self.assertEqual({key for key in second['initial']
+                          if key.startswith('reactive.states.')},
+                         {'reactive.states.first', 'reactive.states.second'})
+        self.assertEqual(second['handlers'], [])
+        replayed = trace.replay(second)
+        self.assertEqual(replayed['handlers'], [])
+        self.assertIn('Handlers diverge at invocation 1',
+                      trace.compare(first, replayed))
+
+    def test_replay_config(self):
+        persistent = os.path.join(self.charm_dir, hookenv.Config.CONFIG_FILE_NAME)
+        with open(persistent, 'w') as fp:
+            fp.write('{"enabled": false}')
+        recorded = self._record()
+        self.assertEqual(recorded['previous_config'], {'enabled': False})
+
+        atexit = list(hookenv._atexit)
+        player = trace.Player(recorded, self.tmpdir)
+        player.start()
+        try:
+            config = hookenv.config()
+            assert config.changed('enabled')
+            self.assertEqual(config.previous('enabled'), False)
+            config['stored'] = 'value'
+            self.assertIs(hookenv.config(), config)
+            config.save()
+        finally:
+            player.stop()
+        self.assertEqual(hookenv._atexit, atexit)
+        self.assertEqual(config.path, os.path.join(self.tmpdir,
+                                                   hookenv.Config.CONFIG_FILE_NAME))
+        with open(persistent) as fp:
+            self.assertEqual(fp.read(), '{"enabled": false}')
+
+
+if __name__ == '__main__':
+    unittest.main()